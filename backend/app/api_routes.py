@@ -1,29 +1,38 @@
 import asyncio
 import json
 import logging
-import os
+import time
 from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks, Request
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-from .cache import get_cached, set_cached
+from .cache import get_cached, get_kb_version, set_cached
 from .config import settings
+from .embeddings import embed_query, get_embeddings_for_texts
 from .eval_monitor import log_query
 from .graph import check_pages_exist, clear_graph, get_all_page_nodes
+from .graph_expansion import request_graph_refresh
 from .guardrails import redact_pii
 from .ingestion import ingest_urls
 from .jobs import create_job, get_job_status
 from .llm import ask_llm
 from .llm_stream import stream_llm
+from .metadata_store import UnsupportedFilterError
 from .monitoring import CACHE_HITS, CACHE_MISSES
 from .retriever import hybrid_retrieve
-from .vectorstore_faiss_prod import reset_store # Import the async reset function
+from .semantic_cache import get_semantic_cache
+from .singleflight import SingleFlight, StreamFlight, flight_key
+from .vectorstore_faiss_prod import get_store, reset_store # Import the async reset function
 
 # --- Setup ---
 router = APIRouter()
 logger = logging.getLogger(__name__)
+# Identical concurrent chat queries share one retrieval and LLM call.
+_chat_flight = SingleFlight("chat")
+_chat_stream_flight = StreamFlight("chat_stream")
 
 
 # --- Pydantic Models ---
@@ -31,9 +40,24 @@ class CrawlRequest(BaseModel):
     urls: List[str]
     max_pages: Optional[int] = None
     max_depth: Optional[int] = None
+    # Re-crawl URLs already in the knowledge base, replacing their chunks.
+    refresh: bool = False
+
+class SearchFilters(BaseModel):
+    domain: Optional[str] = None  # also matches subdomains
+    url_prefix: Optional[str] = None
+    title: Optional[str] = None  # case-insensitive substring
+    ingested_after: Optional[float] = None  # unix timestamps
+    ingested_before: Optional[float] = None
 
 class ChatRequest(BaseModel):
     query: str
+    filters: Optional[SearchFilters] = None
+
+class RetrieveBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    filters: Optional[SearchFilters] = None
 
 
 # --- API Endpoints ---
@@ -41,9 +65,10 @@ class ChatRequest(BaseModel):
 @router.post('/crawl')
 async def crawl_endpoint(req: CrawlRequest, background_tasks: BackgroundTasks):
     """
-    Starts a crawl and ingestion job for new URLs, skipping existing ones.
+    Starts a crawl and ingestion job for new URLs, skipping existing ones
+    unless `refresh` is set, in which case their chunks are replaced.
     """
-    existing_urls = check_pages_exist(req.urls)
+    existing_urls = [] if req.refresh else check_pages_exist(req.urls)
     urls_to_crawl = [url for url in req.urls if url not in existing_urls]
     
     message = f"Skipped {len(existing_urls)} existing URL(s)."
@@ -101,19 +126,17 @@ async def reset_knowledge_base():
     """
     Deletes all data from Neo4j and the FAISS vector store, and resets the store connection.
     """
+    if settings.FAISS_MMAP_READONLY:
+        return {"status": "error", "message": "This worker serves a read-only index; reset through the writer process."}
+
     logger.warning("--- KNOWLEDGE BASE RESET INITIATED ---")
     
     clear_graph()
-    
-    faiss_index_path = settings.FAISS_INDEX_PATH
+    request_graph_refresh()
     
     try:
-        if os.path.exists(faiss_index_path):
-            os.remove(faiss_index_path)
-            logger.info(f"Deleted FAISS index file: {faiss_index_path}")
-        
-        # This is now an async function and must be awaited.
-        # It handles flushing Redis and resetting the in-memory store instance.
+        # Deletes the index snapshot and its sidecars, flushes Redis and
+        # resets the in-memory store instance.
         await reset_store()
 
     except Exception as e:
@@ -122,58 +145,134 @@ async def reset_knowledge_base():
 
     return {"status": "success", "message": "Knowledge base has been cleared."}
 
+@router.post('/vector_store/reload')
+async def reload_vector_store():
+    """
+    Hot-swaps a read-only worker to the latest published index snapshot.
+    """
+    reloaded = await asyncio.to_thread(get_store().reload_if_changed)
+    return {"status": "reloaded" if reloaded else "unchanged"}
+
+@router.get('/vector_store/stats')
+async def vector_store_stats(recall_sample: int = 32, k: int = 10):
+    """
+    Reports memory per vector for the active index layout and, unless
+    recall_sample is 0, its recall@k before and after exact re-scoring.
+    """
+    return await asyncio.to_thread(get_store().stats, recall_sample, k)
+
+@router.post('/retrieve_batch')
+async def retrieve_batch(req: RetrieveBatchRequest):
+    """
+    Dense retrieval for many queries at once, for offline evaluation and bulk
+    question answering. All queries are embedded together and searched with
+    one FAISS call.
+    """
+    if not req.queries:
+        return {"results": []}
+    embeddings = await asyncio.to_thread(get_embeddings_for_texts, req.queries)
+    results = await _filtered(get_store().search_batch(
+        embeddings, top_k=req.top_k, filters=_filter_dict(req.filters)
+    ))
+    return {"results": [{"query": q, "hits": hits} for q, hits in zip(req.queries, results)]}
+
 @router.post('/chat')
 async def chat_endpoint(req: ChatRequest):
     """
-    Handles a non-streaming chat request with caching.
+    Handles a non-streaming chat request with caching. Identical queries
+    arriving while one is being answered share its answer.
     """
-    cached = await get_cached(req.query)
+    filters = _filter_dict(req.filters)
+    cache_key = _cache_key(req.query, filters)
+    # Read before retrieval: an answer built while the KB changes is cached as already stale.
+    kb_version = await get_kb_version()
+    store_version = get_store().version
+    cached = await get_cached(cache_key, kb_version=kb_version)
     if cached:
         CACHE_HITS.inc()
         return {"from_cache": True, "answer": cached}
 
     CACHE_MISSES.inc()
+    result, coalesced = await _chat_flight.do(
+        flight_key(req.query, _filters_key(filters)),
+        lambda: _answer(req.query, filters, cache_key, kb_version, store_version),
+    )
+    return dict(result, coalesced=True) if coalesced else result
+
+async def _answer(query: str, filters: Optional[dict], cache_key: str, kb_version: int, store_version: int) -> dict:
+    # Rephrasings of a recent question get its answer without retrieval or an LLM call.
+    started = time.perf_counter()
+    semantic = get_semantic_cache()
+    q_emb = await embed_query(query) if semantic is not None else None
+    if q_emb is not None and q_emb.size:
+        hit = semantic.get(q_emb, _filters_key(filters), store_version)
+        if hit:
+            return {
+                "from_cache": True, "answer": hit["answer"], "sources": hit["sources"],
+                "semantic_match": {"query": hit["query"], "similarity": round(hit["similarity"], 4)},
+            }
+
+    rerank_info = {}
     # hybrid_retrieve is now an async function and must be awaited.
-    candidates = await hybrid_retrieve(req.query, top_k=5)
+    candidates = await _filtered(hybrid_retrieve(query, top_k=5, filters=filters, rerank_info=rerank_info))
 
     if not candidates:
         no_context_answer = "I'm sorry, but I couldn't find any relevant information in my knowledge base to answer that question. Please try rephrasing your query or adding more sources."
         return {"from_cache": False, "answer": no_context_answer, "sources": []}
 
     context = "\n\n".join([c.get('meta', {}).get('text', '')[:800] for c in candidates])
-    prompt = f"Use the following context to answer the question:\n{context}\n\nQuestion: {req.query}"
+    prompt = f"Use the following context to answer the question:\n{context}\n\nQuestion: {query}"
     answer = ask_llm(prompt)
     
-    await set_cached(req.query, answer, expire=3600)
+    await set_cached(cache_key, answer, expire=3600, kb_version=kb_version)
+    if q_emb is not None and q_emb.size:
+        semantic.put(q_emb, query, _filters_key(filters), store_version, answer, candidates, time.perf_counter() - started)
     
-    asyncio.create_task(_log_query_async(req.query, candidates, answer))
+    asyncio.create_task(_log_query_async(query, candidates, answer))
     
-    return {"from_cache": False, "answer": answer, "sources": candidates}
+    return {"from_cache": False, "answer": answer, "sources": candidates, "rerank": rerank_info}
 
 @router.post('/chat_stream')
 async def chat_stream(request: Request):
     """
-    Handles a streaming chat request.
+    Handles a streaming chat request. Identical queries arriving while one
+    is being answered follow its token stream instead of starting another.
     """
     body = await request.json()
     query = body.get('query')
-    
+    try:
+        filters = _filter_dict(SearchFilters(**body['filters'])) if body.get('filters') else None
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+    stream = await _chat_stream_flight.open(flight_key(query, _filters_key(filters)), lambda: _start_stream(query, filters))
+    return StreamingResponse(stream, media_type='text/plain')
+
+async def _start_stream(query: str, filters: Optional[dict]):
+    """Retrieves the context for a streamed answer and returns the stream to send."""
+    rerank_info = {}
     # hybrid_retrieve is now an async function and must be awaited.
-    candidates = await hybrid_retrieve(query, top_k=5)
+    candidates = await _filtered(hybrid_retrieve(query, top_k=5, filters=filters, rerank_info=rerank_info))
 
     if not candidates:
         async def no_context_stream():
             yield "I'm sorry, but I couldn't find any relevant information in my knowledge base to answer that question."
             footer = {'sources': [], 'hallucination_score': 0.0}
             yield '\n' + json.dumps(footer)
-        return StreamingResponse(no_context_stream(), media_type='text/plain')
+        return no_context_stream()
 
     context = "\n\n".join([c.get('meta', {}).get('text', '')[:800] for c in candidates])
     prompt = f"Use the following context to answer the question:\n{context}\n\nQuestion: {query}"
     
     async def event_stream():
         full_response_text = ""
-        for chunk in stream_llm(prompt):
+        # Tokens are pulled on a worker thread, so the event loop keeps
+        # serving (and attaching followers to) other requests meanwhile.
+        tokens = iter(stream_llm(prompt))
+        while True:
+            chunk = await asyncio.to_thread(next, tokens, None)
+            if chunk is None:
+                break
             safe_chunk = redact_pii(chunk)
             full_response_text += safe_chunk
             yield safe_chunk
@@ -186,13 +285,35 @@ async def chat_stream(request: Request):
             logger.error(f"Failed to calculate hallucination score: {e}")
             score = 0.0
             
-        footer = {'sources': candidates, 'hallucination_score': score}
+        footer = {'sources': candidates, 'hallucination_score': score, 'rerank': rerank_info}
         yield '\n' + json.dumps(footer)
 
-    return StreamingResponse(event_stream(), media_type='text/plain')
+    return event_stream()
 
 
 # --- Helper Functions ---
+def _filter_dict(filters: Optional[SearchFilters]) -> Optional[dict]:
+    """The set filter fields as a plain dict, or None when nothing is set."""
+    if filters is None:
+        return None
+    return filters.model_dump(exclude_none=True) or None
+
+def _filters_key(filters: Optional[dict]) -> str:
+    return json.dumps(filters, sort_keys=True) if filters else ""
+
+def _cache_key(query: str, filters: Optional[dict]) -> str:
+    """Answers to filtered queries are cached separately from unfiltered ones."""
+    if not filters:
+        return query
+    return f"{query}\n{_filters_key(filters)}"
+
+async def _filtered(search):
+    """Awaits a filtered search, turning unsupported filters into a 400."""
+    try:
+        return await search
+    except UnsupportedFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 async def _log_query_async(query, candidates, answer):
     """Helper to log queries without blocking the main request."""
     try:
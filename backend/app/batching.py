@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional
+
+from .monitoring import MICROBATCH_PROCESS_SECONDS, MICROBATCH_QUEUE_DELAY, MICROBATCH_REJECTED, MICROBATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatcherOverloaded(RuntimeError):
+    """Raised by submit() when accepting the items would exceed max_pending."""
+
+
+class MicroBatcher:
+    """
+    Collects work items submitted concurrently (from coroutines or threads)
+    and hands them to `process_batch` in batches on a dedicated worker thread.
+
+    A batch closes once it holds `max_batch_size` items or `max_wait_ms` after
+    its first item arrived, whichever comes first, so a lone request waits at
+    most one window. Items whose `group_key` differs (e.g. different search
+    parameters) are processed as separate calls within the same window.
+    `process_batch` receives a list of items and must return one result per
+    item, in order; if it raises, every item of that call fails with the error.
+
+    With `max_pending` set, at most that many items may wait for the worker;
+    submissions beyond it are rejected with BatcherOverloaded so callers can
+    shed load instead of queueing without bound.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        group_key: Optional[Callable[[Any], Hashable]] = None,
+        max_pending: int = 0,
+    ):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.group_key = group_key
+        self.max_pending = max_pending
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues an item and returns a future resolved with its result."""
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items: List[Any]) -> List[Future]:
+        """Queues all of the items, or none of them if that would exceed max_pending."""
+        with self._pending_lock:
+            if self.max_pending and self._pending + len(items) > self.max_pending:
+                MICROBATCH_REJECTED.labels(batcher=self.name).inc(len(items))
+                raise BatcherOverloaded(f"{self.name} batcher has {self._pending} items pending")
+            self._pending += len(items)
+        futures = []
+        now = time.monotonic()
+        for item in items:
+            future: Future = Future()
+            self._queue.put((item, future, now))
+            futures.append(future)
+        return futures
+
+    async def run(self, item: Any) -> Any:
+        """Awaitable form of submit() for use on the event loop."""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def close(self):
+        """Stops the worker once the items already queued have been processed."""
+        self._queue.put(_STOP)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                # Re-queue so the loop exits after this batch.
+                self._queue.put(_STOP)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            with self._pending_lock:
+                self._pending -= len(batch)
+            started = time.monotonic()
+            MICROBATCH_SIZE.labels(batcher=self.name).observe(len(batch))
+            for _, _, enqueued in batch:
+                MICROBATCH_QUEUE_DELAY.labels(batcher=self.name).observe(started - enqueued)
+
+            groups = defaultdict(list)
+            for entry in batch:
+                groups[self.group_key(entry[0]) if self.group_key else None].append(entry)
+            for entries in groups.values():
+                self._process(entries)
+
+    def _process(self, entries: list):
+        # Callers that gave up (e.g. a cancelled request) are dropped here.
+        entries = [entry for entry in entries if entry[1].set_running_or_notify_cancel()]
+        if not entries:
+            return
+        futures = [future for _, future, _ in entries]
+        started = time.perf_counter()
+        try:
+            results = self.process_batch([item for item, _, _ in entries])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            MICROBATCH_PROCESS_SECONDS.labels(batcher=self.name).observe(time.perf_counter() - started)
+        for future, result in zip(futures, results):
+            future.set_result(result)
@@ -0,0 +1,422 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+K1 = 1.2
+B = 0.75
+# Terms in more than this share of the chunks (stop words, in practice) are
+# skipped: their IDF is close to zero and their postings are the longest to
+# decode. A query of nothing else is left to the vector search. Smaller
+# indexes keep every term: in a one-site knowledge base the site's own name
+# is in most chunks, and there is little decoding to save anyway.
+MAX_DF_RATIO = 0.5
+MAX_DF_MIN_DOCS = 1000
+
+_TOKEN = re.compile(r"\w+(?:[.\-/:@#+]\w+)*")
+_PARTS = re.compile(r"[^0-9a-z]+")
+_MANIFEST = "manifest.json"
+_DELETED = "deleted.npy"
+_SEGMENT_ARRAYS = ("terms", "doc_offsets", "tf_offsets", "docs", "tfs", "doc_ids", "doc_lens")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens such as product codes, error
+    names or hostnames ("err_conn_reset", "x-200", "api.example.com") are
+    kept whole and also split into their parts, so either form matches.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = [part for part in _PARTS.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_varints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """LEB128-encodes unsigned integers; returns the bytes and each value's start offset."""
+    values = np.asarray(values, dtype="uint64")
+    sizes = np.ones(len(values), dtype="int64")
+    for shift in range(7, 64, 7):
+        sizes += values >= (np.uint64(1) << np.uint64(shift))
+    starts = np.cumsum(sizes) - sizes
+    out = np.zeros(int(sizes.sum()), dtype="uint8")
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        rows = np.flatnonzero(sizes > k)
+        byte = (values[rows] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (sizes[rows] > k + 1).astype("uint64") << np.uint64(7)
+        out[starts[rows] + k] = (byte | more).astype("uint8")
+    return out, starts
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Inverse of encode_varints(), vectorised over the whole buffer."""
+    data = np.asarray(data, dtype="uint8")
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    sizes = ends - starts + 1
+    values = np.zeros(len(ends), dtype="uint64")
+    for k in range(int(sizes.max()) if len(sizes) else 0):
+        rows = np.flatnonzero(sizes > k)
+        values[rows] |= (data[starts[rows] + k] & 0x7F).astype("uint64") << np.uint64(7 * k)
+    return values
+
+
+class _Segment:
+    """
+    An immutable block of the inverted index, read through memory maps.
+
+    Terms are 64-bit hashes in sorted order. Each term's postings are its
+    chunk ids (delta-encoded from the segment's lowest id) and term
+    frequencies, both LEB128 varints, located by the offset arrays.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        for name in _SEGMENT_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.base = int(self.doc_ids[0])
+
+    def find(self, h: int) -> int:
+        i = int(np.searchsorted(self.terms, np.uint64(h)))
+        return i if i < len(self.terms) and int(self.terms[i]) == h else -1
+
+    def df(self, i: int) -> int:
+        # One terminating byte per varint.
+        return int(np.count_nonzero(self.tfs[self.tf_offsets[i]:self.tf_offsets[i + 1]] < 0x80))
+
+    def postings(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        deltas = decode_varints(self.docs[self.doc_offsets[i]:self.doc_offsets[i + 1]])
+        tfs = decode_varints(self.tfs[self.tf_offsets[i]:self.tf_offsets[i + 1]])
+        return self.base + np.cumsum(deltas).astype("int64"), tfs.astype("float32")
+
+    def doc_lengths(self, ids: np.ndarray) -> np.ndarray:
+        return self.doc_lens[np.searchsorted(self.doc_ids, ids)].astype("float32")
+
+    def all_postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(term, chunk id, tf) for every posting, decoded in one pass (for merges)."""
+        deltas = decode_varints(self.docs)
+        tfs = decode_varints(self.tfs)
+        # Index of each term's first posting, from where its block starts.
+        bounds = np.searchsorted(np.flatnonzero(np.asarray(self.docs) < 0x80), np.asarray(self.doc_offsets))
+        counts = np.diff(bounds)
+        sums = np.cumsum(deltas)
+        first = bounds[:-1]
+        docs = self.base + (sums - np.repeat(sums[first] - deltas[first], counts)).astype("int64")
+        return np.repeat(np.asarray(self.terms), counts), docs, tfs
+
+
+def _write_segment(path: str, terms: np.ndarray, docs: np.ndarray, tfs: np.ndarray,
+                   doc_ids: np.ndarray, doc_lens: np.ndarray) -> None:
+    """Writes one segment from flat (term, chunk id, tf) postings, atomically."""
+    order = np.lexsort((docs, terms))
+    terms, docs, tfs = terms[order], docs[order], tfs[order]
+    unique_terms, first = np.unique(terms, return_index=True)
+    id_order = np.argsort(doc_ids)
+    doc_ids, doc_lens = doc_ids[id_order], doc_lens[id_order]
+
+    previous = np.empty_like(docs)
+    previous[1:] = docs[:-1]
+    previous[first] = doc_ids[0]
+    doc_bytes, doc_starts = encode_varints(docs - previous)
+    tf_bytes, tf_starts = encode_varints(tfs)
+
+    arrays = {
+        "terms": unique_terms.astype("uint64"),
+        "doc_offsets": np.append(doc_starts[first], len(doc_bytes)).astype("int64"),
+        "tf_offsets": np.append(tf_starts[first], len(tf_bytes)).astype("int64"),
+        "docs": doc_bytes,
+        "tfs": tf_bytes,
+        "doc_ids": doc_ids.astype("int64"),
+        "doc_lens": doc_lens.astype("uint32"),
+    }
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    os.replace(tmp_path, path)
+
+
+class Bm25Index:
+    """
+    A BM25 inverted index over chunk text, kept on disk under `path`.
+
+    New chunks go to an in-memory buffer that is written out as an immutable
+    segment every `flush_docs` chunks and on flush(); whenever `merge_factor`
+    segments of similar size accumulate they are merged into one, dropping
+    deleted chunks. A manifest lists the live segments and is replaced
+    atomically, so read-only workers map a consistent set with reload().
+    Deletions are kept as a sorted id set and filtered at query time until
+    the segment holding them is merged.
+
+    The buffer is not durable; after a crash, chunks above `max_id` are
+    re-added from the metadata store by the owner.
+    """
+
+    def __init__(self, path: str, read_only: bool = False, flush_docs: int = 20_000, merge_factor: int = 4):
+        self.path = path
+        self.read_only = read_only
+        self.flush_docs = max(1, flush_docs)
+        self.merge_factor = max(2, merge_factor)
+        self._lock = threading.Lock()
+        self._segments: List[_Segment] = []
+        self._manifest = {"segments": [], "next_segment": 0, "max_id": -1, "deleted_docs": 0, "deleted_length": 0}
+        self._deleted = np.empty(0, dtype="int64")
+        self._buffer: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+        self._buffer_lens: Dict[int, int] = {}
+        self._manifest_mtime = None
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.reload()
+
+    @property
+    def max_id(self) -> int:
+        return max(self._manifest["max_id"], max(self._buffer_lens, default=-1))
+
+    def _stats(self) -> Tuple[int, float]:
+        docs = sum(s["docs"] for s in self._manifest["segments"]) + len(self._buffer_lens)
+        length = sum(s["length"] for s in self._manifest["segments"]) + sum(self._buffer_lens.values())
+        docs -= self._manifest["deleted_docs"]
+        length -= self._manifest["deleted_length"]
+        return docs, (length / docs if docs > 0 else 1.0)
+
+    def reload(self) -> bool:
+        """(Re)loads the manifest and maps its segments if it changed on disk."""
+        manifest_path = os.path.join(self.path, _MANIFEST)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+        segments = [_Segment(os.path.join(self.path, s["name"])) for s in manifest["segments"]]
+        deleted_path = os.path.join(self.path, _DELETED)
+        deleted = np.load(deleted_path) if os.path.exists(deleted_path) else np.empty(0, dtype="int64")
+        with self._lock:
+            self._manifest, self._segments, self._deleted = manifest, segments, deleted
+            self._manifest_mtime = mtime
+        return True
+
+    def add(self, ids: np.ndarray, texts: List[str]) -> None:
+        for chunk_id, text in zip(np.asarray(ids).tolist(), texts):
+            tokens = tokenize(text or "")
+            counts = Counter(term_hash(t) for t in tokens)
+            with self._lock:
+                for h, tf in counts.items():
+                    self._buffer[h].append((chunk_id, tf))
+                self._buffer_lens[chunk_id] = len(tokens)
+        if len(self._buffer_lens) >= self.flush_docs:
+            self.flush()
+
+    def delete(self, ids: np.ndarray) -> None:
+        """Marks documents deleted. Ids it does not hold are ignored, so replaying a deletion is harmless."""
+        ids = np.setdiff1d(np.asarray(ids, dtype="int64"), self._deleted)
+        if not len(ids):
+            return
+        present = [ids[np.isin(ids, list(self._buffer_lens))]] if self._buffer_lens else []
+        lengths = sum(self._buffer_lens[i] for i in present[0].tolist()) if present else 0.0
+        for segment in self._segments:
+            inside = ids[np.isin(ids, segment.doc_ids)]
+            lengths += float(segment.doc_lengths(inside).sum())
+            present.append(inside)
+        ids = np.unique(np.concatenate(present)) if present else ids[:0]
+        if not len(ids):
+            return
+        with self._lock:
+            self._deleted = np.union1d(self._deleted, ids)
+            self._manifest["deleted_docs"] += len(ids)
+            self._manifest["deleted_length"] += int(lengths)
+
+    def flush(self) -> None:
+        """Writes the buffer as a segment, merges segment tiers and publishes the manifest."""
+        if self.read_only:
+            return
+        with self._lock:
+            buffer, lens = self._buffer, self._buffer_lens
+            self._buffer, self._buffer_lens = defaultdict(list), {}
+            # Chunks deleted while still buffered never reach disk.
+            dropped = np.intersect1d(self._deleted, np.fromiter(lens, dtype="int64", count=len(lens)))
+            if len(dropped):
+                self._forget_deleted(dropped, sum(lens[i] for i in dropped.tolist()))
+            manifest = dict(self._manifest)
+        dropped_set = set(dropped.tolist())
+        live = {i: n for i, n in lens.items() if i not in dropped_set}
+        if live:
+            terms, docs, tfs = [], [], []
+            for h, postings in buffer.items():
+                for chunk_id, tf in postings:
+                    if chunk_id not in dropped_set:
+                        terms.append(h)
+                        docs.append(chunk_id)
+                        tfs.append(tf)
+            name = f"seg_{manifest['next_segment']:06d}"
+            _write_segment(
+                os.path.join(self.path, name),
+                np.array(terms, dtype="uint64"), np.array(docs, dtype="int64"), np.array(tfs, dtype="uint64"),
+                np.fromiter(live, dtype="int64", count=len(live)), np.fromiter(live.values(), dtype="int64", count=len(live)),
+            )
+            segment = _Segment(os.path.join(self.path, name))
+            with self._lock:
+                self._manifest["segments"] = self._manifest["segments"] + [
+                    {"name": name, "docs": len(live), "length": int(sum(live.values()))}
+                ]
+                self._manifest["next_segment"] += 1
+                self._manifest["max_id"] = max(self._manifest["max_id"], max(live))
+                self._segments = self._segments + [segment]
+        while self._merge_one_tier():
+            pass
+        self._publish()
+
+    def _forget_deleted(self, ids: np.ndarray, length: int) -> None:
+        """Drops ids that no longer exist anywhere from the deleted set. Caller holds _lock."""
+        self._deleted = np.setdiff1d(self._deleted, ids)
+        self._manifest["deleted_docs"] -= len(ids)
+        self._manifest["deleted_length"] -= int(length)
+
+    def _merge_one_tier(self) -> bool:
+        tiers = defaultdict(list)
+        for position, entry in enumerate(self._manifest["segments"]):
+            tier = int(math.log(max(entry["docs"], 1) / self.flush_docs, self.merge_factor)) if entry["docs"] > self.flush_docs else 0
+            tiers[tier].append(position)
+        positions = next((p for _, p in sorted(tiers.items()) if len(p) >= self.merge_factor), None)
+        if positions is None:
+            return False
+        positions = positions[:self.merge_factor]
+        merging = [self._segments[p] for p in positions]
+        deleted = self._deleted
+
+        parts = [segment.all_postings() for segment in merging]
+        terms = np.concatenate([p[0] for p in parts])
+        docs = np.concatenate([p[1] for p in parts])
+        tfs = np.concatenate([p[2] for p in parts])
+        doc_ids = np.concatenate([np.asarray(s.doc_ids) for s in merging])
+        doc_lens = np.concatenate([np.asarray(s.doc_lens) for s in merging]).astype("int64")
+        gone = np.isin(doc_ids, deleted)
+        keep = ~np.isin(docs, deleted)
+
+        name = f"seg_{self._manifest['next_segment']:06d}"
+        if (~gone).any():
+            _write_segment(os.path.join(self.path, name), terms[keep], docs[keep], tfs[keep], doc_ids[~gone], doc_lens[~gone])
+            merged = [_Segment(os.path.join(self.path, name))]
+            merged_entry = [{"name": name, "docs": int((~gone).sum()), "length": int(doc_lens[~gone].sum())}]
+        else:
+            merged, merged_entry = [], []
+
+        with self._lock:
+            first = positions[0]
+            entries = [e for i, e in enumerate(self._manifest["segments"]) if i not in positions]
+            segments = [s for i, s in enumerate(self._segments) if i not in positions]
+            insert_at = sum(1 for i in range(first) if i not in positions)
+            self._manifest["segments"] = entries[:insert_at] + merged_entry + entries[insert_at:]
+            self._manifest["next_segment"] += 1
+            self._segments = segments[:insert_at] + merged + segments[insert_at:]
+            self._forget_deleted(doc_ids[gone], int(doc_lens[gone].sum()))
+        logger.info(f"Merged {len(merging)} BM25 segments into {name} ({int((~gone).sum())} chunks).")
+        return True
+
+    def _publish(self) -> None:
+        with self._lock:
+            manifest = json.loads(json.dumps(self._manifest))
+            deleted = self._deleted
+        live = {entry["name"] for entry in manifest["segments"]}
+        tmp_path = os.path.join(self.path, _DELETED + ".tmp")
+        with open(tmp_path, "wb") as fh:
+            np.save(fh, deleted)
+        os.replace(tmp_path, os.path.join(self.path, _DELETED))
+        tmp_path = os.path.join(self.path, _MANIFEST + ".tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(manifest, fh)
+        os.replace(tmp_path, os.path.join(self.path, _MANIFEST))
+        self._manifest_mtime = os.stat(os.path.join(self.path, _MANIFEST)).st_mtime_ns
+        # Segments merged away are unlinked; mappings still open stay valid.
+        for name in os.listdir(self.path):
+            if name.startswith("seg_") and name not in live:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def search(self, query: str, top_k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the ids and BM25 scores of the top_k chunks for the query, best first."""
+        hashes = list(dict.fromkeys(term_hash(t) for t in tokenize(query)))
+        with self._lock:
+            segments = self._segments
+            deleted = self._deleted
+            buffered = {h: list(self._buffer.get(h, ())) for h in hashes}
+            buffer_lens = self._buffer_lens if any(buffered.values()) else {}
+            if buffer_lens:
+                buffer_lens = dict(buffer_lens)
+            n_docs, avgdl = self._stats()
+        if not hashes or n_docs <= 0:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        found = {}
+        for h in hashes:
+            hits = [(segment, i) for segment in segments for i in [segment.find(h)] if i >= 0]
+            df = sum(segment.df(i) for segment, i in hits) + len(buffered[h])
+            if df:
+                found[h] = (hits, df)
+        if not found:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        rare = found
+        if n_docs >= MAX_DF_MIN_DOCS:
+            rare = {h: v for h, v in found.items() if v[1] <= MAX_DF_RATIO * n_docs}
+        if not rare:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        all_ids, all_scores = [], []
+        for h, (hits, df) in rare.items():
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for segment, i in hits:
+                ids, tfs = segment.postings(i)
+                all_ids.append(ids)
+                all_scores.append(idf * _tf_weight(tfs, segment.doc_lengths(ids), avgdl))
+            if buffered[h]:
+                ids = np.array([p[0] for p in buffered[h]], dtype="int64")
+                tfs = np.array([p[1] for p in buffered[h]], dtype="float32")
+                lens = np.array([buffer_lens[i] for i in ids.tolist()], dtype="float32")
+                all_ids.append(ids)
+                all_scores.append(idf * _tf_weight(tfs, lens, avgdl))
+
+        ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+        ids, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=scores).astype("float32")
+        keep = np.ones(len(ids), dtype=bool)
+        if len(deleted):
+            keep &= ~np.isin(ids, deleted, assume_unique=True)
+        if allowed is not None:
+            keep &= np.isin(ids, allowed, assume_unique=True)
+        ids, scores = ids[keep], scores[keep]
+        if len(ids) > top_k:
+            part = np.argpartition(-scores, top_k - 1)[:top_k]
+            ids, scores = ids[part], scores[part]
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order]
+
+    @staticmethod
+    def remove_files(path: str) -> None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _tf_weight(tfs: np.ndarray, lengths: np.ndarray, avgdl: float) -> np.ndarray:
+    return tfs * (K1 + 1.0) / (tfs + K1 * (1.0 - B + B * lengths / avgdl))
@@ -4,6 +4,9 @@ from redis.exceptions import ConnectionError as RedisConnectionError
 import json
 import os
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from .config import settings
 import logging
 
@@ -11,6 +14,13 @@ logger = logging.getLogger(__name__)
 
 _redis_client = None
 _sql_conn = None
+_sql_lock = threading.Lock()
+_sql_writes = 0
+
+KB_VERSION_KEY = "kb_version"
+# The knowledge-base version as last read, and when.
+_kb_version = None
+_kb_version_checked = 0.0
 
 async def get_redis():
     """
@@ -55,39 +65,192 @@ def sqlite_setup():
     """
     global _sql_conn
     if _sql_conn is None:
-        _sql_conn = sqlite3.connect('cache.db', check_same_thread=False)
+        _sql_conn = sqlite3.connect(settings.ANSWER_CACHE_PATH, check_same_thread=False)
         c = _sql_conn.cursor()
         c.execute('CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, v TEXT)')
+        columns = {row[1] for row in c.execute('PRAGMA table_info(cache)')}
+        if 'expires' not in columns:
+            # Rows from before TTLs were stored never expire by time; size eviction still applies.
+            c.execute('ALTER TABLE cache ADD COLUMN expires REAL')
+        c.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+        c.execute('CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v INTEGER)')
         _sql_conn.commit()
     return _sql_conn
 
-async def get_cached(key: str):
+
+class MemoryTier:
     """
-    Asynchronously gets a value from the Redis cache, with SQLite fallback.
+    A bounded in-process LRU with per-entry expiry, in front of Redis or
+    SQLite, so repeated hits never leave the process.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, value, expires_at):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_memory = MemoryTier(settings.ANSWER_CACHE_MEMORY_SIZE)
+
+
+def _read_sql_version() -> int:
+    row = sqlite_setup().execute('SELECT v FROM meta WHERE k=?', (KB_VERSION_KEY,)).fetchone()
+    return row[0] if row else 0
+
+
+async def get_kb_version() -> int:
+    """
+    The knowledge-base version, shared by all workers through Redis (or the
+    SQLite file). Re-read at most every KB_VERSION_CHECK_SECONDS, so cache
+    hits usually need no round trip; a new version empties the memory tier.
+    """
+    global _kb_version, _kb_version_checked
+    now = time.monotonic()
+    if _kb_version is None or now - _kb_version_checked >= settings.KB_VERSION_CHECK_SECONDS:
+        r = await get_redis()
+        if r:
+            version = int(await r.get(KB_VERSION_KEY) or 0)
+        else:
+            with _sql_lock:
+                version = _read_sql_version()
+        _set_kb_version(version, now)
+    return _kb_version
+
+
+def _set_kb_version(version: int, checked: float):
+    global _kb_version, _kb_version_checked
+    if version != _kb_version:
+        _memory.clear()
+    _kb_version, _kb_version_checked = version, checked
+
+
+async def bump_kb_version() -> int:
+    """
+    Marks the knowledge base as changed: answers cached under earlier
+    versions are never served again. Called on every upsert and reset.
     """
     r = await get_redis()
     if r:
-        val = await r.get(key)
-        return json.loads(val) if val else None
-    
+        version = await r.incr(KB_VERSION_KEY)
+    else:
+        with _sql_lock:
+            conn = sqlite_setup()
+            conn.execute('INSERT OR IGNORE INTO meta (k, v) VALUES (?, 0)', (KB_VERSION_KEY,))
+            conn.execute('UPDATE meta SET v = v + 1 WHERE k=?', (KB_VERSION_KEY,))
+            conn.commit()
+            version = _read_sql_version()
+    _set_kb_version(version, time.monotonic())
+    return version
+
+
+async def reset_cache():
+    """
+    Empties every cache tier. Redis is flushed entirely (it also holds the
+    metadata store when configured), but the version counter carries on, so
+    answers cached by other workers before the reset stay unreachable.
+    """
+    version = await get_kb_version()
+    r = await get_redis()
+    if r:
+        await r.flushdb()
+        await r.set(KB_VERSION_KEY, version)
+    else:
+        with _sql_lock:
+            sqlite_setup().execute('DELETE FROM cache')
+            sqlite_setup().commit()
+    _memory.clear()
+    await bump_kb_version()
+
+
+def _versioned(key: str, version: int) -> str:
+    return f"answer:v{version}:{key}"
+
+
+async def get_cached(key: str, kb_version: int = None):
+    """
+    Gets a cached answer for `kb_version` (default: the current knowledge-base
+    version): from the in-process tier, else from Redis (or the SQLite fallback).
+    """
+    key = _versioned(key, await get_kb_version() if kb_version is None else kb_version)
+    value = _memory.get(key)
+    if value is not None:
+        return value
+
+    r = await get_redis()
+    if r:
+        val, ttl = await r.pipeline().get(key).ttl(key).execute()
+        if not val:
+            return None
+        value = json.loads(val)
+        _memory.put(key, value, time.time() + ttl if ttl > 0 else None)
+        return value
+
     # Fallback to SQLite
-    conn = sqlite_setup()
-    cur = conn.cursor()
-    cur.execute('SELECT v FROM cache WHERE k=?', (key,))
-    row = cur.fetchone()
-    return json.loads(row[0]) if row else None
+    with _sql_lock:
+        row = sqlite_setup().execute('SELECT v, expires FROM cache WHERE k=?', (key,)).fetchone()
+    if not row or (row[1] is not None and row[1] <= time.time()):
+        return None
+    value = json.loads(row[0])
+    _memory.put(key, value, row[1])
+    return value
 
-async def set_cached(key: str, value, expire: int = None):
+
+async def set_cached(key: str, value, expire: int = None, kb_version: int = None):
     """
-    Asynchronously sets a value in the Redis cache, with SQLite fallback.
+    Caches an answer in the in-process tier and in Redis (or SQLite),
+    expiring after `expire` seconds. Pass the `kb_version` read before the
+    answer was computed; an answer built while the knowledge base changed is
+    then filed under the old version and never served.
     """
+    key = _versioned(key, await get_kb_version() if kb_version is None else kb_version)
+    expires_at = time.time() + expire if expire else None
+    _memory.put(key, value, expires_at)
+
     r = await get_redis()
     if r:
         await r.set(key, json.dumps(value), ex=expire)
         return
-    
+
     # Fallback to SQLite
-    conn = sqlite_setup()
-    cur = conn.cursor()
-    cur.execute('REPLACE INTO cache (k,v) VALUES (?,?)', (key, json.dumps(value)))
-    conn.commit()
\ No newline at end of file
+    global _sql_writes
+    with _sql_lock:
+        conn = sqlite_setup()
+        conn.execute('REPLACE INTO cache (k, v, expires) VALUES (?, ?, ?)', (key, json.dumps(value), expires_at))
+        _sql_writes += 1
+        if _sql_writes % 100 == 0:
+            _evict_sql(conn)
+        conn.commit()
+
+
+def _evict_sql(conn):
+    """Drops expired rows, then the oldest writes beyond ANSWER_CACHE_SQLITE_MAX_ROWS."""
+    conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+    # REPLACE gives a row a new rowid, so low rowids are the least recently written.
+    conn.execute(
+        'DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY rowid DESC LIMIT -1 OFFSET ?)',
+        (settings.ANSWER_CACHE_SQLITE_MAX_ROWS,),
+    )
@@ -14,6 +14,31 @@ class Settings(BaseSettings):
 
     CRAWL_DEFAULT_MAX_PAGES: int = 20
     CRAWL_DEFAULT_MAX_DEPTH: int = 2
+    # The crawlers fetch with CRAWL_CONCURRENCY workers at once, at most
+    # CRAWL_PER_HOST_CONCURRENCY of them on the same host. Fetches on a host
+    # are spaced CRAWL_HOST_DELAY_SECONDS apart on average by a token bucket
+    # holding up to CRAWL_HOST_BURST fetches.
+    CRAWL_CONCURRENCY: int = 8
+    CRAWL_PER_HOST_CONCURRENCY: int = 2
+    CRAWL_HOST_DELAY_SECONDS: float = 0.5
+    CRAWL_HOST_BURST: int = 1
+    # robots.txt is fetched once per site and cached for
+    # CRAWL_ROBOTS_TTL_SECONDS; its rules for CRAWL_ROBOTS_USER_AGENT decide
+    # which URLs are skipped, and its Crawl-delay can only slow a host down.
+    CRAWL_RESPECT_ROBOTS: bool = True
+    CRAWL_ROBOTS_USER_AGENT: str = "WebGraphRAG"
+    CRAWL_ROBOTS_TTL_SECONDS: int = 3600
+    # A 429 or 503 pauses the host for Retry-After, or else for
+    # CRAWL_BACKOFF_BASE_SECONDS doubling per consecutive throttle (at most
+    # CRAWL_BACKOFF_MAX_SECONDS), halves its rate, and retries the URL up to
+    # CRAWL_MAX_RETRIES times.
+    CRAWL_BACKOFF_BASE_SECONDS: float = 2.0
+    CRAWL_BACKOFF_MAX_SECONDS: float = 120.0
+    CRAWL_MAX_RETRIES: int = 3
+    # Only successful fetches count toward a crawl's max_pages; a crawl gives
+    # up after CRAWL_MAX_FAILURES failed ones (errors, non-2xx responses,
+    # throttled URLs out of retries).
+    CRAWL_MAX_FAILURES: int = 50
 
     # --- THIS SECTION IS CRITICAL ---
     # You MUST declare the variables here.
@@ -22,6 +47,86 @@ class Settings(BaseSettings):
     FAISS_META_DB_PATH: str = os.path.join(DATA_DIR, "faiss_meta.db")
     # --- END OF CRITICAL SECTION ---
 
+    # --- Vector log & snapshots ---
+    # Upserts are appended to the log; the full index is only rewritten when
+    # the log outgrows FAISS_SNAPSHOT_MAX_WAL_BYTES or on the snapshot interval.
+    FAISS_WAL_PATH: str = os.path.join(DATA_DIR, "faiss.wal")
+    FAISS_SNAPSHOT_MAX_WAL_BYTES: int = 64 * 1024 * 1024
+    FAISS_SNAPSHOT_INTERVAL_SECONDS: int = 300
+
+    # Read-only query workers: map the snapshot with mmap instead of loading
+    # it, never ingest, and hot-swap to newer snapshots as the writer
+    # publishes them (checked every FAISS_RELOAD_INTERVAL_SECONDS).
+    FAISS_MMAP_READONLY: bool = False
+    FAISS_RELOAD_INTERVAL_SECONDS: int = 30
+
+    # Chunk metadata backend: "local" keeps it in FAISS_META_DB_PATH (SQLite)
+    # with chunk text in FAISS_META_TEXT_PATH (FAISS_META_TEXT_PATH.<n> once
+    # compacted); "redis" uses meta:{id} keys. "auto" picks local, except
+    # for an index created before the local store existed (FAISS_INDEX_PATH
+    # present, FAISS_META_DB_PATH absent), whose metadata is still in Redis.
+    METADATA_BACKEND: str = "auto"
+    FAISS_META_TEXT_PATH: str = os.path.join(DATA_DIR, "faiss_meta.text")
+
+    # --- Vector index layout ---
+    # One of "flat", "ivf_flat", "ivf_pq" or "hnsw". ANN layouts start out as a
+    # flat index and are rebuilt in the background once the index holds
+    # FAISS_ANN_MIN_VECTORS vectors.
+    FAISS_INDEX_TYPE: str = "flat"
+    # Vector codes held in RAM: "float32", "sq8", "pq" or "binary" (flat only).
+    # Lossy codecs also wait for FAISS_ANN_MIN_VECTORS before the rebuild and
+    # re-score FAISS_RESCORE_OVERSAMPLE x top_k candidates with the exact
+    # vectors kept in FAISS_VECTORS_PATH.
+    FAISS_VECTOR_CODEC: str = "float32"
+    FAISS_RESCORE_OVERSAMPLE: int = 4
+    FAISS_VECTORS_PATH: str = os.path.join(DATA_DIR, "faiss.vectors")
+    FAISS_ANN_MIN_VECTORS: int = 100_000
+    FAISS_TRAIN_SAMPLE_SIZE: int = 200_000
+    FAISS_IVF_NLIST: int = 4096
+    FAISS_PQ_M: int = 48
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    # Query-time defaults, overridable per search call.
+    FAISS_NPROBE: int = 32
+    FAISS_EF_SEARCH: int = 128
+    # Re-crawled pages replace their old chunks. Removed vectors stay in the
+    # vector file (and in HNSW graphs, masked at query time) until a
+    # background compaction, which runs once they reach
+    # FAISS_COMPACT_REMOVED_RATIO of the stored vectors and at least
+    # FAISS_COMPACT_MIN_REMOVED of them.
+    FAISS_COMPACT_REMOVED_RATIO: float = 0.2
+    FAISS_COMPACT_MIN_REMOVED: int = 1000
+    # Filtered searches matching at most this many chunks score them exactly
+    # from the vector file; larger matches search the index through a bitmap
+    # ID selector.
+    FAISS_FILTER_EXACT_MAX: int = 20_000
+    # Concurrent searches are gathered for up to SEARCH_BATCH_WAIT_MS (or
+    # SEARCH_BATCH_MAX_SIZE queries) and run as one FAISS call off the event
+    # loop.
+    SEARCH_BATCH_MAX_SIZE: int = 64
+    SEARCH_BATCH_WAIT_MS: float = 2.0
+
+    # --- Lexical (BM25) index ---
+    # Chunk text is also indexed for BM25 under BM25_INDEX_DIR: immutable,
+    # memory-mapped segments with varint-compressed postings, written every
+    # BM25_FLUSH_DOCS chunks and with each snapshot, and merged once
+    # BM25_MERGE_FACTOR segments of similar size pile up. hybrid_retrieve
+    # fuses BM25 and vector hits by reciprocal rank (1 / (HYBRID_RRF_K + rank)).
+    BM25_ENABLED: bool = True
+    BM25_INDEX_DIR: str = os.path.join(DATA_DIR, "bm25")
+    BM25_FLUSH_DOCS: int = 20_000
+    BM25_MERGE_FACTOR: int = 4
+    HYBRID_RRF_K: int = 60
+    # Fused candidates are diversified before reranking by maximal marginal
+    # relevance (MMR_LAMBDA weighs relevance against similarity to the chunks
+    # already chosen). Chunks with a cosine similarity of at least
+    # MMR_DUPLICATE_THRESHOLD to a chosen one are dropped as near-duplicates,
+    # and at most MMR_MAX_PER_PAGE chunks of a page are kept (0: no cap).
+    MMR_ENABLED: bool = True
+    MMR_LAMBDA: float = 0.7
+    MMR_DUPLICATE_THRESHOLD: float = 0.95
+    MMR_MAX_PER_PAGE: int = 3
+
     USE_OPENAI: bool = False
     OPENAI_API_KEY: Optional[str] = None
     USE_LLAMA_CPP: bool = False
@@ -35,6 +140,105 @@ class Settings(BaseSettings):
     OPENAI_MODEL: str = "gpt-4o-mini"
     GOOGLE_MODEL: str = "gemini-1.5-flash"
     EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # Chunk embeddings keyed by (model, normalised text hash), so boilerplate
+    # repeated across pages is only embedded once.
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = os.path.join(DATA_DIR, "embedding_cache.db")
+    # Chat queries: an LRU of recent query embeddings, and a micro-batcher
+    # that encodes concurrent queries in one forward pass off the event loop.
+    QUERY_EMBEDDING_CACHE_SIZE: int = 4096
+    QUERY_EMBED_BATCH_MAX_SIZE: int = 32
+    QUERY_EMBED_BATCH_WAIT_MS: float = 3.0
+    # Ingestion embeds chunks in EMBEDDING_WORKERS processes, each with its
+    # own model on EMBEDDING_WORKER_THREADS threads (pinned to its own cores
+    # with EMBEDDING_WORKER_PIN_CPUS). At most EMBEDDING_POOL_MAX_PENDING
+    # batches are in flight (0 means twice the worker count). With 0 workers
+    # chunks are embedded on a thread of the API process.
+    EMBEDDING_WORKERS: int = 0
+    EMBEDDING_WORKER_THREADS: int = 1
+    EMBEDDING_WORKER_PIN_CPUS: bool = False
+    EMBEDDING_POOL_MAX_PENDING: int = 0
+
+    # --- Inference backend ---
+    # "torch" runs the sentence-transformers models as-is; "onnx" exports the
+    # embedding model and cross-encoder to ONNX once (int8-quantised when
+    # ONNX_QUANTIZE), caches them under ONNX_CACHE_DIR and serves them with
+    # ONNX Runtime on ONNX_NUM_THREADS threads. An export that falls short of
+    # the parity thresholds against PyTorch is not used.
+    INFERENCE_BACKEND: str = "torch"
+    ONNX_QUANTIZE: bool = True
+    ONNX_CACHE_DIR: str = os.path.join(DATA_DIR, "onnx_models")
+    ONNX_NUM_THREADS: int = 4
+    ONNX_PARITY_CHECK: bool = True
+    ONNX_PARITY_MIN_COSINE: float = 0.98
+    ONNX_PARITY_MIN_RANK_CORRELATION: float = 0.9
+
+    # --- Reranker ---
+    # Cross-encoder scores are cached per (normalised query, chunk uuid) for
+    # RERANK_CACHE_TTL_SECONDS in an LRU of RERANK_CACHE_SIZE entries, and
+    # also in Redis (shared by all workers) with RERANK_CACHE_REDIS.
+    RERANK_CACHE_ENABLED: bool = True
+    RERANK_CACHE_SIZE: int = 50_000
+    RERANK_CACHE_TTL_SECONDS: int = 3600
+    RERANK_CACHE_REDIS: bool = False
+    # Each request reranks as many of its top_k * RERANK_MAX_CANDIDATE_FACTOR
+    # vector candidates as fit in RERANK_LATENCY_BUDGET_MS, in rounds of
+    # RERANK_BATCH_SIZE, stopping once a round leaves the top_k unchanged.
+    # A vector score gap of RERANK_SKIP_MARGIN at the top_k boundary skips
+    # the cross-encoder (0 disables the shortcut).
+    RERANK_LATENCY_BUDGET_MS: float = 150.0
+    RERANK_MAX_CANDIDATE_FACTOR: int = 3
+    RERANK_BATCH_SIZE: int = 8
+    RERANK_SKIP_MARGIN: float = 0.15
+    # Pairs from concurrent requests are merged into length-bucketed batches
+    # of up to RERANK_SCHEDULER_MAX_BATCH, gathered for RERANK_SCHEDULER_WAIT_MS
+    # on one inference thread. Requests that would push more than
+    # RERANK_SCHEDULER_MAX_PENDING pairs into its queue are shed.
+    RERANK_SCHEDULER_MAX_BATCH: int = 64
+    RERANK_SCHEDULER_WAIT_MS: float = 3.0
+    RERANK_SCHEDULER_MAX_PENDING: int = 1024
+
+    # --- Answer cache ---
+    # /chat answers sit in an in-process LRU of ANSWER_CACHE_MEMORY_SIZE
+    # entries in front of Redis, or of the SQLite file ANSWER_CACHE_PATH
+    # (capped at ANSWER_CACHE_SQLITE_MAX_ROWS) when REDIS_URL is unset. Keys
+    # carry a knowledge-base version that every upsert and reset bumps;
+    # workers re-read it at most every KB_VERSION_CHECK_SECONDS.
+    ANSWER_CACHE_MEMORY_SIZE: int = 1024
+    ANSWER_CACHE_PATH: str = os.path.join(DATA_DIR, "cache.db")
+    ANSWER_CACHE_SQLITE_MAX_ROWS: int = 10_000
+    KB_VERSION_CHECK_SECONDS: float = 1.0
+    # Identical /chat and /chat_stream queries (same normalised text and
+    # filters) that arrive while one is being answered wait for its answer
+    # or follow its token stream, rather than running their own.
+    CHAT_COALESCING_ENABLED: bool = True
+    # Chat answers are also cached by query embedding: a query whose cosine
+    # similarity to a recent one (with the same filters) is at least
+    # SEMANTIC_CACHE_THRESHOLD gets that answer. Per process, at most
+    # SEMANTIC_CACHE_MAX_ENTRIES answers for SEMANTIC_CACHE_TTL_SECONDS, all
+    # dropped when the knowledge base changes.
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 10_000
+    SEMANTIC_CACHE_TTL_SECONDS: int = 3600
+
+    # --- Graph expansion ---
+    # The pages of the top GRAPH_EXPANSION_SEEDS vector hits are expanded one
+    # hop through page links and shared MENTIONS entities, using a page
+    # adjacency cache rebuilt from Neo4j every GRAPH_CACHE_REFRESH_SECONDS
+    # (and after each ingestion job). The best-matching chunks of up to
+    # GRAPH_EXPANSION_MAX_PAGES neighbours, at most GRAPH_EXPANSION_MAX_CHUNKS,
+    # join the rerank candidates; expansions slower than
+    # GRAPH_EXPANSION_TIMEOUT_MS are dropped. Entities mentioned on more than
+    # GRAPH_ENTITY_MAX_PAGES pages do not make pages neighbours.
+    GRAPH_EXPANSION_ENABLED: bool = True
+    GRAPH_EXPANSION_SEEDS: int = 3
+    GRAPH_EXPANSION_MAX_PAGES: int = 10
+    GRAPH_EXPANSION_MAX_CHUNKS: int = 10
+    GRAPH_EXPANSION_TIMEOUT_MS: float = 30.0
+    GRAPH_CACHE_REFRESH_SECONDS: int = 900
+    GRAPH_NEIGHBOURS_PER_PAGE: int = 20
+    GRAPH_ENTITY_MAX_PAGES: int = 50
 
     NEO4J_URI: str = "bolt://localhost:7687"
     NEO4J_USER: str = "neo4j"
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+from .config import settings
+from .monitoring import CRAWL_ROBOTS_SKIPPED, CRAWL_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean "slow down" rather than "this page is broken".
+THROTTLE_STATUSES = (429, 503)
+
+_robots_cache = None
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), if usable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RobotsCache:
+    """
+    Parsed robots.txt per site, shared by every crawl in the process and
+    re-fetched after `ttl` seconds. A missing robots.txt (4xx) allows
+    everything; so does one that cannot be fetched (5xx, network errors),
+    which is logged, rather than failing the crawl.
+    """
+
+    def __init__(self, user_agent: str, ttl: int):
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, RobotFileParser]] = {}
+        self._fetching: Dict[str, asyncio.Task] = {}
+
+    async def get(self, url: str) -> RobotFileParser:
+        parts = urlparse(url)
+        site = f"{parts.scheme}://{parts.netloc.lower()}"
+        entry = self._entries.get(site)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        task = self._fetching.get(site)
+        if task is None:
+            task = self._fetching[site] = asyncio.ensure_future(self._fetch(site))
+            task.add_done_callback(lambda _: self._fetching.pop(site, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, site: str) -> RobotFileParser:
+        parser = RobotFileParser(site + "/robots.txt")
+        try:
+            async with httpx.AsyncClient(follow_redirects=True, timeout=10,
+                                         headers={"User-Agent": self.user_agent}) as client:
+                r = await client.get(site + "/robots.txt")
+            if r.status_code >= 500:
+                logger.warning(f"robots.txt for {site} returned {r.status_code}; crawling without it.")
+                parser.allow_all = True
+            elif r.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(r.text.splitlines())
+        except Exception as e:
+            logger.warning(f"Could not fetch robots.txt for {site}; crawling without it: {e}")
+            parser.allow_all = True
+        self._entries[site] = (time.monotonic() + self.ttl, parser)
+        return parser
+
+
+def get_robots_cache() -> Optional[RobotsCache]:
+    """The process-wide robots.txt cache, or None when CRAWL_RESPECT_ROBOTS is off."""
+    global _robots_cache
+    if not settings.CRAWL_RESPECT_ROBOTS:
+        return None
+    if _robots_cache is None:
+        _robots_cache = RobotsCache(settings.CRAWL_ROBOTS_USER_AGENT, settings.CRAWL_ROBOTS_TTL_SECONDS)
+    return _robots_cache
+
+
+class _Host:
+    """One host's queue and politeness state: a token bucket refilled at `rate` fetches per second."""
+
+    def __init__(self, rate: float, burst: float):
+        self.queue = deque()
+        self.active = 0
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.robots = None
+        self.robots_pending = False
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until the bucket holds a token (0 if it does now)."""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def limit(self, rate: float):
+        """Caps the fetch rate, e.g. to a robots.txt Crawl-delay, for good."""
+        self.max_rate = min(self.max_rate, rate)
+        self.rate = min(self.rate, rate)
+        self.burst = 1.0
+        self.tokens = min(self.tokens, 1.0)
+
+
+class HostFrontier:
+    """
+    The URLs still to crawl, grouped by host and handed out to concurrent
+    fetch workers. Every crawler backend drives one.
+
+    Per host, at most `per_host` fetches are in flight and a token bucket
+    spaces them `delay` seconds apart on average (bursts of `burst`); while
+    one host waits, workers are handed URLs of other hosts, and hosts take
+    turns. With `robots`, a host's robots.txt is read before its first
+    fetch: disallowed URLs are skipped and Crawl-delay / Request-rate lower
+    the host's rate. A throttling response (429, 503) backs the host off
+    exponentially (or as long as Retry-After says), halves its rate, and
+    re-queues the URL up to CRAWL_MAX_RETRIES times; successes raise the
+    rate back towards the configured one. The crawl ends after `max_pages`
+    successful fetches, or after `max_failures` failed ones (a throttled
+    attempt that is retried is not a failure).
+    """
+
+    def __init__(self, max_pages: int, per_host: int, delay: float, burst: int = 1,
+                 robots: Optional[RobotsCache] = None, max_failures: Optional[int] = None):
+        self.max_pages = max_pages
+        self.max_failures = max_failures
+        self.per_host = max(1, per_host)
+        self.rate = 1.0 / delay if delay > 0 else 1e9
+        self.burst = max(1, burst)
+        self.robots = robots
+        self.fetched = 0
+        self.failed = 0
+        self.skipped_by_robots = 0
+        self._hosts: "OrderedDict[str, _Host]" = OrderedDict()
+        self._seen = set()
+        self._in_flight: Dict[str, Tuple[int, int]] = {}
+        self._wakeup = asyncio.Event()
+
+    def add(self, url: str, depth: int) -> bool:
+        """Queues a URL unless it was queued before."""
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self._host(host_of(url)).queue.append((url, depth, 0))
+        self._notify()
+        return True
+
+    def _host(self, name: str) -> _Host:
+        host = self._hosts.get(name)
+        if host is None:
+            host = self._hosts[name] = _Host(self.rate, self.burst)
+        return host
+
+    def _notify(self):
+        self._wakeup.set()
+
+    async def next(self) -> Optional[Tuple[str, int]]:
+        """
+        Waits for a URL that may be fetched now and returns (url, depth), or
+        None once the crawl is over: max_pages fetched, max_failures failed,
+        or nothing queued and nothing in flight that could queue more.
+        """
+        while True:
+            wait = None
+            if self.fetched + len(self._in_flight) < self.max_pages and not self._failed_out():
+                now = time.monotonic()
+                for name, host in self._hosts.items():
+                    if not host.queue or host.active >= self.per_host:
+                        continue
+                    if self.robots is not None and host.robots is None:
+                        self._load_robots(name, host)
+                        continue
+                    ready_in = host.ready_in(now)
+                    if ready_in > 0:
+                        wait = ready_in if wait is None else min(wait, ready_in)
+                        continue
+                    claimed = self._claim(name, host)
+                    if claimed is not None:
+                        return claimed
+            if not self._in_flight and not self._waiting_on_robots() and (
+                self.fetched >= self.max_pages or self._failed_out()
+                or not any(h.queue for h in self._hosts.values())
+            ):
+                return None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _failed_out(self) -> bool:
+        return self.max_failures is not None and self.failed >= self.max_failures
+
+    def _waiting_on_robots(self) -> bool:
+        return any(h.robots_pending for h in self._hosts.values())
+
+    def _load_robots(self, name: str, host: _Host):
+        if host.robots_pending:
+            return
+        host.robots_pending = True
+        url = host.queue[0][0]
+
+        async def load():
+            try:
+                host.robots = await self.robots.get(url)
+            except Exception as e:
+                logger.warning(f"robots.txt lookup for {name} failed: {e}")
+                host.robots = RobotFileParser()
+                host.robots.allow_all = True
+            finally:
+                host.robots_pending = False
+            agent = self.robots.user_agent
+            delay = host.robots.crawl_delay(agent)
+            rate = host.robots.request_rate(agent)
+            if delay:
+                host.limit(1.0 / float(delay))
+            if rate and rate.requests and rate.seconds:
+                host.limit(rate.requests / rate.seconds)
+            self._notify()
+
+        asyncio.ensure_future(load())
+
+    def _claim(self, name: str, host: _Host) -> Optional[Tuple[str, int]]:
+        while host.queue:
+            url, depth, attempts = host.queue.popleft()
+            if self.robots is not None and not host.robots.can_fetch(self.robots.user_agent, url):
+                self.skipped_by_robots += 1
+                CRAWL_ROBOTS_SKIPPED.inc()
+                logger.info(f"Skipping {url}: disallowed by robots.txt.")
+                continue
+            # Hosts take turns: the one just served goes to the back.
+            self._hosts.move_to_end(name)
+            host.active += 1
+            host.tokens -= 1.0
+            self._in_flight[url] = (depth, attempts)
+            return url, depth
+        return None
+
+    def done(self, url: str, fetched: bool, status: Optional[int] = None, retry_after: Optional[str] = None):
+        """
+        Marks a handed-out URL as finished; `fetched` says whether it yielded
+        a page. `status` is the HTTP status when there was a response; a
+        throttling one backs the host off and re-queues the URL. `retry_after`
+        is the response's Retry-After header.
+        """
+        depth, attempts = self._in_flight.pop(url)
+        host = self._host(host_of(url))
+        host.active -= 1
+        now = time.monotonic()
+        if status in THROTTLE_STATUSES:
+            CRAWL_THROTTLED.inc()
+            host.strikes += 1
+            backoff = parse_retry_after(retry_after)
+            if backoff is None:
+                backoff = settings.CRAWL_BACKOFF_BASE_SECONDS * 2 ** (host.strikes - 1)
+            backoff = min(backoff, settings.CRAWL_BACKOFF_MAX_SECONDS)
+            host.blocked_until = max(host.blocked_until, now + backoff)
+            host.rate = max(host.rate / 2.0, host.max_rate / 64.0)
+            if attempts < settings.CRAWL_MAX_RETRIES:
+                host.queue.appendleft((url, depth, attempts + 1))
+                logger.info(f"{url} answered {status}; backing off {host_of(url)} for {backoff:.1f}s.")
+            else:
+                logger.warning(f"Giving up on {url} after {attempts + 1} throttled attempts.")
+                self.failed += 1
+        elif fetched:
+            self.fetched += 1
+            host.strikes = 0
+            host.rate = min(host.max_rate, host.rate * 1.25)
+        else:
+            self.failed += 1
+        self._notify()
+
+
+def new_frontier(max_pages: int) -> HostFrontier:
+    """A frontier with the configured per-host limits, honouring robots.txt when enabled."""
+    return HostFrontier(
+        max_pages, settings.CRAWL_PER_HOST_CONCURRENCY, settings.CRAWL_HOST_DELAY_SECONDS,
+        burst=settings.CRAWL_HOST_BURST, robots=get_robots_cache(),
+        max_failures=settings.CRAWL_MAX_FAILURES,
+    )
@@ -2,47 +2,59 @@ import asyncio
 import httpx
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-from typing import List, Set
+from typing import List
 import logging
 from .config import settings
+from .crawl_frontier import new_frontier
 
 logger = logging.getLogger(__name__)
 
 async def fetch_page(client: httpx.AsyncClient, url: str, timeout=15):
+    """Returns (html, response); html is None when the fetch failed, response when there was one."""
+    r = None
     try:
         r = await client.get(url, timeout=timeout)
         r.raise_for_status()
-        return r.text
+        return r.text, r
     except Exception as e:
         logger.warning(f"Failed to fetch {url}: {e}")
-        return None
+        return None, r
 
 async def crawl(start_urls: List[str], max_pages: int = None) -> List[dict]:
     max_pages = max_pages or settings.MAX_PAGES_PER_SESSION
-    visited: Set[str] = set()
-    queue = list(start_urls)
+    frontier = new_frontier(max_pages)
+    for url in start_urls:
+        frontier.add(url, 0)
     results = []
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
-        while queue and len(visited) < max_pages:
-            url = queue.pop(0)
-            if url in visited:
-                continue
-            html = await fetch_page(client, url)
-            visited.add(url)
-            if not html:
-                continue
-            results.append({"url": url, "html": html})
-
-            soup = BeautifulSoup(html, "html.parser")
-            for a in soup.find_all("a", href=True):
-                href = a["href"].strip()
-                href = urljoin(url, href)
-                p = urlparse(href)
-                if p.scheme not in ("http", "https"):
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            item = await frontier.next()
+            if item is None:
+                return
+            url, depth = item
+            html, r = await fetch_page(client, url)
+            try:
+                if not html:
                     continue
-                if href not in visited and href not in queue:
-                    queue.append(href)
-            await asyncio.sleep(0.01)
+                results.append({"url": url, "html": html})
+
+                soup = BeautifulSoup(html, "html.parser")
+                for a in soup.find_all("a", href=True):
+                    href = a["href"].strip()
+                    href = urljoin(url, href)
+                    p = urlparse(href)
+                    if p.scheme not in ("http", "https"):
+                        continue
+                    frontier.add(href, depth + 1)
+            finally:
+                # Links are queued first, so the crawl cannot look finished in between.
+                frontier.done(url, html is not None,
+                              r.status_code if r is not None else None,
+                              r.headers.get("retry-after") if r is not None else None)
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=20) as client:
+        workers = max(1, min(settings.CRAWL_CONCURRENCY, max_pages))
+        await asyncio.gather(*[worker(client) for _ in range(workers)])
 
-    return results
+    return results[:max_pages]
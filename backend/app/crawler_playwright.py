@@ -5,6 +5,7 @@ from urllib.parse import urljoin, urlparse
 from playwright.async_api import async_playwright
 
 from .config import settings
+from .crawl_frontier import THROTTLE_STATUSES, new_frontier
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +27,9 @@ async def login_and_get_cookies(login_url: str, username: str, password: str,
 
 async def crawl_with_playwright(start_urls: List[str], max_pages: int = None, cookies: List[Dict] = None, headless: bool = True):
     max_pages = max_pages or settings.MAX_PAGES_PER_SESSION
-    visited = set()
-    queue = list(start_urls)
+    frontier = new_frontier(max_pages)
+    for url in start_urls:
+        frontier.add(url, 0)
     results = []
 
     async with async_playwright() as p:
@@ -35,28 +37,44 @@ async def crawl_with_playwright(start_urls: List[str], max_pages: int = None, co
         context = await browser.new_context()
         if cookies:
             await context.add_cookies(cookies)
-        page = await context.new_page()
 
-        while queue and len(visited) < max_pages:
-            url = queue.pop(0)
-            if url in visited:
-                continue
+        async def worker():
+            page = await context.new_page()
             try:
-                await page.goto(url, wait_until='networkidle', timeout=15000)
-                html = await page.content()
-                results.append({'url': url, 'html': html})
-                visited.add(url)
-                # extract links via DOM
-                anchors = await page.eval_on_selector_all('a[href]', 'els => els.map(e => e.href)')
-                for href in anchors:
-                    if not href:
-                        continue
-                    purl = urlparse(href)
-                    if purl.scheme not in ('http','https'):
-                        continue
-                    if href not in visited and href not in queue:
-                        queue.append(href)
-            except Exception as e:
-                logger.warning(f'Playwright failed for {url}: {e}')
+                while True:
+                    item = await frontier.next()
+                    if item is None:
+                        return
+                    url, depth = item
+                    fetched = False
+                    status = retry_after = None
+                    try:
+                        response = await page.goto(url, wait_until='networkidle', timeout=15000)
+                        if response is not None:
+                            status = response.status
+                            retry_after = response.headers.get('retry-after')
+                        if status in THROTTLE_STATUSES:
+                            continue
+                        html = await page.content()
+                        results.append({'url': url, 'html': html})
+                        fetched = True
+                        # extract links via DOM
+                        anchors = await page.eval_on_selector_all('a[href]', 'els => els.map(e => e.href)')
+                        for href in anchors:
+                            if not href:
+                                continue
+                            purl = urlparse(href)
+                            if purl.scheme not in ('http','https'):
+                                continue
+                            frontier.add(href, depth + 1)
+                    except Exception as e:
+                        logger.warning(f'Playwright failed for {url}: {e}')
+                    finally:
+                        frontier.done(url, fetched, status, retry_after)
+            finally:
+                await page.close()
+
+        workers = max(1, min(settings.CRAWL_CONCURRENCY, max_pages))
+        await asyncio.gather(*[worker() for _ in range(workers)])
         await browser.close()
-    return results
+    return results[:max_pages]
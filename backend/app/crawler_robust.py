@@ -1,73 +1,93 @@
 import asyncio
 import logging
-from typing import List, Set, Dict
+import time
+from typing import Callable, List, Optional
 from urllib.parse import urljoin, urlparse
 from playwright.async_api import async_playwright
 
+from .config import settings
+from .crawl_frontier import THROTTLE_STATUSES, new_frontier
+
 logger = logging.getLogger(__name__)
 
-async def crawl(start_urls: List[str], max_pages: int = 20, max_depth: int = 2, **kwargs) -> List[dict]:
+async def crawl(start_urls: List[str], max_pages: int = 20, max_depth: int = 2,
+                on_progress: Optional[Callable[[int, float], None]] = None, **kwargs) -> List[dict]:
     """
     A robust, Playwright-based crawler that can handle JavaScript-heavy websites.
+
+    CRAWL_CONCURRENCY browser pages fetch in parallel from a shared frontier,
+    which keeps each host to its politeness limits, robots.txt and backoff
+    (see HostFrontier). `on_progress` is called with the pages crawled so
+    far and the rate in pages per second.
     """
     logger.info(f"Starting Playwright crawl for: {start_urls}")
-    visited: Set[str] = set()
-    queue = [(url, 0) for url in start_urls]
+    frontier = new_frontier(max_pages)
+    for url in start_urls:
+        frontier.add(url, 0)
     results = []
+    started = time.monotonic()
 
     async with async_playwright() as p:
         browser = await p.chromium.launch(
             headless=True,
             args=["--disable-blink-features=AutomationControlled"]
         )
-        
+
         context = await browser.new_context(
             user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
             viewport={'width': 1920, 'height': 1080}
             # The incorrect 'navigation_timeout' argument has been removed from here.
         )
-        page = await context.new_page()
-
-        # --- THIS IS THE CORRECT WAY TO SET THE TIMEOUT ---
-        # Set the default navigation timeout for all subsequent actions on this page.
-        page.set_default_navigation_timeout(30000) # 30 seconds
-        # --- END OF FIX ---
-
-        while queue and len(results) < max_pages:
-            url, depth = queue.pop(0)
-            
-            if url in visited:
-                continue
-            
-            visited.add(url)
 
+        async def worker():
+            page = await context.new_page()
+            # --- THIS IS THE CORRECT WAY TO SET THE TIMEOUT ---
+            # Set the default navigation timeout for all subsequent actions on this page.
+            page.set_default_navigation_timeout(30000) # 30 seconds
+            # --- END OF FIX ---
             try:
-                logger.info(f"Navigating to (depth {depth}, page {len(results) + 1}/{max_pages}): {url}")
-                # The goto command will now use the 30-second default timeout set above.
-                await page.goto(url, wait_until='domcontentloaded')
-                
-                # Add a small, human-like random delay
-                await asyncio.sleep(1 + (0.1 * (hash(url) % 10)))
+                while True:
+                    item = await frontier.next()
+                    if item is None:
+                        return
+                    url, depth = item
+                    fetched = False
+                    status = retry_after = None
+                    try:
+                        logger.info(f"Navigating to (depth {depth}, page {len(results) + 1}/{max_pages}): {url}")
+                        # The goto command will now use the 30-second default timeout set above.
+                        response = await page.goto(url, wait_until='domcontentloaded')
+                        if response is not None:
+                            status = response.status
+                            retry_after = response.headers.get('retry-after')
+                        if status in THROTTLE_STATUSES:
+                            continue
+                        html = await page.content()
+                        results.append({"url": url, "html": html})
+                        fetched = True
 
-                html = await page.content()
-                results.append({"url": url, "html": html})
+                        if depth < max_depth:
+                            anchors = await page.eval_on_selector_all('a[href]', 'els => els.map(e => e.href)')
+                            for href in anchors:
+                                if not href: continue
+                                full_url = urljoin(url, href)
+                                p_url = urlparse(full_url)
+                                if p_url.scheme not in ('http', 'https'): continue
+                                frontier.add(full_url.split('#')[0], depth + 1)
 
-                if depth < max_depth:
-                    anchors = await page.eval_on_selector_all('a[href]', 'els => els.map(e => e.href)')
-                    
-                    for href in anchors:
-                        if not href: continue
-                        full_url = urljoin(url, href)
-                        p_url = urlparse(full_url)
-                        if p_url.scheme not in ('http', 'https'): continue
-                        full_url_no_fragment = full_url.split('#')[0]
-                        if full_url_no_fragment not in visited:
-                            queue.append((full_url_no_fragment, depth + 1))
+                    except Exception as e:
+                        logger.warning(f"Playwright navigation to {url} failed. Error: {type(e).__name__}: {e}")
+                    finally:
+                        frontier.done(url, fetched, status, retry_after)
+                    if fetched and on_progress:
+                        on_progress(len(results), len(results) / max(time.monotonic() - started, 1e-6))
+            finally:
+                await page.close()
 
-            except Exception as e:
-                logger.warning(f"Playwright navigation to {url} failed. Error: {type(e).__name__}: {e}")
-            
+        workers = max(1, min(settings.CRAWL_CONCURRENCY, max_pages))
+        await asyncio.gather(*[worker() for _ in range(workers)])
         await browser.close()
-    
-    logger.info(f"Playwright crawl finished. Found {len(results)} pages.")
-    return results
\ No newline at end of file
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Playwright crawl finished. Found {len(results)} pages in {elapsed:.1f}s ({len(results) / max(elapsed, 1e-6):.2f} pages/sec).")
+    return results[:max_pages]
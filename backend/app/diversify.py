@@ -0,0 +1,72 @@
+from typing import Dict, List
+
+import numpy as np
+
+from .config import settings
+from .monitoring import DIVERSIFY_DROPPED
+
+_KEPT, _DUPLICATE, _PAGE_CAP = 0, 1, 2
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, groups: np.ndarray, k: int,
+               lambda_: float, duplicate_threshold: float, max_per_group: int):
+    """
+    Greedy maximal-marginal-relevance selection over n candidates.
+
+    `relevance` is scaled to [0, 1], `vectors` holds unit rows (zero rows
+    never count as similar to anything) and `groups` an integer group (page)
+    per row. The pairwise similarities are one matrix product; each step then
+    updates every candidate's similarity to the chosen set in one vector
+    operation. Returns the chosen row indices in selection order and, per
+    row, why it was dropped (_DUPLICATE, _PAGE_CAP; _KEPT otherwise).
+    """
+    n = len(relevance)
+    sim = vectors @ vectors.T
+    closest = np.zeros(n, dtype="float32")
+    available = np.ones(n, dtype=bool)
+    dropped = np.full(n, _KEPT, dtype="int8")
+    group_counts = np.zeros(int(groups.max()) + 1 if n else 0, dtype="int64")
+    chosen = []
+    while len(chosen) < k and available.any():
+        gain = np.where(available, lambda_ * relevance - (1.0 - lambda_) * closest, -np.inf)
+        i = int(np.argmax(gain))
+        chosen.append(i)
+        available[i] = False
+        np.maximum(closest, sim[i], out=closest)
+
+        duplicates = available & (sim[i] >= duplicate_threshold)
+        dropped[duplicates] = _DUPLICATE
+        available &= ~duplicates
+        if max_per_group:
+            group_counts[groups[i]] += 1
+            if group_counts[groups[i]] >= max_per_group:
+                capped = available & (groups == groups[i])
+                dropped[capped] = _PAGE_CAP
+                available &= ~capped
+    return np.array(chosen, dtype="int64"), dropped
+
+
+def diversify(candidates: List[Dict], vectors: np.ndarray, limit: int) -> List[Dict]:
+    """
+    Picks up to `limit` candidates by MMR on their fused 'score', dropping
+    near-duplicates (MMR_DUPLICATE_THRESHOLD) and chunks beyond
+    MMR_MAX_PER_PAGE per page. `vectors` are the candidates' stored
+    embeddings, row for row.
+    """
+    if len(candidates) <= 1:
+        return candidates[:limit]
+    scores = np.array([c.get('score', 0.0) for c in candidates], dtype="float32")
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    _, groups = np.unique([c.get('meta', {}).get('page_url') or '' for c in candidates], return_inverse=True)
+
+    chosen, dropped = mmr_select(
+        relevance, np.asarray(vectors, dtype="float32"), groups.ravel(), limit,
+        settings.MMR_LAMBDA, settings.MMR_DUPLICATE_THRESHOLD, settings.MMR_MAX_PER_PAGE,
+    )
+    duplicates = int((dropped == _DUPLICATE).sum())
+    capped = int((dropped == _PAGE_CAP).sum())
+    DIVERSIFY_DROPPED.labels(reason="duplicate").inc(duplicates)
+    DIVERSIFY_DROPPED.labels(reason="page_cap").inc(capped)
+    DIVERSIFY_DROPPED.labels(reason="mmr").inc(len(candidates) - len(chosen) - duplicates - capped)
+    return [candidates[i] for i in chosen]
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+from .embedding_pool import embed_texts
+from .embeddings import normalize_text
+from .monitoring import EMBEDDING_CACHE_HITS, EMBEDDING_CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+_embedding_cache = None
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Chunk embeddings persisted in SQLite as float32 blobs, keyed by
+    (model key, SHA-256 of the normalised chunk text); see model_key().
+
+    Boilerplate such as headers, footers and cookie banners repeats across
+    the pages of a site; with this cache each distinct chunk is embedded
+    once per model. Entries stay valid across knowledge-base resets because
+    they depend only on the text and the model.
+    """
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.model_name = model_name
+        self._conn_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT, hash BLOB, vector BLOB, PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached embedding for each text, or None where there is none."""
+        hashes = [content_hash(text) for text in texts]
+        placeholders = ",".join("?" * len(set(hashes)))
+        with self._conn_lock:
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [self.model_name, *set(hashes)],
+            ).fetchall()
+        found = {row[0]: np.frombuffer(row[1], dtype="float32") for row in rows}
+        return [found.get(h) for h in hashes]
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray) -> None:
+        records = [
+            (self.model_name, content_hash(text), np.ascontiguousarray(embedding, dtype="float32").tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._conn_lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?,?,?)", records)
+            self._conn.commit()
+
+
+def model_key() -> str:
+    """
+    The embedding model plus the runtime serving it: ONNX vectors, int8
+    quantized ones above all, differ slightly from the PyTorch model's and
+    are cached apart from them.
+    """
+    if settings.INFERENCE_BACKEND == "onnx":
+        return f"{settings.EMBEDDING_MODEL}|onnx{'-int8' if settings.ONNX_QUANTIZE else ''}"
+    return settings.EMBEDDING_MODEL
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """The process-wide cache, or None when EMBEDDING_CACHE_ENABLED is off."""
+    global _embedding_cache
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH, model_key())
+    return _embedding_cache
+
+
+async def get_embeddings_cached(texts: List[str]) -> Tuple[np.ndarray, int]:
+    """
+    Like embed_texts(), but serves repeated chunks from the embedding cache
+    and only runs the model on the rest. Returns the (n, dim) float32
+    embeddings and how many of them were cache hits.
+    """
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return await embed_texts(texts), 0
+
+    cached = await asyncio.to_thread(cache.get_many, texts)
+    missing = [i for i, emb in enumerate(cached) if emb is None]
+    # Duplicates within the batch are embedded once.
+    unique_missing = list(dict.fromkeys(normalize_text(texts[i]) for i in missing))
+    computed = {}
+    if unique_missing:
+        fresh = await embed_texts(unique_missing)
+        await asyncio.to_thread(cache.put_many, unique_missing, fresh)
+        computed = dict(zip(unique_missing, fresh))
+
+    hits = len(texts) - len(missing)
+    EMBEDDING_CACHE_HITS.inc(hits)
+    EMBEDDING_CACHE_MISSES.inc(len(missing))
+    first = next(emb for emb in cached if emb is not None) if hits else fresh[0]
+    embeddings = np.empty((len(texts), first.shape[0]), dtype="float32")
+    for i, emb in enumerate(cached):
+        embeddings[i] = emb if emb is not None else computed[normalize_text(texts[i])]
+    return embeddings, hits
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from .config import settings
+from .monitoring import EMBEDDING_POOL_PENDING
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def _init_worker(threads: int, pin_cpus: bool, counter) -> None:
+    """Runs once in each worker process: pins its threads (and cores), then loads the model."""
+    # torch and the model are imported only after this, so its thread pools
+    # start with the worker's thread count.
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        with counter.get_lock():
+            slot = counter.value
+            counter.value += 1
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[(slot * threads + k) % len(cpus)] for k in range(threads)})
+
+    import torch
+    torch.set_num_threads(threads)
+    settings.ONNX_NUM_THREADS = threads
+
+    from .embeddings import load_model_on_startup
+    load_model_on_startup()
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    from .embeddings import get_embeddings_for_texts
+    # Returned arrays are pickled as one contiguous buffer (protocol 5).
+    return get_embeddings_for_texts(texts)
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+class EmbeddingPool:
+    """
+    A pool of worker processes that embed chunk batches for ingestion, each
+    with its own preloaded model. Embedding happens outside the API process,
+    so a large crawl uses as many cores as there are workers while chat
+    requests keep the event loop and the API process's cores to themselves.
+
+    At most `max_pending` batches are queued or running at once; further
+    callers wait in embed(), which keeps memory bounded however fast the
+    crawler produces pages.
+    """
+
+    def __init__(self, workers: int, threads: int, max_pending: int, pin_cpus: bool = False):
+        self.workers = workers
+        # Spawned, not forked: a forked copy of an initialised torch runtime can deadlock.
+        ctx = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(threads, pin_cpus, ctx.Value("i", 0)),
+        )
+        self._slots = asyncio.Semaphore(max(1, max_pending))
+
+    async def start(self) -> None:
+        """Waits until every worker has loaded its model."""
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self._executor, _ready) for _ in range(self.workers)])
+        logger.info(f"Embedding pool ready: {len(set(pids))} worker processes.")
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        async with self._slots:
+            EMBEDDING_POOL_PENDING.inc()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, _embed_batch, list(texts))
+            finally:
+                EMBEDDING_POOL_PENDING.dec()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_embedding_pool() -> Optional[EmbeddingPool]:
+    """The process-wide pool, or None when EMBEDDING_WORKERS is 0."""
+    global _pool
+    if settings.EMBEDDING_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = EmbeddingPool(
+            settings.EMBEDDING_WORKERS,
+            settings.EMBEDDING_WORKER_THREADS,
+            settings.EMBEDDING_POOL_MAX_PENDING or 2 * settings.EMBEDDING_WORKERS,
+            settings.EMBEDDING_WORKER_PIN_CPUS,
+        )
+    return _pool
+
+
+async def start_embedding_pool() -> None:
+    pool = get_embedding_pool()
+    if pool is not None:
+        await pool.start()
+
+
+def shutdown_embedding_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    Embeds chunk texts as an (n, dim) float32 array without blocking the
+    event loop: on the worker pool when there is one, else on a thread.
+    """
+    pool = get_embedding_pool()
+    if pool is not None:
+        return await pool.embed(texts)
+    from .embeddings import get_embeddings_for_texts
+    return await asyncio.to_thread(get_embeddings_for_texts, texts)
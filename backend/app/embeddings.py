@@ -1,13 +1,30 @@
 from sentence_transformers import SentenceTransformer
+from .batching import MicroBatcher
 from .config import settings
+from .monitoring import QUERY_EMBEDDING_CACHE_HITS, QUERY_EMBEDDING_CACHE_MISSES
+from .onnx_backend import load_sentence_encoder
+from collections import OrderedDict
 import numpy as np
 import logging
+import re
+import threading
 import time
 import torch
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
 _model = None
+_query_batcher = None
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalised text with whitespace runs collapsed, so trivially different copies share a key."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
 
 # This is the function that will be called ONCE when the app starts.
 def load_model_on_startup():
@@ -22,6 +39,13 @@ def load_model_on_startup():
         logger.info(f"Loading embedding model '{settings.EMBEDDING_MODEL}'...")
         start_time = time.time()
 
+        if settings.INFERENCE_BACKEND == "onnx":
+            # Falls back to PyTorch below if the ONNX model is unusable.
+            _model = load_sentence_encoder(settings.EMBEDDING_MODEL)
+            if _model is not None:
+                logger.info(f"--- AI MODEL LOAD COMPLETE --- (Took {time.time() - start_time:.2f} seconds)")
+                return
+
         # Explicitly check for MPS and fallback to CPU
         # This is good practice for robustness on Mac.
         device = "mps" if torch.backends.mps.is_available() else "cpu"
@@ -40,12 +64,57 @@ def _get_model():
         load_model_on_startup()
     return _model
 
-def get_embedding_for_text(text: str) -> list:
-    m = _get_model()
-    emb = m.encode([text], show_progress_bar=False)[0]
-    return emb.astype("float32").tolist()
+def get_embedding_for_text(text: str) -> np.ndarray:
+    return get_embeddings_for_texts([text])[0]
 
-def get_embeddings_for_texts(texts: list) -> list:
+def get_embeddings_for_texts(texts: list) -> np.ndarray:
+    """
+    Embeds texts as one contiguous (n, dim) float32 array. The array goes to
+    the vector store as-is, so no per-chunk Python lists are ever built.
+    """
     m = _get_model()
-    embs = m.encode(texts, show_progress_bar=False)
-    return [e.astype("float32").tolist() for e in embs]
\ No newline at end of file
+    embs = m.encode(texts, show_progress_bar=False, convert_to_numpy=True)
+    return np.ascontiguousarray(embs, dtype="float32")
+
+def _encode_query_batch(texts: list) -> list:
+    """Query batcher callback: one forward pass for every distinct text in the batch."""
+    unique = list(dict.fromkeys(texts))
+    embs = _get_model().encode(unique, show_progress_bar=False).astype("float32")
+    by_text = dict(zip(unique, embs))
+    return [by_text[t] for t in texts]
+
+def _get_query_batcher() -> MicroBatcher:
+    global _query_batcher
+    if _query_batcher is None:
+        _query_batcher = MicroBatcher(
+            "query_embedding", _encode_query_batch,
+            max_batch_size=settings.QUERY_EMBED_BATCH_MAX_SIZE,
+            max_wait_ms=settings.QUERY_EMBED_BATCH_WAIT_MS,
+        )
+    return _query_batcher
+
+async def embed_query(text: str) -> np.ndarray:
+    """
+    Embeds a user query without blocking the event loop. Repeated queries are
+    answered from an LRU cache keyed by the normalised text; the rest are
+    coalesced with concurrent queries into one batched forward pass on the
+    query batcher's thread. The returned array is shared; do not modify it.
+    """
+    key = normalize_text(text)
+    with _query_cache_lock:
+        emb = _query_cache.get(key)
+        if emb is not None:
+            _query_cache.move_to_end(key)
+    if emb is not None:
+        QUERY_EMBEDDING_CACHE_HITS.inc()
+        return emb
+
+    QUERY_EMBEDDING_CACHE_MISSES.inc()
+    emb = await _get_query_batcher().run(key)
+    emb.setflags(write=False)
+    with _query_cache_lock:
+        _query_cache[key] = emb
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > settings.QUERY_EMBEDDING_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return emb
\ No newline at end of file
@@ -0,0 +1,310 @@
+import logging
+import math
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_CODECS = ("float32", "sq8", "pq", "binary")
+
+# IVF k-means wants roughly this many training points per centroid.
+_MIN_POINTS_PER_CENTROID = 39
+
+# Every id stored by an IDMap wrapper costs one int64.
+_ID_BYTES = 8
+
+
+def _codec_of(storage) -> str:
+    storage = faiss.downcast_index(storage)
+    if isinstance(storage, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(storage, faiss.IndexPQ):
+        return "pq"
+    return "float32"
+
+
+def _unwrap(index):
+    """The index doing the work: the one inside an IDMap wrapper, or the index itself."""
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else faiss.downcast_index(index)
+
+
+def index_layout(index) -> Tuple[str, str]:
+    """
+    Returns the (index_type, codec) pair of an index built by this module,
+    e.g. ("flat", "float32") or ("hnsw", "sq8").
+    """
+    if isinstance(index, faiss.IndexBinary):
+        return "flat", "binary"
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw", _codec_of(inner.storage)
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq", "pq"
+    if isinstance(inner, faiss.IndexIVFScalarQuantizer):
+        return "ivf_flat", "sq8"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat", "float32"
+    return "flat", _codec_of(inner)
+
+
+def index_kind(index) -> str:
+    """Returns the layout ("flat", "ivf_flat", "ivf_pq" or "hnsw") of an index."""
+    return index_layout(index)[0]
+
+
+def target_layout() -> Tuple[str, str]:
+    """
+    The (index_type, codec) pair the configuration asks for, normalised the
+    same way index_layout() reports an existing index.
+    """
+    index_type, codec = settings.FAISS_INDEX_TYPE, settings.FAISS_VECTOR_CODEC
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported FAISS index type: {index_type!r}. Expected one of {INDEX_TYPES}.")
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"Unsupported FAISS vector codec: {codec!r}. Expected one of {VECTOR_CODECS}.")
+    if codec == "binary":
+        # Binary codes are only searched exhaustively (Hamming distance).
+        return "flat", "binary"
+    if index_type == "ivf_pq" or (index_type == "ivf_flat" and codec == "pq"):
+        return "ivf_pq", "pq"
+    return index_type, codec
+
+
+def needs_rescoring(index) -> bool:
+    """Lossy layouts return approximate scores that must be re-ranked exactly."""
+    return index_layout(index)[1] != "float32"
+
+
+def build_flat_index(dim: int):
+    """Creates the empty exact inner-product index every store starts with."""
+    return faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest sub-quantizer count <= FAISS_PQ_M that divides the dimension."""
+    for m in range(min(settings.FAISS_PQ_M, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _factory_string(layout: Tuple[str, str], dim: int, ntotal: int, ntrain: int) -> str:
+    index_type, codec = layout
+    codes = {"float32": "Flat", "sq8": "SQ8", "pq": f"PQ{_pq_subquantizers(dim)}"}[codec]
+
+    if index_type == "flat":
+        return codes
+    if index_type == "hnsw":
+        return f"HNSW{settings.FAISS_HNSW_M}" if codec == "float32" else f"HNSW{settings.FAISS_HNSW_M}_{codes}"
+
+    # Keep nlist near 4*sqrt(N) but never more than the sample can train.
+    nlist = int(4 * math.sqrt(max(ntotal, 1)))
+    nlist = min(nlist, settings.FAISS_IVF_NLIST, max(1, ntrain // _MIN_POINTS_PER_CENTROID))
+    return f"IVF{max(nlist, 1)},{codes}"
+
+
+def pack_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign-binarises float vectors into the packed uint8 codes binary indexes expect."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def build_index(layout: Tuple[str, str], vectors: np.ndarray, ids: np.ndarray):
+    """
+    Builds, trains and fills an index of the given (index_type, codec)
+    layout. Vectors must already be L2-normalised float32. This is CPU heavy
+    and is meant to be run in a worker thread.
+    """
+    ntotal, dim = vectors.shape
+    if layout == ("flat", "binary"):
+        index = faiss.IndexBinaryIDMap(faiss.IndexBinaryFlat(dim))
+        add_vectors(index, vectors, ids)
+        return index
+
+    sample_size = min(ntotal, settings.FAISS_TRAIN_SAMPLE_SIZE)
+    if sample_size < ntotal:
+        rng = np.random.default_rng(0)
+        sample = vectors[np.sort(rng.choice(ntotal, size=sample_size, replace=False))]
+    else:
+        sample = vectors
+
+    factory = _factory_string(layout, dim, ntotal, sample_size)
+    logger.info(f"Building '{factory}' index over {ntotal} vectors (training on {sample_size}).")
+    inner = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+    if layout[0] == "hnsw":
+        faiss.downcast_index(inner).hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+
+    # IVF lists store the ids themselves and delete by id. An IDMap wrapper
+    # would compact its id table on removal while the lists keep the old
+    # positions, so the two drift apart after the first delete.
+    index = inner if isinstance(faiss.downcast_index(inner), faiss.IndexIVF) else faiss.IndexIDMap(inner)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(sample, dtype="float32"))
+    add_vectors(index, vectors, ids)
+    return index
+
+
+def add_vectors(index, vectors: np.ndarray, ids: np.ndarray):
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    if isinstance(index, faiss.IndexBinary):
+        index.add_with_ids(pack_binary(vectors), ids)
+    else:
+        index.add_with_ids(vectors, ids)
+
+
+def is_legacy_ivf(index) -> bool:
+    """
+    True for IVF indexes wrapped in an IDMap, as older snapshots stored them.
+    Their id table and inverted lists drift apart on the first removal.
+    """
+    return isinstance(index, faiss.IndexIDMap) and isinstance(faiss.downcast_index(index.index), faiss.IndexIVF)
+
+
+def deletes_in_place(index) -> bool:
+    """
+    False for layouts whose removed ids must instead be masked at query time
+    until the next rebuild: HNSW graphs, and IDMap-wrapped IVF indexes.
+    """
+    return index_kind(index) != "hnsw" and not is_legacy_ivf(index)
+
+
+def stored_ids(index) -> np.ndarray:
+    """Copies the ids held by an index built by this module, in no particular order."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexBinaryIDMap)):
+        return faiss.vector_to_array(index.id_map).copy()
+    invlists = faiss.extract_index_ivf(index).invlists
+    chunks = []
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+        ids = invlists.get_ids(list_no)
+        chunks.append(faiss.rev_swig_ptr(ids, size).copy())
+        invlists.release_ids(list_no, ids)
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype="int64")
+
+
+def remove_ids(index, ids: np.ndarray) -> bool:
+    """
+    Deletes ids from the index in place. Returns False for layouts that do not
+    support deletion (see deletes_in_place); those ids must be masked at query
+    time until the next compaction rebuilds the index.
+    """
+    if not deletes_in_place(index):
+        return False
+    index.remove_ids(np.ascontiguousarray(ids, dtype="int64"))
+    return True
+
+
+def exclude_selector(ids: np.ndarray):
+    """ID selector that matches every id except the given ones."""
+    # IDSelectorNot keeps a Python reference to the batch it wraps.
+    return faiss.IDSelectorNot(faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype="int64")))
+
+
+def bitmap_selector(ids: np.ndarray):
+    """
+    ID selector over a bitmap with one bit per id, for filters matching many
+    ids: membership is a bit test instead of a hash lookup.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    bits = np.zeros(int(ids.max()) + 1 if len(ids) else 0, dtype=bool)
+    bits[ids] = True
+    # The Python wrapper keeps a reference to the bitmap array.
+    return faiss.IDSelectorBitmap(np.packbits(bits, bitorder="little"))
+
+
+def search_index(index, queries: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Searches any index built by this module. Binary indexes return Hamming
+    distances, which are mapped onto a [-1, 1] similarity estimate.
+    """
+    if isinstance(index, faiss.IndexBinary):
+        D, I = index.search(pack_binary(queries), k)
+        return 1.0 - 2.0 * D.astype("float32") / index.d, I
+    return index.search(queries, k, params=params)
+
+
+def bytes_per_vector(index) -> float:
+    """Approximate in-RAM cost of one stored vector, including its id."""
+    if isinstance(index, faiss.IndexBinary):
+        return index.code_size + _ID_BYTES
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        # Level-0 neighbour lists dominate the graph's footprint.
+        links = inner.hnsw.nb_neighbors(0) * 4
+        return storage.code_size + links + _ID_BYTES
+    if isinstance(inner, faiss.IndexIVF):
+        # Inverted lists keep the id next to every code.
+        return inner.code_size + _ID_BYTES
+    return inner.code_size + _ID_BYTES
+
+
+def read_index(path: str, mmap: bool = False):
+    """
+    Loads a persisted index. With mmap=True the file is mapped read-only so
+    that processes opening the same snapshot share its pages through the OS
+    page cache instead of each holding a private heap copy.
+    """
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+    try:
+        return _read_any_index(path, flags)
+    except RuntimeError as e:
+        if not mmap:
+            raise
+        logger.warning(f"Could not memory-map {path} ({e}); loading it into memory instead.")
+    return _read_any_index(path, 0)
+
+
+def _read_any_index(path: str, flags: int):
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        # Binary-code snapshots use their own serialisation format.
+        return faiss.read_index_binary(path, flags)
+
+
+def write_index(index, path: str):
+    if isinstance(index, faiss.IndexBinary):
+        faiss.write_index_binary(index, path)
+    else:
+        faiss.write_index(index, path)
+
+
+def export_flat_vectors(index, start: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Copies the vectors and ids stored at positions [start, ntotal) of a
+    float32 flat IDMap index. The returned arrays do not alias the index's
+    memory.
+    """
+    inner = faiss.downcast_index(index.index)
+    n = index.ntotal - start
+    if n <= 0:
+        return np.empty((0, index.d), dtype="float32"), np.empty(0, dtype="int64")
+    vectors = inner.reconstruct_n(start, n)
+    ids = faiss.vector_to_array(index.id_map)[start:].copy()
+    return vectors, ids
+
+
+def search_params(index, top_k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None):
+    """
+    Builds the per-query SearchParameters for the index layout, or None for an
+    unfiltered flat index. Unset values fall back to FAISS_NPROBE /
+    FAISS_EF_SEARCH. The caller must keep `sel` alive until the search returns.
+    """
+    kind = index_kind(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(nprobe=nprobe or settings.FAISS_NPROBE, sel=sel)
+    if kind == "hnsw":
+        # efSearch below k silently truncates the result list.
+        ef = max(ef_search or settings.FAISS_EF_SEARCH, top_k)
+        return faiss.SearchParametersHNSW(efSearch=ef, sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
@@ -1,7 +1,7 @@
 from neo4j import GraphDatabase
 from .config import settings
 import logging
-from typing import List
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 _driver = None
@@ -41,6 +41,42 @@ def add_page_node(url: str, title: str):
     except Exception as e:
         logger.error(f"Failed to add page node for URL {url}: {e}")
 
+def set_page_links(url: str, links: List[str]):
+    """
+    Records the pages a WebPage links to as its `links` property. Targets
+    that have not been ingested yet are kept too; the adjacency cache
+    resolves them once they are.
+    """
+    try:
+        drv = _get_driver()
+        if not drv: return
+
+        with drv.session() as session:
+            session.run("MERGE (p:WebPage {url: $url}) SET p.links = $links", url=url, links=links)
+    except Exception as e:
+        logger.error(f"Failed to set page links for URL {url}: {e}")
+
+def load_page_adjacency() -> Optional[Tuple[List[tuple], List[tuple]]]:
+    """
+    Reads the whole page neighbourhood in two queries: (url, links) for every
+    WebPage and (url, entity name) for every MENTIONS edge. None if Neo4j is
+    unavailable.
+    """
+    try:
+        drv = _get_driver()
+        if not drv: return None
+
+        with drv.session() as session:
+            pages = [(r["url"], r["links"] or []) for r in session.run("MATCH (p:WebPage) RETURN p.url AS url, p.links AS links")]
+            mentions = [
+                (r["url"], r["name"])
+                for r in session.run("MATCH (p:WebPage)-[:MENTIONS]->(e:Entity) RETURN p.url AS url, e.name AS name")
+            ]
+            return pages, mentions
+    except Exception as e:
+        logger.error(f"Failed to load the page adjacency: {e}")
+        return None
+
 def get_all_page_nodes() -> List[dict]:
     """
     Retrieves all WebPage nodes from the graph to display in the UI.
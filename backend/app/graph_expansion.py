@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .config import settings
+from .graph import load_page_adjacency
+from .monitoring import GRAPH_ADJACENCY_PAGES, GRAPH_EXPANSION_LATENCY, GRAPH_EXPANSIONS
+
+logger = logging.getLogger(__name__)
+
+_adjacency = None
+_refresh_requested = None
+
+
+class PageAdjacency:
+    """
+    One-hop page neighbourhoods precomputed from the Neo4j graph, so that
+    expanding a query's top pages is a dictionary lookup rather than a Cypher
+    round trip.
+
+    Two pages are neighbours when either links to the other or both MENTION
+    the same entity. A link weighs 1 and a shared entity 1/log2(1 + pages
+    mentioning it); entities on more than `entity_max_pages` pages (site
+    names, navigation) are ignored. Each page keeps its `per_page` strongest
+    neighbours.
+    """
+
+    def __init__(self, neighbours: Dict[str, List[Tuple[str, float]]]):
+        self._neighbours = neighbours
+
+    def __len__(self) -> int:
+        return len(self._neighbours)
+
+    @classmethod
+    def build(cls, pages: List[tuple], mentions: List[tuple], per_page: int, entity_max_pages: int) -> "PageAdjacency":
+        weights = defaultdict(lambda: defaultdict(float))
+        known = {url for url, _ in pages}
+        for url, links in pages:
+            # Links to pages that were never ingested have no chunks to offer.
+            for link in set(links):
+                if link != url and link in known:
+                    weights[url][link] += 1.0
+                    weights[link][url] += 1.0
+
+        by_entity = defaultdict(set)
+        for url, name in mentions:
+            by_entity[name].add(url)
+        for urls in by_entity.values():
+            if not 2 <= len(urls) <= entity_max_pages:
+                continue
+            weight = 1.0 / math.log2(1 + len(urls))
+            for a in urls:
+                for b in urls:
+                    if a != b:
+                        weights[a][b] += weight
+
+        return cls({
+            url: heapq.nlargest(per_page, found.items(), key=lambda item: item[1])
+            for url, found in weights.items()
+        })
+
+    def expand(self, seeds: List[str], max_pages: int) -> List[str]:
+        """The seeds' neighbours by summed weight, strongest first, excluding the seeds."""
+        scores = defaultdict(float)
+        for url in seeds:
+            for neighbour, weight in self._neighbours.get(url, ()):
+                scores[neighbour] += weight
+        for url in seeds:
+            scores.pop(url, None)
+        return heapq.nlargest(max_pages, scores, key=scores.get)
+
+
+def _load() -> Optional[PageAdjacency]:
+    loaded = load_page_adjacency()
+    if loaded is None:
+        return None
+    pages, mentions = loaded
+    return PageAdjacency.build(pages, mentions, settings.GRAPH_NEIGHBOURS_PER_PAGE, settings.GRAPH_ENTITY_MAX_PAGES)
+
+
+async def refresh_page_adjacency() -> bool:
+    """Rebuilds the adjacency cache from Neo4j; keeps the old one if the graph is unreachable."""
+    global _adjacency
+    adjacency = await asyncio.to_thread(_load)
+    if adjacency is None:
+        return False
+    _adjacency = adjacency
+    GRAPH_ADJACENCY_PAGES.set(len(adjacency))
+    logger.info(f"Graph adjacency cache rebuilt: {len(adjacency)} pages with neighbours.")
+    return True
+
+
+def _refresh_event() -> asyncio.Event:
+    global _refresh_requested
+    if _refresh_requested is None:
+        _refresh_requested = asyncio.Event()
+    return _refresh_requested
+
+
+def request_graph_refresh():
+    """Asks the refresher to rebuild the cache now, e.g. after an ingestion job."""
+    if settings.GRAPH_EXPANSION_ENABLED:
+        _refresh_event().set()
+
+
+async def run_graph_refresher():
+    """
+    Background loop that rebuilds the adjacency cache on startup, every
+    GRAPH_CACHE_REFRESH_SECONDS, and whenever a refresh is requested.
+    """
+    while True:
+        _refresh_event().clear()
+        try:
+            await refresh_page_adjacency()
+        except Exception as e:
+            logger.exception(f"Graph adjacency refresh failed: {e}")
+        try:
+            await asyncio.wait_for(_refresh_event().wait(), settings.GRAPH_CACHE_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def expand_candidates(store, query_embedding, results: List[Dict], filters: Optional[Dict] = None) -> List[Dict]:
+    """
+    Returns the chunks of the graph neighbours of the top results' pages that
+    best match the query, in the shape of store.search() results. Empty when
+    expansion is off, the cache is not built yet, or it takes longer than
+    GRAPH_EXPANSION_TIMEOUT_MS.
+    """
+    adjacency = _adjacency
+    if not settings.GRAPH_EXPANSION_ENABLED or adjacency is None or not results:
+        return []
+    started = time.perf_counter()
+    seeds = list(dict.fromkeys(r["page_url"] for r in results[:settings.GRAPH_EXPANSION_SEEDS]))
+    pages = adjacency.expand(seeds, settings.GRAPH_EXPANSION_MAX_PAGES)
+
+    found, outcome = [], "expanded"
+    if not pages:
+        outcome = "no_neighbours"
+    else:
+        try:
+            found = await asyncio.wait_for(
+                store.search_pages(query_embedding, pages, top_k=settings.GRAPH_EXPANSION_MAX_CHUNKS, filters=filters),
+                settings.GRAPH_EXPANSION_TIMEOUT_MS / 1000.0,
+            )
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+        except Exception as e:
+            # Expansion only adds candidates; retrieval goes on without them.
+            logger.warning(f"Graph expansion failed: {e}")
+            outcome = "error"
+    GRAPH_EXPANSIONS.labels(outcome=outcome).inc()
+    GRAPH_EXPANSION_LATENCY.observe(time.perf_counter() - started)
+    return found
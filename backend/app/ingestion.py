@@ -1,14 +1,20 @@
+import asyncio
 import uuid
 import logging
-from typing import List, Dict
+from collections import deque
+from typing import List, Dict, Tuple
+from urllib.parse import urldefrag, urljoin, urlparse
 
-from bs4 import BeautifulSoup
+import numpy as np
+from bs4 import BeautifulSoup, SoupStrainer
 from readability import Document
 
+from .config import settings
 from .crawler_robust import crawl
-from .embeddings import get_embeddings_for_texts, get_embedding_for_text
-from .graph import add_page_node
-from .jobs import update_job_status, update_job_sub_step
+from .embedding_cache import get_embeddings_cached
+from .graph import add_page_node, set_page_links
+from .graph_expansion import request_graph_refresh
+from .jobs import update_job_stats, update_job_status, update_job_sub_step
 from .monitoring import CRAWL_PAGES, INGESTED_PAGES
 from .vectorstore_faiss_prod import get_store # Use the singleton getter
 
@@ -19,6 +25,8 @@ logger = logging.getLogger(__name__)
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 100
 EMBEDDING_BATCH_SIZE = 32
+PAGE_PIPELINE_DEPTH = max(2, 2 * settings.EMBEDDING_WORKERS)
+MAX_PAGE_LINKS = 200
 
 # --- Helper Functions ---
 def extract_main_text(html: str) -> dict:
@@ -29,6 +37,17 @@ def extract_main_text(html: str) -> dict:
     txt = BeautifulSoup(summary, "html.parser").get_text(separator="\n", strip=True)
     return {"title": title, "text": txt}
 
+def extract_links(html: str, base_url: str) -> List[str]:
+    """The distinct http(s) pages a page links to, without fragments, in document order."""
+    links = {}
+    for a in BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a", href=True)).find_all("a", href=True):
+        link = urldefrag(urljoin(base_url, a["href"].strip()))[0]
+        if urlparse(link).scheme in ("http", "https") and link != base_url:
+            links[link] = None
+            if len(links) >= MAX_PAGE_LINKS:
+                break
+    return list(links)
+
 def chunk_text(text: str, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> List[str]:
     """Splits a long text into smaller, overlapping chunks."""
     tokens = text.split()
@@ -43,20 +62,56 @@ def chunk_text(text: str, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP) -> List[
     return chunks
 
 
+async def _embed_chunks(chunks: List[str]) -> Tuple[np.ndarray, int]:
+    """
+    Embeds a page's chunks in batches of EMBEDDING_BATCH_SIZE, all submitted
+    at once so they spread across the embedding workers. Chunks seen before
+    (on this page or any other) come from the embedding cache. Batches are
+    written straight into one (chunks, dim) array, which the vector store
+    takes without further copies.
+    """
+    results = await asyncio.gather(*[
+        get_embeddings_cached(chunks[j:j + EMBEDDING_BATCH_SIZE])
+        for j in range(0, len(chunks), EMBEDDING_BATCH_SIZE)
+    ])
+    embeddings = np.empty((len(chunks), results[0][0].shape[1]), dtype="float32")
+    for j, (batch_embeddings, _) in zip(range(0, len(chunks), EMBEDDING_BATCH_SIZE), results):
+        embeddings[j:j + len(batch_embeddings)] = batch_embeddings
+    return embeddings, sum(hits for _, hits in results)
+
+
+async def _prepare_page(page: Dict) -> Dict:
+    """Extracts, chunks and embeds one crawled page off the event loop."""
+    meta = await asyncio.to_thread(extract_main_text, page["html"])
+    text = meta.get("text") or ""
+    prepared = {"title": meta.get("title") or page["url"], "text_length": len(text), "chunks": [], "cache_hits": 0}
+    prepared["links"] = await asyncio.to_thread(extract_links, page["html"], page["url"])
+    if text.strip():
+        prepared["chunks"] = chunk_text(text)
+    if prepared["chunks"]:
+        prepared["embeddings"], prepared["cache_hits"] = await _embed_chunks(prepared["chunks"])
+    return prepared
+
+
 # --- Main Ingestion Logic ---
 async def ingest_urls(urls: List[str], job_id: str, max_pages: int = 20, max_depth: int = 2):
     """
     Crawls and ingests URLs, updating the job status with granular sub-steps and detailed logging.
     """
+    pending = deque()
     try:
         update_job_status(job_id, "running", f"Starting crawl (max pages: {max_pages}, max depth: {max_depth})...")
-        raw_pages = await crawl(urls, max_pages=max_pages, max_depth=max_depth)
+        def crawl_progress(pages: int, pages_per_sec: float):
+            update_job_status(job_id, "running", f"Crawling: {pages}/{max_pages} pages ({pages_per_sec:.2f} pages/sec)...")
+            update_job_stats(job_id, crawled_pages=pages, crawl_pages_per_sec=round(pages_per_sec, 2))
+
+        raw_pages = await crawl(urls, max_pages=max_pages, max_depth=max_depth, on_progress=crawl_progress)
         
         if not raw_pages:
             update_job_status(job_id, "failed", "No pages found or all pages failed to crawl.")
             return
 
-        summary = {"pages": 0, "chunks": 0}
+        summary = {"pages": 0, "chunks": 0, "cache_hits": 0}
         total_pages = len(raw_pages)
         
         sub_step_template = [
@@ -65,81 +120,74 @@ async def ingest_urls(urls: List[str], job_id: str, max_pages: int = 20, max_dep
             {"name": "Upserting to Vector Store", "status": "pending", "detail": ""},
         ]
 
-        for i, page in enumerate(raw_pages):
-            main_progress_text = f"Processing page {i+1}/{total_pages}: {page['url']}"
+        # Pages are extracted and embedded up to PAGE_PIPELINE_DEPTH ahead of
+        # the one being upserted, so every embedding worker has work queued.
+        next_page = 0
+        for i in range(total_pages):
+            while next_page < total_pages and len(pending) < PAGE_PIPELINE_DEPTH:
+                pending.append(asyncio.create_task(_prepare_page(raw_pages[next_page])))
+                next_page += 1
+
+            url = raw_pages[i]["url"]
+            main_progress_text = f"Processing page {i+1}/{total_pages}: {url}"
             update_job_status(job_id, "running", main_progress_text, sub_steps=sub_step_template)
-            
-            url = page["url"]
-            html = page["html"]
             CRAWL_PAGES.inc()
-            
-            # --- Step 1: Extract & Chunk ---
+
+            # --- Steps 1 & 2: Extract & Chunk, Generate Embeddings ---
             update_job_sub_step(job_id, "Extracting & Chunking", "running")
-            meta = extract_main_text(html)
-            title = meta.get("title") or url
-            text = meta.get("text") or ""
-            
-            if not text.strip():
+            update_job_sub_step(job_id, "Generating Embeddings", "running", "Waiting for embedding workers...")
+            prepared = await pending.popleft()
+            title = prepared["title"]
+            chunks = prepared["chunks"]
+
+            if not chunks:
+                # A re-crawled page that lost its text drops its old chunks;
+                # for a page never stored before this is a no-op.
+                await get_store().replace_page(url, [], np.empty((0, 0), dtype="float32"))
                 for step in sub_step_template:
                     update_job_sub_step(job_id, step["name"], "completed", "Skipped (empty page)")
                 continue
 
-            chunks = chunk_text(text)
-            
-            logger.info(f"Job {job_id}: Page '{title}' | Extracted text length: {len(text)} chars | Created {len(chunks)} chunks.")
-
+            logger.info(f"Job {job_id}: Page '{title}' | Extracted text length: {prepared['text_length']} chars | Created {len(chunks)} chunks.")
             update_job_sub_step(job_id, "Extracting & Chunking", "completed", f"{len(chunks)} chunks found")
 
-            # --- Step 2: Generate Embeddings (with smart logic) ---
-            update_job_sub_step(job_id, "Generating Embeddings", "running", "Preparing...")
-            
-            all_chunk_texts = chunks
-            all_embeddings = []
-            total_chunks = len(all_chunk_texts)
-
-            if total_chunks == 1:
-                progress_detail = "(1/1 chunks)"
-                update_job_sub_step(job_id, "Generating Embeddings", "running", progress_detail)
-                logger.info(f"Job {job_id}: Using fast path for single chunk on page {url}")
-                embedding = get_embedding_for_text(all_chunk_texts[0])
-                all_embeddings.append(embedding)
-            elif total_chunks > 1:
-                for j in range(0, total_chunks, EMBEDDING_BATCH_SIZE):
-                    batch_texts = all_chunk_texts[j:j + EMBEDDING_BATCH_SIZE]
-                    batch_embeddings = get_embeddings_for_texts(batch_texts)
-                    all_embeddings.extend(batch_embeddings)
-                    
-                    progress_detail = f"({min(j + EMBEDDING_BATCH_SIZE, total_chunks)}/{total_chunks} chunks)"
-                    update_job_sub_step(job_id, "Generating Embeddings", "running", progress_detail)
-                    logger.info(f"Job {job_id}: Embedding progress {progress_detail} for page {url}")
-
-            update_job_sub_step(job_id, "Generating Embeddings", "completed", f"{total_chunks} embeddings generated")
+            cache_hits = prepared["cache_hits"]
+            summary["cache_hits"] += cache_hits
+            update_job_sub_step(
+                job_id, "Generating Embeddings", "completed",
+                f"{len(chunks)} embeddings generated ({cache_hits} from cache, {cache_hits / len(chunks):.0%} hit rate)",
+            )
 
             # --- Step 3: Upsert to Vector Store ---
             update_job_sub_step(job_id, "Upserting to Vector Store", "running")
             to_upsert = []
-            for k, chunk in enumerate(all_chunk_texts):
+            for chunk in chunks:
                 to_upsert.append({
                     "uuid": str(uuid.uuid4()), 
                     "page_url": url, 
                     "title": title,
                     "text": chunk,
-                    "embedding": all_embeddings[k]
                 })
 
-            if to_upsert:
-                # This is now an async function and must be awaited.
-                await get_store().upsert_chunks(to_upsert)
-                add_page_node(url, title)
-                INGESTED_PAGES.inc(len(to_upsert))
-                summary["pages"] += 1
-                summary["chunks"] += len(to_upsert)
+            # Re-crawled pages swap out their previous chunks atomically.
+            await get_store().replace_page(url, to_upsert, prepared["embeddings"])
+            add_page_node(url, title)
+            set_page_links(url, prepared["links"])
+            INGESTED_PAGES.inc(len(to_upsert))
+            summary["pages"] += 1
+            summary["chunks"] += len(to_upsert)
             update_job_sub_step(job_id, "Upserting to Vector Store", "completed")
 
-        final_progress = f"Completed. Ingested {summary['pages']} pages and {summary['chunks']} chunks."
+        final_progress = (
+            f"Completed. Ingested {summary['pages']} pages and {summary['chunks']} chunks "
+            f"({summary['cache_hits']} embeddings served from cache)."
+        )
         update_job_status(job_id, "completed", final_progress, sub_steps=[])
+        request_graph_refresh()
         logger.info(f"Job {job_id} completed: {final_progress}")
 
     except Exception as e:
         logger.exception(f"Job {job_id} failed: {e}")
+        for task in pending:
+            task.cancel()
         update_job_status(job_id, "failed", f"An error occurred: {str(e)}")
\ No newline at end of file
@@ -39,6 +39,11 @@ def update_job_status(job_id: str, status: str, main_progress: str = "", sub_ste
         if sub_steps is not None: # Allows resetting the steps for a new page
             job["sub_steps"] = sub_steps
 
+def update_job_stats(job_id: str, **stats):
+    """Records numeric progress figures for a job, e.g. its crawl rate."""
+    if job_id in _jobs:
+        _jobs[job_id].setdefault("stats", {}).update(stats)
+
 def update_job_sub_step(job_id: str, step_name: str, step_status: str, detail: str = ""):
     """Updates the status and detail of a specific sub-step for a job."""
     if job_id in _jobs:
@@ -8,6 +8,7 @@ os.environ["MKL_NUM_THREADS"] = "1"
 
 # then the rest of your imports and app code
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,10 +16,13 @@ import uvicorn
 
 from .api_routes import router
 from .config import settings
+from .embedding_pool import shutdown_embedding_pool, start_embedding_pool
 from .embeddings import load_model_on_startup
+from .graph_expansion import run_graph_refresher
 from .reranker import load_reranker_model_on_startup, warmup_reranker
 from .logging import logger
 from .monitoring import IN_PROGRESS_REQUESTS, REQUEST_COUNT
+from .vectorstore_faiss_prod import run_reload_watcher, run_snapshot_scheduler, snapshot_store
 
 # --- Lifespan Manager ---
 # This is the modern FastAPI way to handle startup and shutdown events.
@@ -34,12 +38,29 @@ async def lifespan(app: FastAPI):
     load_model_on_startup()
     load_reranker_model_on_startup()
     warmup_reranker() # This prevents a deadlock on the first reranker request
+    # Ingestion's embedding workers load their own copies of the model.
+    await start_embedding_pool()
+
+    # Writers compact the vector log into the index file on a fixed schedule;
+    # read-only workers instead watch for the snapshots the writer publishes.
+    if settings.FAISS_MMAP_READONLY:
+        snapshot_task = asyncio.create_task(run_reload_watcher())
+    else:
+        snapshot_task = asyncio.create_task(run_snapshot_scheduler())
+    # Graph expansion reads page neighbourhoods from an in-memory cache of the graph.
+    graph_task = asyncio.create_task(run_graph_refresher()) if settings.GRAPH_EXPANSION_ENABLED else None
     
     # The 'yield' keyword passes control back to FastAPI to start serving requests.
     yield
     
     # This code runs ONCE when the application is shutting down.
     logger.info("--- Application Shutdown ---")
+    snapshot_task.cancel()
+    if graph_task is not None:
+        graph_task.cancel()
+    shutdown_embedding_pool()
+    if not settings.FAISS_MMAP_READONLY:
+        await snapshot_store(force=True)
 
 
 # --- FastAPI App Initialization ---
@@ -0,0 +1,482 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+from .cache import get_redis
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_metadata_store = None
+
+# Filters understood by select_ids(); see SearchFilters in api_routes.
+FILTER_KEYS = ("domain", "url_prefix", "title", "ingested_after", "ingested_before")
+
+# Set once the Redis attribute indexes cover every meta:{id} key.
+_REDIS_INDEXED_KEY = "meta_indexed"
+
+
+class UnsupportedFilterError(ValueError):
+    """A search filter the configured metadata backend cannot evaluate."""
+
+
+def normalize_domain(value: str) -> str:
+    """Lower-cased host name without a leading "www.", from a URL or a bare domain."""
+    host = urlparse(value).hostname if "://" in value else value.split("/")[0]
+    host = (host or "").lower().rstrip(".")
+    return host[4:] if host.startswith("www.") else host
+
+
+def domain_matches(domain: str, wanted: str) -> bool:
+    """True if domain is the wanted domain or one of its subdomains."""
+    return domain == wanted or domain.endswith("." + wanted)
+
+
+class LocalMetadataStore:
+    """
+    Chunk metadata kept next to the FAISS index, keyed by FAISS id.
+
+    Scalar columns live in a SQLite table; chunk text is appended to a blob
+    file and addressed by (offset, length), so a lookup is a primary-key
+    query plus a slice of a memory map: no network hop and no JSON decoding.
+    The indexed domain, page_url and ingested_at columns double as the
+    attribute index that search filters are resolved against.
+
+    Compaction writes the blob under a new generation (`<text_path>.<n>`,
+    recorded as the database's user_version) rather than over the old file,
+    so read-only workers still holding the old blob mapped notice the new
+    generation in the same query that returns the new offsets.
+    """
+
+    def __init__(self, db_path: str, text_path: str, read_only: bool = False):
+        self.db_path = db_path
+        self.text_path = text_path
+        self.read_only = read_only
+        self._conn_lock = threading.Lock()
+        self._text_map: Optional[mmap.mmap] = None
+        self._map_generation = None
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id INTEGER PRIMARY KEY, uuid TEXT, page_url TEXT, title TEXT,"
+                " text_offset INTEGER, text_length INTEGER, ingested_at REAL, domain TEXT)"
+            )
+            self._add_domain_column()
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_page_url ON chunks (page_url)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_domain ON chunks (domain)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_ingested_at ON chunks (ingested_at)")
+            self._conn.commit()
+        self._generation = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if not read_only:
+            open(self._blob_path(self._generation), "ab").close()
+
+    def _blob_path(self, generation: int) -> str:
+        return f"{self.text_path}.{generation}" if generation else self.text_path
+
+    def _add_domain_column(self):
+        """Upgrades tables created before filtered search existed."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if "domain" in columns:
+            return
+        self._conn.execute("ALTER TABLE chunks ADD COLUMN domain TEXT")
+        pages = [row[0] for row in self._conn.execute("SELECT DISTINCT page_url FROM chunks")]
+        self._conn.executemany(
+            "UPDATE chunks SET domain = ? WHERE page_url = ?",
+            [(normalize_domain(url or ""), url) for url in pages],
+        )
+        logger.info(f"Added the domain column to {self.db_path} for {len(pages)} pages.")
+
+    def _text(self, offset: int, length: int, generation: int) -> str:
+        if not length:
+            return ""
+        if (
+            self._text_map is None or generation != self._map_generation
+            or offset + length > len(self._text_map)
+        ):
+            # A blob only grows; remap to pick up text appended since, or to
+            # switch to the blob a compaction wrote.
+            if self._text_map is not None:
+                self._text_map.close()
+            with open(self._blob_path(generation), "rb") as fh:
+                self._text_map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_generation = generation
+        return self._text_map[offset:offset + length].decode("utf-8")
+
+    def refresh(self):
+        """Drops the text mapping, e.g. after the writer compacted the blob."""
+        with self._conn_lock:
+            if self._text_map is not None:
+                self._text_map.close()
+                self._text_map = None
+
+    def _put_many(self, rows: List[Dict]):
+        now = time.time()
+        records = []
+        with open(self._blob_path(self._generation), "ab") as fh:
+            offset = fh.tell()
+            for row in rows:
+                data = (row.get("text") or "").encode("utf-8")
+                fh.write(data)
+                page_url = row.get("page_url")
+                records.append((
+                    row["id"], row["uuid"], page_url, row.get("title"), offset, len(data), now,
+                    normalize_domain(page_url or ""),
+                ))
+                offset += len(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        with self._conn_lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks"
+                " (id, uuid, page_url, title, text_offset, text_length, ingested_at, domain)"
+                " VALUES (?,?,?,?,?,?,?,?)",
+                records,
+            )
+            self._conn.commit()
+
+    async def put_many(self, rows: List[Dict]):
+        await asyncio.to_thread(self._put_many, rows)
+
+    def _get_many(self, ids: List[int]) -> List[Optional[Dict]]:
+        placeholders = ",".join("?" * len(ids))
+        with self._conn_lock:
+            # The blob generation comes from the same statement, hence the same
+            # snapshot, as the offsets into it.
+            found = self._conn.execute(
+                "SELECT id, uuid, page_url, title, text_offset, text_length, ingested_at,"
+                " (SELECT user_version FROM pragma_user_version)"
+                f" FROM chunks WHERE id IN ({placeholders})",
+                [int(i) for i in ids],
+            ).fetchall()
+            # Text is sliced under the lock so no other thread remaps the blob
+            # between reading an offset and reading the bytes it points at.
+            by_id = {
+                row[0]: {
+                    "uuid": row[1], "page_url": row[2], "title": row[3],
+                    "text": self._text(row[4], row[5], row[7]), "ingested_at": row[6],
+                }
+                for row in found
+            }
+        return [by_id.get(int(i)) for i in ids]
+
+    async def get_many(self, ids: List[int]) -> List[Optional[Dict]]:
+        """Returns metadata for each id, in order, with None for unknown ids."""
+        if not ids:
+            return []
+        return await asyncio.to_thread(self._get_many, ids)
+
+    def _ids_for_page(self, page_url: str) -> List[int]:
+        with self._conn_lock:
+            rows = self._conn.execute("SELECT id FROM chunks WHERE page_url = ?", (page_url,)).fetchall()
+        return [row[0] for row in rows]
+
+    async def ids_for_page(self, page_url: str) -> List[int]:
+        """Reverse index: every chunk id currently stored for a page."""
+        return await asyncio.to_thread(self._ids_for_page, page_url)
+
+    def _select_ids(self, filters: Dict) -> np.ndarray:
+        clauses, args = [], []
+        if filters.get("domain"):
+            domain = normalize_domain(filters["domain"])
+            clauses.append("(domain = ? OR domain GLOB ?)")
+            args += [domain, "*." + domain]
+        if filters.get("url_prefix"):
+            # A range scan on the page_url index; LIKE would not use it.
+            clauses.append("page_url >= ? AND page_url < ?")
+            args += [filters["url_prefix"], filters["url_prefix"] + "\U0010ffff"]
+        if filters.get("title"):
+            escaped = re.sub(r"([\\%_])", r"\\\1", filters["title"])
+            clauses.append("title LIKE ? ESCAPE '\\'")
+            args.append(f"%{escaped}%")
+        if filters.get("ingested_after") is not None:
+            clauses.append("ingested_at >= ?")
+            args.append(filters["ingested_after"])
+        if filters.get("ingested_before") is not None:
+            clauses.append("ingested_at < ?")
+            args.append(filters["ingested_before"])
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._conn_lock:
+            rows = self._conn.execute(f"SELECT id FROM chunks{where} ORDER BY id", args).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype="int64", count=len(rows))
+
+    async def select_ids(self, filters: Dict) -> np.ndarray:
+        """Sorted ids of every chunk matching the filters (see FILTER_KEYS)."""
+        return await asyncio.to_thread(self._select_ids, filters)
+
+    def _delete_many(self, ids: List[int]):
+        with self._conn_lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(i),) for i in ids])
+            self._conn.commit()
+
+    async def delete_many(self, ids: List[int]):
+        if ids:
+            await asyncio.to_thread(self._delete_many, ids)
+
+    def _compact(self):
+        """
+        Rewrites the text blob without the text of deleted chunks into the
+        next generation and vacuums the table. The caller guarantees no
+        concurrent writers; readers are only blocked for the offset update.
+        """
+        with self._conn_lock:
+            rows = self._conn.execute("SELECT id, text_offset, text_length FROM chunks ORDER BY text_offset").fetchall()
+        generation = self._generation
+        updates = []
+        with open(self._blob_path(generation), "rb") as src, open(self._blob_path(generation + 1), "wb") as dst:
+            for chunk_id, offset, length in rows:
+                src.seek(offset)
+                updates.append((dst.tell(), chunk_id))
+                dst.write(src.read(length))
+            dst.flush()
+            os.fsync(dst.fileno())
+        with self._conn_lock:
+            self._conn.executemany("UPDATE chunks SET text_offset = ? WHERE id = ?", updates)
+            self._conn.execute(f"PRAGMA user_version = {generation + 1}")
+            self._conn.commit()
+            self._generation = generation + 1
+            if self._text_map is not None:
+                self._text_map.close()
+                self._text_map = None
+        # Workers may still read the previous generation with offsets fetched
+        # just before the update; only the one before that is unreachable.
+        if generation and os.path.exists(self._blob_path(generation - 1)):
+            os.remove(self._blob_path(generation - 1))
+        # On its own connection: in WAL mode readers keep going meanwhile.
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    async def compact(self):
+        await asyncio.to_thread(self._compact)
+
+    def _clear(self):
+        # A fresh generation rather than a truncated blob: workers may still
+        # have the old one mapped and would read past its new end.
+        generation = self._generation
+        open(self._blob_path(generation + 1), "wb").close()
+        with self._conn_lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute(f"PRAGMA user_version = {generation + 1}")
+            self._conn.commit()
+            self._generation = generation + 1
+            if self._text_map is not None:
+                self._text_map.close()
+                self._text_map = None
+        for old in (generation - 1, generation):
+            if old >= 0 and os.path.exists(self._blob_path(old)):
+                os.remove(self._blob_path(old))
+
+    async def clear(self):
+        await asyncio.to_thread(self._clear)
+
+
+class RedisMetadataStore:
+    """
+    The original layout: one `meta:{id}` JSON string per chunk in Redis,
+    with a `page_ids:{url}` set per page.
+
+    Search filters resolve through attribute indexes kept next to them: a
+    `domain_ids:{domain}` set per domain (the domains themselves in
+    `domains`), the `ingested_at` sorted set scored by ingest time, and the
+    `page_urls` sorted set whose lexicographic ranges answer URL prefixes.
+    Stores written before these existed are indexed once, on first use.
+    """
+
+    def __init__(self):
+        self._indexed = False
+        self._index_lock = asyncio.Lock()
+
+    async def _client(self):
+        redis_client = await get_redis()
+        if not redis_client:
+            raise ConnectionError("Redis is not available for vector store metadata.")
+        return redis_client
+
+    async def _ensure_indexed(self, redis_client):
+        """Builds the attribute indexes from the meta:{id} keys, once per store."""
+        if self._indexed:
+            return
+        async with self._index_lock:
+            if self._indexed or await redis_client.exists(_REDIS_INDEXED_KEY):
+                self._indexed = True
+                return
+            logger.info("Indexing Redis chunk metadata for filtered search.")
+            batch = []
+            async for key in redis_client.scan_iter(match="meta:*", count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    await self._index_keys(redis_client, batch)
+                    batch = []
+            if batch:
+                await self._index_keys(redis_client, batch)
+            await redis_client.set(_REDIS_INDEXED_KEY, 1)
+            self._indexed = True
+
+    async def _index_keys(self, redis_client, keys: List[str]):
+        values = await redis_client.mget(keys)
+        async with redis_client.pipeline() as pipe:
+            for key, value in zip(keys, values):
+                if value:
+                    await self._queue_index(pipe, int(key[len("meta:"):]), json.loads(value))
+            await pipe.execute()
+
+    @staticmethod
+    async def _queue_index(pipe, chunk_id: int, meta: Dict):
+        page_url = meta.get("page_url")
+        domain = normalize_domain(page_url or "")
+        await pipe.sadd(f"page_ids:{page_url}", chunk_id)
+        await pipe.zadd("page_urls", {page_url or "": 0})
+        await pipe.sadd(f"domain_ids:{domain}", chunk_id)
+        await pipe.sadd("domains", domain)
+        await pipe.zadd("ingested_at", {chunk_id: meta.get("ingested_at") or 0.0})
+
+    async def put_many(self, rows: List[Dict]):
+        redis_client = await self._client()
+        await self._ensure_indexed(redis_client)
+        now = time.time()
+        async with redis_client.pipeline() as pipe:
+            for row in rows:
+                meta = {
+                    "uuid": row["uuid"],
+                    "page_url": row.get("page_url"),
+                    "title": row.get("title"),
+                    "text": row.get("text"),
+                    "ingested_at": now,
+                }
+                await pipe.set(f"meta:{row['id']}", json.dumps(meta))
+                await self._queue_index(pipe, row["id"], meta)
+            await pipe.execute()
+
+    async def get_many(self, ids: List[int]) -> List[Optional[Dict]]:
+        if not ids:
+            return []
+        redis_client = await self._client()
+        values = await redis_client.mget([f"meta:{int(i)}" for i in ids])
+        return [json.loads(v) if v else None for v in values]
+
+    async def select_ids(self, filters: Dict) -> np.ndarray:
+        """
+        Resolves domain, URL-prefix and ingest-time filters through the
+        attribute indexes. Title filters need the local backend.
+        """
+        if filters.get("title"):
+            raise UnsupportedFilterError("Filtering on title requires METADATA_BACKEND=local.")
+        redis_client = await self._client()
+        await self._ensure_indexed(redis_client)
+        matches = []
+        if filters.get("domain"):
+            wanted = normalize_domain(filters["domain"])
+            domains = [d for d in await redis_client.smembers("domains") if domain_matches(d, wanted)]
+            matches.append(await redis_client.sunion([f"domain_ids:{d}" for d in domains]) if domains else set())
+        if filters.get("url_prefix"):
+            prefix = filters["url_prefix"]
+            urls = await redis_client.zrangebylex("page_urls", f"[{prefix}", f"[{prefix}\U0010ffff")
+            matches.append(await redis_client.sunion([f"page_ids:{url}" for url in urls]) if urls else set())
+        after, before = filters.get("ingested_after"), filters.get("ingested_before")
+        if after is not None or before is not None or not matches:
+            low = after if after is not None else "-inf"
+            high = f"({before}" if before is not None else "+inf"
+            matches.append(await redis_client.zrangebyscore("ingested_at", low, high))
+        ids = set.intersection(*[{int(i) for i in found} for found in matches])
+        return np.sort(np.fromiter(ids, dtype="int64", count=len(ids)))
+
+    async def ids_for_page(self, page_url: str) -> List[int]:
+        redis_client = await self._client()
+        return [int(i) for i in await redis_client.smembers(f"page_ids:{page_url}")]
+
+    async def delete_many(self, ids: List[int]):
+        if not ids:
+            return
+        redis_client = await self._client()
+        await self._ensure_indexed(redis_client)
+        metas = await self.get_many(ids)
+        pages = set()
+        async with redis_client.pipeline() as pipe:
+            for chunk_id, meta in zip(ids, metas):
+                if meta:
+                    page_url = meta.get("page_url")
+                    pages.add(page_url)
+                    await pipe.srem(f"page_ids:{page_url}", chunk_id)
+                    await pipe.srem(f"domain_ids:{normalize_domain(page_url or '')}", chunk_id)
+                await pipe.zrem("ingested_at", chunk_id)
+                await pipe.delete(f"meta:{int(chunk_id)}")
+            await pipe.execute()
+        # Pages left without chunks drop out of the URL index; a stale entry
+        # in `domains` only costs an empty set lookup.
+        pages = list(pages)
+        if pages:
+            sizes = await asyncio.gather(*[redis_client.scard(f"page_ids:{url}") for url in pages])
+            empty = [url or "" for url, size in zip(pages, sizes) if not size]
+            if empty:
+                await redis_client.zrem("page_urls", *empty)
+
+    async def compact(self):
+        # Redis frees deleted keys itself.
+        pass
+
+    def refresh(self):
+        pass
+
+    async def clear(self):
+        # reset_store() flushes the whole Redis database.
+        pass
+
+
+def _resolve_backend() -> str:
+    backend = settings.METADATA_BACKEND
+    if backend != "auto":
+        return backend
+    if os.path.exists(settings.FAISS_INDEX_PATH) and not os.path.exists(settings.FAISS_META_DB_PATH):
+        logger.warning(
+            f"{settings.FAISS_INDEX_PATH} predates the local metadata store; keeping chunk metadata in Redis. "
+            "Reset the knowledge base to switch to the local store."
+        )
+        return "redis"
+    return "local"
+
+
+def get_metadata_store():
+    """
+    Returns the metadata backend selected by METADATA_BACKEND ("local",
+    "redis" or "auto").
+    """
+    global _metadata_store
+    if _metadata_store is None:
+        backend = _resolve_backend()
+        if backend == "redis":
+            _metadata_store = RedisMetadataStore()
+        elif backend == "local":
+            _metadata_store = LocalMetadataStore(
+                settings.FAISS_META_DB_PATH, settings.FAISS_META_TEXT_PATH, read_only=settings.FAISS_MMAP_READONLY
+            )
+        else:
+            raise ValueError(
+                f"Unsupported METADATA_BACKEND: {settings.METADATA_BACKEND!r}. Expected 'auto', 'local' or 'redis'."
+            )
+    return _metadata_store
+
+
+def reset_metadata_store():
+    """
+    Forgets the backend instance after a knowledge base reset, so that "auto"
+    moves a store that was kept on Redis to the local backend.
+    """
+    # Not closed: searches that started before the reset may still use it.
+    global _metadata_store
+    _metadata_store = None
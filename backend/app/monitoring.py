@@ -8,13 +8,52 @@ CACHE_HITS = Counter('app_cache_hits_total', 'Cache hits')
 CACHE_MISSES = Counter('app_cache_misses_total', 'Cache misses')
 CRAWL_PAGES = Counter('app_crawl_pages_total', 'Total pages crawled')
 INGESTED_PAGES = Counter('app_ingested_pages_total', 'Total pages ingested')
+EMBEDDING_CACHE_HITS = Counter('app_embedding_cache_hits_total', 'Chunk embeddings served from the embedding cache')
+EMBEDDING_CACHE_MISSES = Counter('app_embedding_cache_misses_total', 'Chunk embeddings computed by the model')
+QUERY_EMBEDDING_CACHE_HITS = Counter('app_query_embedding_cache_hits_total', 'Query embeddings served from the LRU cache')
+QUERY_EMBEDDING_CACHE_MISSES = Counter('app_query_embedding_cache_misses_total', 'Query embeddings computed by the model')
+RERANK_CACHE_HITS = Counter('app_rerank_cache_hits_total', 'Cross-encoder scores served from the score cache', ['tier'])
+RERANK_CACHE_MISSES = Counter('app_rerank_cache_misses_total', 'Cross-encoder scores computed by the model')
+RERANK_DECISIONS = Counter('app_rerank_decisions_total', 'Rerank outcomes (skipped_margin, reranked, early_exit, budget_exhausted, shed)', ['decision'])
+GRAPH_EXPANSIONS = Counter('app_graph_expansions_total', 'Graph expansion outcomes (expanded, no_neighbours, timeout, error)', ['outcome'])
+DIVERSIFY_DROPPED = Counter('app_diversify_dropped_total', 'Candidates dropped before reranking (duplicate, page_cap, mmr)', ['reason'])
+SEMANTIC_CACHE_HITS = Counter('app_semantic_cache_hits_total', 'Chat answers served from the semantic answer cache')
+SEMANTIC_CACHE_MISSES = Counter('app_semantic_cache_misses_total', 'Chat queries with no close enough cached answer')
+SEMANTIC_CACHE_SAVED_SECONDS = Counter('app_semantic_cache_saved_seconds_total', 'Retrieval and LLM time that semantic cache hits did not spend')
+COALESCED_REQUESTS = Counter('app_coalesced_requests_total', 'Chat requests served by an identical request already in flight', ['endpoint'])
+CRAWL_ROBOTS_SKIPPED = Counter('app_crawl_robots_skipped_total', 'URLs not crawled because robots.txt disallows them')
+CRAWL_THROTTLED = Counter('app_crawl_throttled_total', 'Crawl fetches answered with 429 or 503')
+MICROBATCH_REJECTED = Counter('app_microbatch_rejected_total', 'Items rejected because the batcher queue was full', ['batcher'])
 
 # Gauges
 IN_PROGRESS_REQUESTS = Gauge('app_inprogress_requests', 'Number of in-progress requests')
 HALLUCINATION_GAUGE = Gauge('app_hallucination_score', 'Last computed hallucination score')
+EMBEDDING_POOL_PENDING = Gauge('app_embedding_pool_pending_batches', 'Chunk batches queued or running on the embedding worker pool')
+GRAPH_ADJACENCY_PAGES = Gauge('app_graph_adjacency_pages', 'Pages with neighbours in the graph adjacency cache')
+SEMANTIC_CACHE_ENTRIES = Gauge('app_semantic_cache_entries', 'Answers held in the semantic answer cache')
 
 # Histograms
 REQUEST_LATENCY = Histogram('app_request_latency_seconds', 'Request latency', ['endpoint'])
+RERANK_LATENCY = Histogram(
+    'app_rerank_latency_seconds', 'Time spent reranking one request', ['decision'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5),
+)
+GRAPH_EXPANSION_LATENCY = Histogram(
+    'app_graph_expansion_latency_seconds', 'Time spent expanding one request through the graph',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.03, 0.05, 0.1, 0.25),
+)
+MICROBATCH_SIZE = Histogram(
+    'app_microbatch_size', 'Items per micro-batch', ['batcher'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+MICROBATCH_QUEUE_DELAY = Histogram(
+    'app_microbatch_queue_delay_seconds', 'Time items wait before their micro-batch runs', ['batcher'],
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+MICROBATCH_PROCESS_SECONDS = Histogram(
+    'app_microbatch_process_seconds', 'Time to process one micro-batch call', ['batcher'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
 
 # Helper decorator for timing
 def observe_latency(endpoint):
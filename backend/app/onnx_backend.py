@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Fixed inputs for the export-time parity check against PyTorch.
+PARITY_QUERIES = [
+    "how do I reset my password",
+    "what is the refund policy for annual plans",
+    "python asyncio event loop blocking",
+    "neo4j graph database pricing",
+]
+PARITY_PASSAGES = [
+    "To reset your password, open Settings, choose Security and click 'Reset password'.",
+    "Annual plans can be refunded within 30 days of purchase; after that, credit is prorated.",
+    "Calling a blocking function inside a coroutine stalls the event loop for every other task.",
+    "Neo4j offers a free community edition and a paid enterprise edition with clustering.",
+    "Our office is closed on public holidays.",
+    "Cookies help us deliver our services. By using our services, you agree to our use of cookies.",
+    "FAISS supports inverted-file and graph-based indexes for approximate nearest neighbour search.",
+    "The weather tomorrow will be mostly sunny with a light breeze from the west.",
+]
+_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+_OPSET = 17
+
+
+def artifact_dir(model_name: str, quantize: bool) -> str:
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name)
+    return os.path.join(settings.ONNX_CACHE_DIR, f"{safe_name}{'--int8' if quantize else ''}")
+
+
+def _session(model_path: str):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = settings.ONNX_NUM_THREADS
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+
+class _OnnxModel:
+    """An exported transformer plus its tokenizer, loaded from an artifact directory."""
+
+    def __init__(self, model_dir: str):
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, "meta.json")) as fh:
+            self.meta = json.load(fh)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _session(os.path.join(model_dir, "model.onnx"))
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.max_length = self.meta["max_length"]
+
+    def _run(self, *texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        tokens = self.tokenizer(
+            *texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feeds = {name: tokens[name].astype("int64") for name in self.input_names}
+        return self.session.run(None, feeds)[0], tokens["attention_mask"]
+
+
+class OnnxSentenceEncoder(_OnnxModel):
+    """Drop-in for SentenceTransformer.encode(): transformer in ONNX Runtime, pooling in numpy."""
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        out = []
+        for start in range(0, len(texts), batch_size):
+            hidden, mask = self._run(list(texts[start:start + batch_size]))
+            out.append(_pool(hidden, mask, self.meta["pooling"], self.meta["normalize"]))
+        if not out:
+            return np.empty((0, self.meta["dim"]), dtype="float32")
+        return np.concatenate(out).astype("float32")
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Drop-in for CrossEncoder.predict() on (query, passage) pairs."""
+
+    def predict(self, pairs: List[Tuple[str, str]], batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        out = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            logits, _ = self._run([p[0] for p in batch], [p[1] for p in batch])
+            out.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+        if not out:
+            return np.empty(0, dtype="float32")
+        scores = np.concatenate(out).astype("float32")
+        if self.meta["activation"] == "sigmoid":
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores
+
+
+def _pool(hidden: np.ndarray, mask: np.ndarray, mode: str, normalize: bool) -> np.ndarray:
+    if mode == "cls":
+        pooled = hidden[:, 0]
+    elif mode == "max":
+        pooled = np.where(mask[..., None] > 0, hidden, -1e9).max(axis=1)
+    else:
+        weights = mask[..., None].astype("float32")
+        pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+    if normalize:
+        pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+    return pooled
+
+
+def _sentence_pipeline(model) -> Dict:
+    """Reads the pooling setup of a SentenceTransformer that the numpy port reproduces."""
+    from sentence_transformers.models import Normalize, Pooling, Transformer
+
+    modules = list(model)
+    if not isinstance(modules[0], Transformer) or len(modules) < 2 or not isinstance(modules[1], Pooling):
+        raise ValueError("Only Transformer + Pooling (+ Normalize) sentence-transformers can be exported.")
+    pooling = modules[1]
+    if pooling.pooling_mode_cls_token:
+        mode = "cls"
+    elif pooling.pooling_mode_max_tokens:
+        mode = "max"
+    elif pooling.pooling_mode_mean_tokens:
+        mode = "mean"
+    else:
+        raise ValueError("Unsupported pooling mode for ONNX export.")
+    extra = modules[2:]
+    if any(not isinstance(m, Normalize) for m in extra):
+        raise ValueError("Only a trailing Normalize module is supported after pooling.")
+    return {"pooling": mode, "normalize": bool(extra), "dim": model.get_sentence_embedding_dimension()}
+
+
+def _cross_encoder_activation(model) -> str:
+    import torch
+
+    activation = getattr(model, "activation_fn", None) or getattr(model, "default_activation_function", None)
+    if activation is None or isinstance(activation, torch.nn.Identity):
+        return "identity"
+    if isinstance(activation, torch.nn.Sigmoid):
+        return "sigmoid"
+    raise ValueError(f"Unsupported cross-encoder activation {activation!r} for ONNX export.")
+
+
+def _export_transformer(hf_model, tokenizer, path: str, *pair: List[str]):
+    import torch
+
+    class _FirstOutput(torch.nn.Module):
+        def __init__(self, model, names):
+            super().__init__()
+            self.model, self.names = model, names
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(self.names, inputs)))[0]
+
+    sample = tokenizer(*pair, padding=True, truncation=True, return_tensors="pt")
+    names = [n for n in _INPUT_NAMES if n in sample]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    # Encoders return per-token hidden states, classifiers one row of logits.
+    dynamic_axes["output"] = {0: "batch", 1: "sequence"} if len(pair) == 1 else {0: "batch"}
+    hf_model = hf_model.to("cpu").eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            _FirstOutput(hf_model, names), tuple(sample[n] for n in names), path,
+            input_names=names, output_names=["output"], dynamic_axes=dynamic_axes,
+            opset_version=_OPSET, do_constant_folding=True,
+        )
+
+
+def _quantize(path: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = path + ".int8"
+    quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, path)
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    rank_a, rank_b = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def sentence_parity(reference, candidate) -> Dict:
+    """Cosine similarity between reference and candidate embeddings of the parity texts."""
+    texts = PARITY_QUERIES + PARITY_PASSAGES
+    ref = np.asarray(reference.encode(texts, show_progress_bar=False), dtype="float32")
+    got = np.asarray(candidate.encode(texts, show_progress_bar=False), dtype="float32")
+    cos = (ref * got).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(got, axis=1))
+    min_cos = float(cos.min())
+    return {"min_cosine": round(min_cos, 5), "passed": min_cos >= settings.ONNX_PARITY_MIN_COSINE}
+
+
+def cross_encoder_parity(reference, candidate) -> Dict:
+    """Score differences and per-query rank agreement on the parity pairs."""
+    pairs = [(q, p) for q in PARITY_QUERIES for p in PARITY_PASSAGES]
+    ref = np.asarray(reference.predict(pairs, show_progress_bar=False), dtype="float32")
+    got = np.asarray(candidate.predict(pairs, show_progress_bar=False), dtype="float32")
+    n = len(PARITY_PASSAGES)
+    rank_corr = min(_spearman(ref[i:i + n], got[i:i + n]) for i in range(0, len(pairs), n))
+    return {
+        "max_abs_diff": round(float(np.abs(ref - got).max()), 5),
+        "min_rank_correlation": round(rank_corr, 5),
+        "passed": rank_corr >= settings.ONNX_PARITY_MIN_RANK_CORRELATION,
+    }
+
+
+def export_model(model_name: str, kind: str, quantize: bool, reference=None) -> str:
+    """
+    Exports model_name to an artifact directory (ONNX graph, tokenizer and
+    meta.json), optionally int8-quantised, and records its parity with the
+    PyTorch model. Returns the directory.
+    """
+    model_dir = artifact_dir(model_name, quantize)
+    tmp_dir = model_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    start_time = time.time()
+
+    if kind == "sentence":
+        if reference is None:
+            from sentence_transformers import SentenceTransformer
+            reference = SentenceTransformer(model_name, device="cpu")
+        meta = _sentence_pipeline(reference)
+        tokenizer, hf_model = reference.tokenizer, reference[0].auto_model
+        max_length = reference.max_seq_length
+        _export_transformer(hf_model, tokenizer, os.path.join(tmp_dir, "model.onnx"), PARITY_PASSAGES[:2])
+    else:
+        if reference is None:
+            from sentence_transformers import CrossEncoder
+            reference = CrossEncoder(model_name, device="cpu")
+        meta = {"activation": _cross_encoder_activation(reference)}
+        tokenizer, hf_model = reference.tokenizer, reference.model
+        max_length = getattr(reference, "max_length", None)
+        _export_transformer(
+            hf_model, tokenizer, os.path.join(tmp_dir, "model.onnx"), PARITY_QUERIES[:2], PARITY_PASSAGES[:2]
+        )
+
+    if quantize:
+        _quantize(os.path.join(tmp_dir, "model.onnx"))
+    tokenizer.save_pretrained(tmp_dir)
+    meta.update({
+        "model": model_name, "kind": kind, "quantized": quantize,
+        "max_length": int(max_length or tokenizer.model_max_length or 512),
+    })
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+        json.dump(meta, fh)
+
+    if settings.ONNX_PARITY_CHECK:
+        candidate = (OnnxSentenceEncoder if kind == "sentence" else OnnxCrossEncoder)(tmp_dir)
+        check = sentence_parity if kind == "sentence" else cross_encoder_parity
+        meta["parity"] = check(reference, candidate)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as fh:
+            json.dump(meta, fh)
+
+    shutil.rmtree(model_dir, ignore_errors=True)
+    os.replace(tmp_dir, model_dir)
+    logger.info(
+        f"Exported '{model_name}' to ONNX{' (int8)' if quantize else ''} in {time.time() - start_time:.1f}s: "
+        f"{model_dir} parity={meta.get('parity')}"
+    )
+    return model_dir
+
+
+def _load(model_name: str, kind: str, reference=None):
+    """
+    Returns the ONNX model for model_name, exporting it on first use, or None
+    (so callers fall back to PyTorch) if ONNX Runtime is unavailable, the
+    export fails, or the artifact failed its parity check.
+    """
+    quantize = settings.ONNX_QUANTIZE
+    model_dir = artifact_dir(model_name, quantize)
+    try:
+        if not os.path.exists(os.path.join(model_dir, "meta.json")):
+            export_model(model_name, kind, quantize, reference)
+        model = (OnnxSentenceEncoder if kind == "sentence" else OnnxCrossEncoder)(model_dir)
+    except ImportError as e:
+        logger.error(f"ONNX backend needs onnx and onnxruntime ({e}); using PyTorch for '{model_name}'.")
+        return None
+    except Exception as e:
+        logger.exception(f"ONNX export of '{model_name}' failed ({e}); using PyTorch.")
+        return None
+
+    parity = model.meta.get("parity")
+    if parity is not None and not parity["passed"]:
+        logger.error(
+            f"ONNX artifact {model_dir} failed its parity check ({parity}); using PyTorch for '{model_name}'. "
+            "Delete the directory to re-export, or set ONNX_QUANTIZE=false."
+        )
+        return None
+    logger.info(f"Serving '{model_name}' with ONNX Runtime ({settings.ONNX_NUM_THREADS} threads) from {model_dir}.")
+    return model
+
+
+def load_sentence_encoder(model_name: str, reference=None) -> Optional[OnnxSentenceEncoder]:
+    return _load(model_name, "sentence", reference)
+
+
+def load_cross_encoder(model_name: str, reference=None) -> Optional[OnnxCrossEncoder]:
+    return _load(model_name, "cross", reference)
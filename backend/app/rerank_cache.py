@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .cache import get_redis
+from .config import settings
+from .embeddings import normalize_text
+from .monitoring import RERANK_CACHE_HITS, RERANK_CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+_rerank_cache = None
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_text(query).encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    """
+    Cross-encoder scores keyed by (normalised query hash, chunk uuid).
+
+    Entries live in a bounded in-process LRU and, when `use_redis` is set
+    and REDIS_URL is configured, in Redis too, so workers share each other's
+    scores. Both tiers expire entries after `ttl` seconds. Re-crawled pages
+    get new chunk uuids, so stale scores are never served for changed text.
+    """
+
+    def __init__(self, model_name: str, max_size: int, ttl: int, use_redis: bool = False):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _redis_key(self, qhash: str, uuid: str) -> str:
+        return f"rerank:{self.model_name}:{qhash}:{uuid}"
+
+    async def get_many(self, qhash: str, uuids: List[str]) -> Dict[str, float]:
+        """The cached score of each uuid that has one."""
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for uuid in uuids:
+                entry = self._entries.get((qhash, uuid))
+                if entry is None:
+                    continue
+                if entry[1] <= now:
+                    del self._entries[(qhash, uuid)]
+                    continue
+                self._entries.move_to_end((qhash, uuid))
+                found[uuid] = entry[0]
+        RERANK_CACHE_HITS.labels(tier="memory").inc(len(found))
+
+        missing = [uuid for uuid in uuids if uuid not in found]
+        redis_client = await get_redis() if self.use_redis and missing else None
+        if redis_client:
+            values = await redis_client.mget([self._redis_key(qhash, uuid) for uuid in missing])
+            from_redis = {uuid: float(v) for uuid, v in zip(missing, values) if v is not None}
+            RERANK_CACHE_HITS.labels(tier="redis").inc(len(from_redis))
+            # Promote into the local tier for the next request.
+            self._put_local(qhash, from_redis)
+            found.update(from_redis)
+
+        RERANK_CACHE_MISSES.inc(len(uuids) - len(found))
+        return found
+
+    async def put_many(self, qhash: str, scores: Dict[str, float]) -> None:
+        self._put_local(qhash, scores)
+        redis_client = await get_redis() if self.use_redis and scores else None
+        if redis_client:
+            pipe = redis_client.pipeline()
+            for uuid, score in scores.items():
+                pipe.set(self._redis_key(qhash, uuid), repr(score), ex=self.ttl)
+            await pipe.execute()
+
+    def _put_local(self, qhash: str, scores: Dict[str, float]) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for uuid, score in scores.items():
+                self._entries[(qhash, uuid)] = (score, expires)
+                self._entries.move_to_end((qhash, uuid))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+def get_rerank_cache(model_name: str) -> Optional[RerankScoreCache]:
+    """The process-wide cache, or None when RERANK_CACHE_ENABLED is off."""
+    global _rerank_cache
+    if not settings.RERANK_CACHE_ENABLED:
+        return None
+    if _rerank_cache is None:
+        _rerank_cache = RerankScoreCache(
+            model_name, settings.RERANK_CACHE_SIZE, settings.RERANK_CACHE_TTL_SECONDS, settings.RERANK_CACHE_REDIS,
+        )
+    return _rerank_cache
@@ -1,9 +1,19 @@
+import asyncio
 import logging
+import time
+from typing import Optional
 from sentence_transformers import CrossEncoder
 
+from .batching import BatcherOverloaded, MicroBatcher
+from .config import settings
+from .monitoring import RERANK_DECISIONS, RERANK_LATENCY
+from .onnx_backend import load_cross_encoder
+from .rerank_cache import get_rerank_cache, query_hash
+
 logger = logging.getLogger(__name__)
 _model = None
 _model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+_batcher = None
 
 def load_reranker_model_on_startup():
     """
@@ -15,7 +25,11 @@ def load_reranker_model_on_startup():
     if _model is None:
         logger.info(f"--- RERANKER MODEL LOAD START (LIFESPAN) ---")
         logger.info(f"Loading reranker model '{_model_name}'...")
-        _model = CrossEncoder(_model_name)
+        if settings.INFERENCE_BACKEND == "onnx":
+            # Falls back to PyTorch if the ONNX model is unusable.
+            _model = load_cross_encoder(_model_name)
+        if _model is None:
+            _model = CrossEncoder(_model_name)
         logger.info(f"--- RERANKER MODEL LOAD COMPLETE ---")
 
 # --- THIS IS THE MISSING FUNCTION ---
@@ -43,23 +57,141 @@ def _get_model():
         warmup_reranker() # Also warm up if loaded lazily
     return _model
 
-def rerank(query: str, candidates: list, top_k: int = 5):
-    """Rerank candidate dicts using a cross-encoder."""
-    if not candidates:
-        return []
-    
+# Running estimate of the cross-encoder's cost per (query, passage) pair,
+# used to size each request's candidate set to its latency budget.
+_pair_seconds = 0.002
+
+def _predict(pairs: list) -> list:
+    global _pair_seconds
     model = _get_model()
-    
-    pairs = []
-    for c in candidates:
-        text = c.get('meta', {}).get('text', '')
-        pairs.append((query, text))
-        
+    started = time.perf_counter()
     # Ensure progress bar is disabled here as well for safety
-    scores = model.predict(pairs, show_progress_bar=False)
-    
-    for c, s in zip(candidates, scores):
-        c['rerank_score'] = float(s)
-        
-    sorted_c = sorted(candidates, key=lambda x: x['rerank_score'], reverse=True)
-    return sorted_c[:top_k]
\ No newline at end of file
+    scores = [float(s) for s in model.predict(pairs, show_progress_bar=False)]
+    _pair_seconds = 0.8 * _pair_seconds + 0.2 * (time.perf_counter() - started) / len(pairs)
+    return scores
+
+def _length_bucket(pair: tuple) -> int:
+    # Power-of-two length classes: pairs batched together pad to similar lengths.
+    return (len(pair[0]) + len(pair[1])).bit_length()
+
+def _get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(
+            "rerank", _predict,
+            max_batch_size=settings.RERANK_SCHEDULER_MAX_BATCH,
+            max_wait_ms=settings.RERANK_SCHEDULER_WAIT_MS,
+            group_key=_length_bucket,
+            max_pending=settings.RERANK_SCHEDULER_MAX_PENDING,
+        )
+    return _batcher
+
+async def _score(pairs: list) -> list:
+    """
+    Scores pairs on the shared rerank scheduler, which merges them with the
+    pairs of concurrent requests into length-bucketed batches on its own
+    inference thread. Raises BatcherOverloaded when its queue is full.
+    """
+    futures = _get_batcher().submit_many(pairs)
+    return await asyncio.gather(*[asyncio.wrap_future(f) for f in futures])
+
+def _vector_score(candidate: dict) -> Optional[float]:
+    return candidate.get('vector_score', candidate.get('score'))
+
+def _margin_is_decisive(candidates: list, top_k: int) -> bool:
+    if settings.RERANK_SKIP_MARGIN <= 0:
+        return False
+    dense = sorted((c for c in candidates if _vector_score(c) is not None), key=_vector_score, reverse=True)
+    if len(dense) <= top_k or {id(c) for c in dense[:top_k]} != {id(c) for c in candidates[:top_k]}:
+        return False
+    return _vector_score(dense[top_k - 1]) - _vector_score(dense[top_k]) >= settings.RERANK_SKIP_MARGIN
+
+def _text(candidate: dict) -> str:
+    return candidate.get('meta', {}).get('text', '')
+
+def _top_uuids(scored: dict, top_k: int) -> set:
+    return set(sorted(scored, key=scored.get, reverse=True)[:top_k])
+
+async def rerank(query: str, candidates: list, top_k: int = 5, info: Optional[dict] = None):
+    """
+    Rerank candidate dicts using a cross-encoder, within a latency budget of
+    RERANK_LATENCY_BUDGET_MS.
+
+    Candidates are considered in order of their retrieval 'score'. When the
+    dense and lexical results agree on the top_k and the vector score gap at
+    the top_k boundary is at least RERANK_SKIP_MARGIN, the cross-encoder is
+    skipped and the retrieval ranking stands. Otherwise the candidate count is
+    sized to the budget from the measured per-pair cost; scores cached for this
+    query and chunk are reused, and the rest are scored in length-sorted
+    rounds of RERANK_BATCH_SIZE on the rerank scheduler. Scoring stops early once a
+    round leaves the top_k unchanged, or when the next round would overrun
+    the budget. If the scheduler is saturated the request sheds load: it
+    keeps the scores it has, or falls back to the vector ranking. The
+    decision, counts and elapsed time are recorded in `info` when given.
+    """
+    info = {} if info is None else info
+    if not candidates:
+        return []
+    started = time.perf_counter()
+    budget = settings.RERANK_LATENCY_BUDGET_MS / 1000.0
+    candidates = sorted(candidates, key=lambda c: c.get('score', 0.0), reverse=True)
+
+    if _margin_is_decisive(candidates, top_k):
+        _record(info, "skipped_margin", started, candidates=len(candidates), scored=0, cached=0)
+        return candidates[:top_k]
+
+    limit = min(len(candidates), max(top_k, int(budget / _pair_seconds)))
+    pool = candidates[:limit]
+    by_uuid = {c.get('meta', {}).get('uuid') or id(c): c for c in pool}
+
+    cache = get_rerank_cache(_model_name)
+    qhash = query_hash(query)
+    scored = await cache.get_many(qhash, [u for u in by_uuid if isinstance(u, str)]) if cache else {}
+    cached = len(scored)
+    pending = [u for u in by_uuid if u not in scored]
+
+    decision = "reranked"
+    top = _top_uuids(scored, top_k) if len(scored) >= top_k else None
+    batch_size = max(top_k - len(scored), settings.RERANK_BATCH_SIZE)
+    while pending:
+        batch, pending = pending[:batch_size], pending[batch_size:]
+        # Shortest first, so that pairs of similar length pad together.
+        batch.sort(key=lambda u: len(_text(by_uuid[u])))
+        round_started = time.perf_counter()
+        try:
+            fresh = dict(zip(batch, await _score([(query, _text(by_uuid[u])) for u in batch])))
+        except BatcherOverloaded:
+            decision = "shed"
+            break
+        scored.update(fresh)
+        if cache:
+            await cache.put_many(qhash, {u: s for u, s in fresh.items() if isinstance(u, str)})
+
+        # This request's own rounds are the freshest cost estimate.
+        pair_seconds = max(_pair_seconds, (time.perf_counter() - round_started) / len(batch))
+        new_top = _top_uuids(scored, top_k)
+        batch_size = settings.RERANK_BATCH_SIZE
+        if not pending:
+            break
+        if new_top == top:
+            decision = "early_exit"
+            break
+        if time.perf_counter() - started + min(batch_size, len(pending)) * pair_seconds > budget:
+            decision = "budget_exhausted"
+            break
+        top = new_top
+
+    _record(info, decision, started, candidates=len(candidates), scored=len(scored) - cached, cached=cached)
+    if len(scored) < min(top_k, len(pool)):
+        # Shed before enough candidates were scored: keep the vector ranking.
+        return candidates[:top_k]
+    for u, score in scored.items():
+        by_uuid[u]['rerank_score'] = score
+    sorted_c = sorted((by_uuid[u] for u in scored), key=lambda x: x['rerank_score'], reverse=True)
+    return sorted_c[:top_k]
+
+def _record(info: dict, decision: str, started: float, **counts):
+    elapsed = time.perf_counter() - started
+    RERANK_DECISIONS.labels(decision=decision).inc()
+    RERANK_LATENCY.labels(decision=decision).observe(elapsed)
+    info.update(decision=decision, elapsed_ms=round(elapsed * 1000, 2), **counts)
@@ -1,33 +1,78 @@
-import logging
 import asyncio
+import logging
+from typing import Dict, List, Optional
 
-from .embeddings import get_embedding_for_text
+from .config import settings
+from .diversify import diversify
+from .embeddings import embed_query
+from .graph_expansion import expand_candidates
 from .reranker import rerank
 from .vectorstore_faiss_prod import get_store
 
 logger = logging.getLogger(__name__)
 
-async def hybrid_retrieve(query: str, top_k: int = 5):
+def _fuse(vec_results: List[Dict], lex_results: List[Dict], graph_results: List[Dict], limit: Optional[int]) -> List[Dict]:
+    """
+    Reciprocal-rank fusion of the dense, BM25 and graph-expansion result
+    lists. Each candidate's 'score' is its fused score; 'vector_score',
+    'lexical_score' and 'graph_score' keep the scores from the lists it
+    appeared in (None where it did not). Keeps the best `limit` (all if None).
+    """
+    k = settings.HYBRID_RRF_K
+    by_id = {}
+    for source, results in (('vector', vec_results), ('lexical', lex_results), ('graph', graph_results)):
+        for rank, r in enumerate(results):
+            c = by_id.get(r['id'])
+            if c is None:
+                c = by_id[r['id']] = {
+                    'type': source, 'score': 0.0, 'vector_score': None, 'lexical_score': None, 'graph_score': None, 'meta': r,
+                }
+            elif c['type'] != source:
+                c['type'] = 'hybrid'
+            c[f'{source}_score'] = r.get('score', 0.0)
+            c['score'] += 1.0 / (k + rank + 1)
+    return sorted(by_id.values(), key=lambda c: c['score'], reverse=True)[:limit]
+
+async def hybrid_retrieve(query: str, top_k: int = 5, filters: Optional[Dict] = None, rerank_info: Optional[Dict] = None):
     """
-    Performs an async vector search and then runs the synchronous, CPU-bound
-    reranker in a separate thread to avoid deadlocks.
+    Runs a dense vector search and a BM25 search in parallel, expands the
+    top vector hits' pages one hop through the knowledge graph, fuses all
+    three by reciprocal rank, diversifies the fused candidates (MMR,
+    near-duplicate and per-page limits) and reranks them; the CPU-bound
+    cross-encoder runs off the event loop. `filters` (domain,
+    url_prefix, title, ingested_after, ingested_before) restrict the search
+    to matching chunks. How the reranker handled the request (decision,
+    candidate counts, time spent) is recorded in `rerank_info` when given.
     """
     store = get_store()
-    
-    # 1. Initial dense vector search (async and non-blocking)
-    q_emb = get_embedding_for_text(query)
-    
-    if not q_emb:
-        logger.error("Failed to generate query embedding. Aborting retrieval.")
-        return []
+    # Fetch more candidates than needed; the reranker decides how many it can afford
+    n_candidates = top_k * settings.RERANK_MAX_CANDIDATE_FACTOR
 
-    # Fetch slightly more candidates for the reranker to work with
-    vec_results = await store.search(q_emb, top_k=top_k * 3)
-    
-    # 2. Convert to a standard candidate format
-    candidates = []
-    for r in vec_results:
-        candidates.append({'type': 'vector', 'score': r.get('score', 0.0), 'meta': r})
+    # 1. Lexical search starts right away; it does not need the query embedding.
+    lexical = asyncio.create_task(store.lexical_search(query, top_k=n_candidates, filters=filters))
+    try:
+        q_emb = await embed_query(query)
+        if q_emb is None or not q_emb.size:
+            logger.error("Failed to generate query embedding. Aborting retrieval.")
+            return []
+        vec_results = await store.search(q_emb, top_k=n_candidates, filters=filters)
+        # 2. Neighbouring pages' chunks join as extra candidates (capped in size and time)
+        graph_results, lex_results = await asyncio.gather(
+            expand_candidates(store, q_emb, vec_results, filters=filters), lexical,
+        )
+    finally:
+        lexical.cancel()
+
+    # 3. Fuse the result lists into the standard candidate format, then
+    # diversify: drop near-duplicates, cap chunks per page, choose by MMR
+    limit = n_candidates + len(graph_results)
+    if settings.MMR_ENABLED:
+        candidates = _fuse(vec_results, lex_results, graph_results, None)
+        if len(candidates) > 1:
+            vectors = await store.vectors_for([c['meta']['id'] for c in candidates])
+            candidates = diversify(candidates, vectors, limit)
+    else:
+        candidates = _fuse(vec_results, lex_results, graph_results, limit)
 
     if not candidates:
         return []
@@ -35,7 +80,7 @@ async def hybrid_retrieve(query: str, top_k: int = 5):
     # --- THIS IS THE FINAL FIX ---
     # The bypass has been removed. We are now re-enabling the call
     # to the reranker, which is the final step in the RAG pipeline.
-    reranked = await asyncio.to_thread(rerank, query=query, candidates=candidates, top_k=top_k)
+    reranked = await rerank(query=query, candidates=candidates, top_k=top_k, info=rerank_info)
     # --- END OF FIX ---
     
     return reranked
\ No newline at end of file
@@ -0,0 +1,129 @@
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import faiss
+import numpy as np
+
+from .config import settings
+from .monitoring import (
+    SEMANTIC_CACHE_ENTRIES, SEMANTIC_CACHE_HITS, SEMANTIC_CACHE_MISSES, SEMANTIC_CACHE_SAVED_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Nearest past queries checked per lookup; entries for other filters or
+# that have expired are skipped over.
+_NEIGHBOURS = 8
+
+_semantic_cache = None
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by the embedding of the query that produced them, so that
+    rephrasings of a recent question ("What is X?", "what's x") are served
+    without retrieval or an LLM call.
+
+    Query embeddings live in a small exact inner-product FAISS index; a
+    lookup returns the closest past query with the same filters whose cosine
+    similarity is at least `threshold`. Entries expire after `ttl` seconds,
+    the least recently used are evicted beyond `max_entries`, and the whole
+    cache is dropped whenever the vector store's content version changes.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: int):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._index = None
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._ids = itertools.count()
+        self._kb_version = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        if self._index is not None:
+            self._index.reset()
+        self._entries.clear()
+        SEMANTIC_CACHE_ENTRIES.set(0)
+
+    def _check_version(self, kb_version: int):
+        if kb_version != self._kb_version:
+            if self._entries:
+                logger.info(f"Knowledge base changed; dropping {len(self._entries)} cached answers.")
+            self.clear()
+            self._kb_version = kb_version
+
+    def _vector(self, embedding) -> np.ndarray:
+        vector = np.array(embedding, dtype="float32", ndmin=2)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def get(self, embedding, filters_key: str, kb_version: int) -> Optional[Dict[str, Any]]:
+        """The cached entry for the closest matching past query, or None."""
+        self._check_version(kb_version)
+        found = None
+        if self._entries:
+            similarities, ids = self._index.search(self._vector(embedding), min(_NEIGHBOURS, len(self._entries)))
+            now = time.monotonic()
+            for similarity, entry_id in zip(similarities[0].tolist(), ids[0].tolist()):
+                if similarity < self.threshold:
+                    break
+                entry = self._entries.get(entry_id)
+                if entry is None or entry["filters_key"] != filters_key:
+                    continue
+                if entry["expires"] <= now:
+                    self._remove([entry_id])
+                    continue
+                self._entries.move_to_end(entry_id)
+                found = dict(entry, similarity=similarity)
+                break
+
+        if found is None:
+            SEMANTIC_CACHE_MISSES.inc()
+            return None
+        SEMANTIC_CACHE_HITS.inc()
+        SEMANTIC_CACHE_SAVED_SECONDS.inc(found["seconds"])
+        return found
+
+    def put(self, embedding, query: str, filters_key: str, kb_version: int, answer, sources: list, seconds: float):
+        """Caches an answer and the sources it was based on; `seconds` is what it took to produce."""
+        self._check_version(kb_version)
+        vector = self._vector(embedding)
+        if self._index is None or self._index.d != vector.shape[1]:
+            self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self._entries.clear()
+        entry_id = next(self._ids)
+        self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+        self._entries[entry_id] = {
+            "query": query, "filters_key": filters_key, "answer": answer, "sources": sources,
+            "seconds": seconds, "expires": time.monotonic() + self.ttl,
+        }
+        if len(self._entries) > self.max_entries:
+            # Evict a tenth at a time; each removal rewrites the flat index.
+            excess = len(self._entries) - self.max_entries + max(1, self.max_entries // 10)
+            self._remove(list(itertools.islice(self._entries, excess)))
+        SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+
+    def _remove(self, entry_ids: list):
+        self._index.remove_ids(np.array(entry_ids, dtype="int64"))
+        for entry_id in entry_ids:
+            del self._entries[entry_id]
+        SEMANTIC_CACHE_ENTRIES.set(len(self._entries))
+
+
+def get_semantic_cache() -> Optional[SemanticAnswerCache]:
+    """The process-wide cache, or None when SEMANTIC_CACHE_ENABLED is off."""
+    global _semantic_cache
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        _semantic_cache = SemanticAnswerCache(
+            settings.SEMANTIC_CACHE_THRESHOLD, settings.SEMANTIC_CACHE_MAX_ENTRIES, settings.SEMANTIC_CACHE_TTL_SECONDS,
+        )
+    return _semantic_cache
@@ -0,0 +1,127 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from .config import settings
+from .embeddings import normalize_text
+from .monitoring import COALESCED_REQUESTS
+
+
+def flight_key(query: str, filters_key: str) -> str:
+    return f"{normalize_text(query)}\n{filters_key}"
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while the first caller's (the
+    leader's) call for a key is in flight, later callers await its result
+    instead of starting their own.
+
+    The call runs as its own task, so a leader whose client goes away does
+    not cancel it for the followers.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """Returns fn()'s result, and whether it came from another request's call."""
+        task = self._in_flight.get(key)
+        coalesced = task is not None and settings.CHAT_COALESCING_ENABLED
+        if coalesced:
+            COALESCED_REQUESTS.labels(endpoint=self.endpoint).inc()
+        else:
+            task = asyncio.ensure_future(fn())
+            if settings.CHAT_COALESCING_ENABLED:
+                self._in_flight[key] = task
+                task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task), coalesced
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+
+class _Broadcast:
+    """
+    One stream's chunks so far, replayed to each subscriber and then
+    followed live. `ready` resolves once the stream has started, or with
+    the error that kept it from starting.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def run(self, start: Callable[[], Awaitable[AsyncIterator[str]]]):
+        try:
+            source = await start()
+            self.ready.set_result(None)
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError as e:
+            self.ready.cancel()
+            self.error = e
+            raise
+        except Exception as e:
+            if not self.ready.done():
+                self.ready.set_exception(e)
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamFlight:
+    """
+    SingleFlight for token streams: identical concurrent requests subscribe
+    to one producer. Late subscribers first get the chunks already produced,
+    then follow the stream as it is generated.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self._in_flight: Dict[str, _Broadcast] = {}
+
+    async def open(self, key: str, start: Callable[[], Awaitable[AsyncIterator[str]]]) -> AsyncIterator[str]:
+        """
+        Returns a subscription to the stream for `key`, starting it with
+        start() unless one is in flight. Raises what start() raised, so
+        errors before the first chunk still become error responses.
+        """
+        broadcast = self._in_flight.get(key) if settings.CHAT_COALESCING_ENABLED else None
+        if broadcast is not None:
+            COALESCED_REQUESTS.labels(endpoint=self.endpoint).inc()
+        else:
+            broadcast = _Broadcast()
+            task = asyncio.ensure_future(broadcast.run(start))
+            if settings.CHAT_COALESCING_ENABLED:
+                self._in_flight[key] = broadcast
+                task.add_done_callback(lambda _: self._forget(key, broadcast))
+        await asyncio.shield(broadcast.ready)
+        return broadcast.subscribe()
+
+    def _forget(self, key: str, broadcast: _Broadcast):
+        if self._in_flight.get(key) is broadcast:
+            del self._in_flight[key]
@@ -0,0 +1,171 @@
+import logging
+import os
+import struct
+import threading
+from typing import Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"WGVF"
+# Magic, dimension and padding so that rows start 16-byte aligned.
+_HEADER = struct.Struct("<4sI8x")
+
+
+class VectorFile:
+    """
+    Full-precision float32 copy of every indexed vector, kept on disk and read
+    through a memory map.
+
+    The index may hold lossy codes (SQ8, PQ, binary); this file is what exact
+    re-scoring, index rebuilds and recall estimates read from. Rows are
+    appended in id order, so the sidecar `.ids` file is sorted and lookups are
+    a binary search.
+
+    A compacted copy is swapped in file by file behind a `.swap` marker; if
+    the process dies halfway, the writer finishes the swap when it next
+    opens the file, so the two files always come from the same copy.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.ids_path = path + ".ids"
+        self.compact_path = path + ".compact"
+        self.swap_path = path + ".swap"
+        self.read_only = read_only
+        self.dim = None
+        self._rows = 0
+        self._ids = None
+        self._vectors = None
+        self._mapped_rows = -1
+        # Searches read from worker threads while the writer appends.
+        self._map_lock = threading.Lock()
+        if not read_only and os.path.exists(self.swap_path):
+            self._finish_swap()
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the file sizes, e.g. after another process appended rows."""
+        if not os.path.exists(self.path):
+            self.dim, self._rows = None, 0
+            return
+        with open(self.path, "rb") as fh:
+            magic, dim = _HEADER.unpack(fh.read(_HEADER.size))
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path} is not a vector file.")
+        self.dim = dim
+        vector_rows = (os.path.getsize(self.path) - _HEADER.size) // (dim * 4)
+        id_rows = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+        rows = min(vector_rows, id_rows)
+        if not self.read_only and (rows != vector_rows or rows != id_rows):
+            # A crash mid-append leaves one file longer than the other.
+            logger.warning(f"Trimming torn tail of vector file {self.path} to {rows} rows.")
+            os.truncate(self.path, _HEADER.size + rows * dim * 4)
+            os.truncate(self.ids_path, rows * 8)
+        with self._map_lock:
+            self._rows = rows
+            # The file may have been swapped for a compacted copy; always remap.
+            self._mapped_rows = -1
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def max_id(self) -> int:
+        ids = self._mapped()[0]
+        return int(ids[-1]) if len(ids) else -1
+
+    def _mapped(self) -> Tuple[np.ndarray, np.ndarray]:
+        """A consistent (ids, vectors) pair of maps; callers use their lengths, not _rows."""
+        with self._map_lock:
+            rows = self._rows
+            if self._mapped_rows != rows:
+                if rows:
+                    self._ids = np.memmap(self.ids_path, dtype="int64", mode="r", shape=(rows,))
+                    self._vectors = np.memmap(
+                        self.path, dtype="float32", mode="r", offset=_HEADER.size, shape=(rows, self.dim)
+                    )
+                else:
+                    self._ids = np.empty(0, dtype="int64")
+                    self._vectors = np.empty((0, self.dim or 0), dtype="float32")
+                self._mapped_rows = rows
+            return self._ids, self._vectors
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        """Appends rows (ids must be greater than every stored id) and fsyncs."""
+        if self.read_only:
+            raise RuntimeError("Vector file is opened read-only.")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.path, "wb") as fh:
+                fh.write(_HEADER.pack(_MAGIC, self.dim))
+        for path, data in ((self.path, vectors), (self.ids_path, np.ascontiguousarray(ids, dtype="int64"))):
+            with open(path, "ab") as fh:
+                fh.write(data.tobytes())
+                fh.flush()
+                os.fsync(fh.fileno())
+        self._rows += len(ids)
+
+    def get(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (vectors, found) for the requested ids. Rows for ids that are
+        not stored are zero and flagged False in `found`.
+        """
+        ids = np.asarray(ids, dtype="int64")
+        stored_ids, vectors = self._mapped()
+        if not len(stored_ids) or not len(ids):
+            return np.zeros((len(ids), self.dim or 0), dtype="float32"), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(stored_ids, ids), len(stored_ids) - 1)
+        found = stored_ids[rows] == ids
+        out = np.asarray(vectors[rows], dtype="float32")
+        out[~found] = 0.0
+        return out, found
+
+    def read_rows(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (ids, vectors) for rows [start, stop) as memory-mapped views."""
+        stored_ids, vectors = self._mapped()
+        return stored_ids[start:stop], vectors[start:stop]
+
+    def compacted_copy(self, exclude: np.ndarray, stop: int) -> "VectorFile":
+        """
+        Writes rows [0, stop) minus the excluded ids to a sibling file and
+        returns it, so the caller can append any newer rows and then swap it
+        in with replace_with(). Blocking; run it in a worker thread.
+        """
+        copy = VectorFile(self.compact_path)
+        copy.remove_files()
+        ids, vectors = self.read_rows(0, stop)
+        block = 65536
+        for start in range(0, stop, block):
+            block_ids = np.asarray(ids[start:start + block])
+            keep = ~np.isin(block_ids, exclude)
+            if keep.any():
+                copy.append(block_ids[keep], np.asarray(vectors[start:start + block])[keep])
+        return copy
+
+    def replace_with(self, other: "VectorFile"):
+        """Swaps in the copy made by compacted_copy(). Open memory maps stay valid."""
+        if len(other):
+            # The copy is complete and fsynced by now; from here on it wins.
+            with open(self.swap_path, "wb") as fh:
+                os.fsync(fh.fileno())
+            self._finish_swap()
+        else:
+            other.remove_files()
+            self.remove_files()
+        self.refresh()
+
+    def _finish_swap(self):
+        """Moves whichever files of the compacted copy are still left into place."""
+        for src, dst in ((self.compact_path, self.path), (self.compact_path + ".ids", self.ids_path)):
+            if os.path.exists(src):
+                os.replace(src, dst)
+        os.remove(self.swap_path)
+
+    def remove_files(self):
+        for path in (self.path, self.ids_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dim, self._rows, self._mapped_rows = None, 0, -1
@@ -0,0 +1,105 @@
+import logging
+import os
+import struct
+import zlib
+from typing import Iterator, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Record layout: op (1 byte), count (uint32), dim (uint32), crc32 of payload
+# (uint32), followed by the payload: count int64 ids and count*dim float32s.
+# OP_REPLACE payloads are prefixed with the removed ids (an int64 count and
+# the ids), so a removal and its replacement vectors commit as one record.
+_HEADER = struct.Struct("<cIII")
+_COUNT = struct.Struct("<q")
+
+OP_ADD = b"A"
+OP_REPLACE = b"X"
+
+_NO_IDS = np.empty(0, dtype="int64")
+
+
+class VectorLog:
+    """
+    Append-only write-ahead log of vectors added to (and ids removed from)
+    the FAISS index.
+
+    Each batch is written as a single checksummed record and fsynced before
+    the vectors are applied to the in-memory index, so a crash loses nothing
+    that was acknowledged. The log is truncated whenever a snapshot of the
+    index has been written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = open(path, "ab")
+
+    @property
+    def size_bytes(self) -> int:
+        return self._fh.tell()
+
+    def append(self, op: bytes, ids: np.ndarray, vectors: np.ndarray, removed: np.ndarray = _NO_IDS):
+        ids = np.ascontiguousarray(ids, dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(ids), -1)
+        payload = ids.tobytes() + vectors.tobytes()
+        if op == OP_REPLACE:
+            removed = np.ascontiguousarray(removed, dtype="int64")
+            payload = _COUNT.pack(len(removed)) + removed.tobytes() + payload
+        header = _HEADER.pack(op, len(ids), vectors.shape[1], zlib.crc32(payload))
+        self._fh.write(header + payload)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def append_add(self, ids: np.ndarray, vectors: np.ndarray):
+        self.append(OP_ADD, ids, vectors)
+
+    def append_replace(self, removed: np.ndarray, ids: np.ndarray, vectors: np.ndarray):
+        self.append(OP_REPLACE, ids, vectors, removed)
+
+    def replay(self) -> Iterator[Tuple[bytes, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields (op, ids, vectors, removed_ids) for every intact record. A torn
+        or corrupt tail (e.g. from a crash mid-write) is logged and cut off.
+        """
+        good_offset = 0
+        with open(self.path, "rb") as fh:
+            while True:
+                header = fh.read(_HEADER.size)
+                if not header:
+                    break
+                if len(header) < _HEADER.size:
+                    logger.warning(f"Vector log {self.path} has a truncated record header; ignoring the tail.")
+                    break
+                op, count, dim, crc = _HEADER.unpack(header)
+                prefix = b""
+                if op == OP_REPLACE:
+                    prefix = fh.read(_COUNT.size)
+                    n_removed = _COUNT.unpack(prefix)[0] if len(prefix) == _COUNT.size else 0
+                    prefix += fh.read(max(n_removed, 0) * 8)
+                body = fh.read(count * 8 + count * dim * 4)
+                if len(body) < count * 8 + count * dim * 4 or zlib.crc32(prefix + body) != crc:
+                    logger.warning(f"Vector log {self.path} has a corrupt record at offset {good_offset}; ignoring the tail.")
+                    break
+                removed = np.frombuffer(prefix, dtype="int64", offset=_COUNT.size) if prefix else _NO_IDS
+                ids = np.frombuffer(body, dtype="int64", count=count)
+                vectors = np.frombuffer(body, dtype="float32", offset=count * 8).reshape(count, dim)
+                good_offset = fh.tell()
+                yield op, ids, vectors, removed
+
+        if good_offset != self.size_bytes:
+            self._fh.truncate(good_offset)
+            self._fh.seek(good_offset)
+
+    def reset(self):
+        """Discards every record; called once a snapshot covers them."""
+        self._fh.truncate(0)
+        self._fh.seek(0)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self):
+        self._fh.close()
@@ -1,123 +1,842 @@
 import faiss
+import itertools
 import numpy as np
 import os
-import json
 import asyncio
+import logging
+import threading
+import time
 from typing import List, Dict, Optional
 
+from .batching import MicroBatcher
+from .bm25_index import Bm25Index
 from .config import settings
-from .cache import get_redis
+from .cache import bump_kb_version, reset_cache
+from .metadata_store import get_metadata_store, reset_metadata_store
+from .faiss_index import (
+    add_vectors, bitmap_selector, build_flat_index, build_index, bytes_per_vector, deletes_in_place,
+    exclude_selector, export_flat_vectors, index_layout, is_legacy_ivf, needs_rescoring, read_index,
+    remove_ids, search_index, search_params, stored_ids, target_layout, write_index,
+)
+from .vector_file import VectorFile
+from .vector_wal import OP_ADD, OP_REPLACE, VectorLog
+
+logger = logging.getLogger(__name__)
 
 _lock = asyncio.Lock()
 _store_instance = None
+# Store versions are unique within the process, across resets too.
+_versions = itertools.count(1)
+# Sidecar holding the id counter and the ids removed since the last
+# compaction; written next to every snapshot.
+_STATE_SUFFIX = ".state.npz"
 
 class FaissVectorStore:
     def __init__(self):
         self.index_path = settings.FAISS_INDEX_PATH
+        self.state_path = self.index_path + _STATE_SUFFIX
+        self.read_only = settings.FAISS_MMAP_READONLY
         self._index = None
         self._dim = None
-        if os.path.exists(self.index_path):
-            try:
-                self._index = faiss.read_index(self.index_path)
-                self._dim = self._index.d
-            except Exception:
-                self._index = None
+        # At most one background rebuild or compaction runs at a time.
+        self._maintenance_task: Optional[asyncio.Task] = None
+        self._next_id = 0
+        self._removed = np.empty(0, dtype="int64")
+        self._tombstones = None
+        self._last_snapshot = time.time()
+        self._snapshot_signature = None
+        # Changes whenever the searchable content does, so that anything
+        # derived from search results (cached answers) can tell it is stale.
+        self.version = next(_versions)
+        # Serialises index mutations against searches running on the search
+        # executor's thread; FAISS indexes are not safe to read while written.
+        self._index_lock = threading.Lock()
+        self._searcher = MicroBatcher(
+            "faiss_search", self._run_search_batch,
+            max_batch_size=settings.SEARCH_BATCH_MAX_SIZE,
+            max_wait_ms=settings.SEARCH_BATCH_WAIT_MS,
+            # Only queries with the same nprobe / efSearch share a FAISS call.
+            group_key=lambda item: item[2:],
+        )
+        self._load_snapshot()
+        saved_next_id = self._load_state()
+        self._vectors = VectorFile(settings.FAISS_VECTORS_PATH, read_only=self.read_only)
+
+        # Read-only workers never append; the writer process owns the log.
+        self._wal = None
+        if not self.read_only:
+            self._wal = VectorLog(settings.FAISS_WAL_PATH)
+            self._backfill_vector_file()
+            replayed_removals = self._replay_log()
+            # Removing the newest ids lowers the index's max id; never reuse ids.
+            self._next_id = max(self._next_id, saved_next_id, self._vectors.max_id + 1)
+        # Ids are handed out in increasing order, so the ids searches may see
+        # are those below this bound and not in _removed. It moves together
+        # with the index, under _index_lock.
+        self._visible_next_id = self._next_id
+
+        # BM25 index over the same chunk ids. Its in-memory tail is rebuilt
+        # from the metadata store on first use (see _sync_lexical).
+        self._lexical = None
+        self._lexical_synced = self.read_only
+        self._lexical_sync_lock = asyncio.Lock()
+        if settings.BM25_ENABLED:
+            self._lexical = Bm25Index(
+                settings.BM25_INDEX_DIR, read_only=self.read_only,
+                flush_docs=settings.BM25_FLUSH_DOCS, merge_factor=settings.BM25_MERGE_FACTOR,
+            )
+            # Deletions the BM25 index had not flushed when the process died.
+            if not self.read_only and len(replayed_removals):
+                self._lexical.delete(replayed_removals)
+
+    def _backfill_vector_file(self):
+        """Seeds the full-precision vector file from indexes created before it existed."""
+        if len(self._vectors) or self._index is None or not self._index.ntotal:
+            return
+        if index_layout(self._index) != ("flat", "float32"):
+            logger.warning("Vector file is missing and the index is lossy; exact re-scoring is unavailable.")
+            return
+        vectors, ids = export_flat_vectors(self._index)
+        order = np.argsort(ids)
+        self._vectors.append(ids[order], vectors[order])
+
+    def _load_snapshot(self):
+        self._snapshot_signature = _file_signature(self.index_path)
+        if self._snapshot_signature is None:
+            return
+        try:
+            self._index = read_index(self.index_path, mmap=self.read_only)
+            self._dim = self._index.d
+        except Exception:
+            self._index = None
+        if self._index is not None and self._index.ntotal:
+            self._next_id = int(stored_ids(self._index).max()) + 1
+
+    def _load_state(self) -> int:
+        """Loads the removed-id set and returns the saved id counter (0 if none)."""
+        if not os.path.exists(self.state_path):
+            return 0
+        with np.load(self.state_path) as state:
+            self._set_removed(state["removed"].astype("int64"))
+            return int(state["next_id"])
+
+    def _write_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez(fh, next_id=np.int64(self._next_id), removed=self._removed)
+        os.replace(tmp_path, self.state_path)
+
+    def _set_removed(self, removed: np.ndarray):
+        self._removed = removed
+        self._tombstones = None
+
+    def reload_if_changed(self) -> bool:
+        """
+        Hot-swaps to the snapshot on disk if it differs from the one loaded.
+        Only meaningful for read-only workers. Snapshots are published with an
+        atomic rename, so in-flight searches keep using the old mapping until
+        they finish. Blocking; run it in a worker thread.
+        """
+        if not self.read_only:
+            return False
+        signature = _file_signature(self.index_path)
+        if signature is None or signature == self._snapshot_signature:
+            return False
+        index = read_index(self.index_path, mmap=True)
+        self._vectors.refresh()
+        get_metadata_store().refresh()
+        self._index, self._dim = index, index.d
+        self._next_id = int(stored_ids(index).max()) + 1 if index.ntotal else 0
+        self._load_state()
+        with self._index_lock:
+            self._visible_next_id = self._next_id
+        if self._lexical is not None:
+            self._lexical.reload()
+        self._snapshot_signature = signature
+        self.version = next(_versions)
+        logger.info(f"Hot-swapped to vector index snapshot {self.index_path} ({index.ntotal} vectors).")
+        return True
+
+    def _replay_log(self) -> np.ndarray:
+        """
+        Applies the vector log tail on top of the snapshot loaded from disk.
+        Returns the ids it removed, for the BM25 index to drop as well.
+        """
+        replayed = 0
+        all_removed = []
+        for op, ids, vectors, removed in self._wal.replay():
+            if op not in (OP_ADD, OP_REPLACE):
+                continue
+            # Removals are idempotent, so they are re-applied unconditionally.
+            if len(removed):
+                all_removed.append(removed)
+                if self._index is not None:
+                    self._apply_removal(removed)
+            # A crash between writing a snapshot and truncating the log leaves
+            # records the snapshot already contains; ids only ever grow.
+            fresh = ids >= self._next_id
+            if not fresh.any():
+                continue
+            if self._index is None:
+                self._init_index(vectors.shape[1])
+            # The log is written first, so the vector file may be missing the tail.
+            missing = ids > self._vectors.max_id
+            if missing.any():
+                self._vectors.append(ids[missing], vectors[missing])
+            add_vectors(self._index, vectors[fresh], ids[fresh])
+            self._next_id = int(ids.max()) + 1
+            replayed += int(fresh.sum())
+        if replayed:
+            logger.info(f"Replayed {replayed} vectors from the vector log {self._wal.path}.")
+        return np.unique(np.concatenate(all_removed)) if all_removed else np.empty(0, dtype="int64")
 
     def _init_index(self, dim: int):
-        idx = faiss.IndexFlatIP(dim)
-        self._index = faiss.IndexIDMap(idx)
+        # Every store starts flat float32; ANN layouts and lossy codecs need
+        # enough data to train on.
+        self._index = build_flat_index(dim)
         self._dim = dim
 
-    # --- THIS IS THE FIX: Make persist() a simple, synchronous function ---
+    def _maybe_schedule_maintenance(self):
+        """
+        Starts a background compaction once enough vectors have been removed,
+        or a rebuild into the configured layout once the index has grown past
+        FAISS_ANN_MIN_VECTORS. Must be called with _lock held.
+        """
+        if self._maintenance_task is not None:
+            return
+        threshold = max(settings.FAISS_COMPACT_MIN_REMOVED, settings.FAISS_COMPACT_REMOVED_RATIO * len(self._vectors))
+        if len(self._removed) and len(self._removed) >= threshold:
+            self._maintenance_task = asyncio.create_task(self._compact())
+            return
+        if is_legacy_ivf(self._index) and len(self._vectors):
+            # Re-create snapshots from before IVF indexes kept their own ids.
+            self._maintenance_task = asyncio.create_task(self._rebuild_index(index_layout(self._index)))
+            return
+        if self._index.ntotal < settings.FAISS_ANN_MIN_VECTORS:
+            return
+        layout = target_layout()
+        if index_layout(self._index) == layout:
+            return
+        self._maintenance_task = asyncio.create_task(self._rebuild_index(layout))
+
+    def _live_rows(self, start: int, stop: int, removed: np.ndarray):
+        """(ids, vectors) of vector file rows [start, stop) minus the removed ids."""
+        ids, vectors = self._vectors.read_rows(start, stop)
+        if not len(removed):
+            return ids, vectors
+        keep = ~np.isin(ids, removed)
+        return ids[keep], vectors[keep]
+
+    def _build_from_file(self, layout, rows: int, removed: np.ndarray):
+        ids, vectors = self._live_rows(0, rows, removed)
+        return build_index(layout, vectors, ids)
+
+    async def _rebuild_index(self, layout):
+        """
+        Trains and fills an index of the target layout from the full-precision
+        vector file in a worker thread while queries keep hitting the current
+        index, then swaps it in under the lock.
+        """
+        try:
+            async with _lock:
+                source = self._index
+                rows = len(self._vectors)
+                removed = self._removed
+
+            start_time = time.time()
+            new_index = await asyncio.to_thread(self._build_from_file, layout, rows, removed)
+
+            async with _lock:
+                if self._index is not source or _store_instance is not self:
+                    logger.info("Vector store changed during index rebuild; discarding the rebuilt index.")
+                    return
+                # Catch up with anything ingested or removed while the new
+                # index was being built.
+                tail_ids, tail_vectors = self._live_rows(rows, len(self._vectors), self._removed)
+                if len(tail_ids):
+                    add_vectors(new_index, tail_vectors, tail_ids)
+                removed_since = np.setdiff1d(self._removed, removed)
+                if len(removed_since):
+                    remove_ids(new_index, removed_since)
+                self._index = new_index
+                self._tombstones = None
+                await asyncio.to_thread(self.persist)
+            logger.info(
+                f"Rebuilt vector index as {layout} with {new_index.ntotal} vectors "
+                f"in {time.time() - start_time:.1f}s."
+            )
+        except Exception as e:
+            logger.exception(f"ANN index rebuild failed: {e}")
+        finally:
+            self._maintenance_task = None
+
+    async def _compact(self):
+        """
+        Drops removed vectors from the vector file, rebuilds indexes that
+        still hold them as tombstones (HNSW), and compacts the metadata store. The
+        heavy copying runs in worker threads; only the final swap holds the
+        lock.
+        """
+        try:
+            async with _lock:
+                source = self._index
+                rows = len(self._vectors)
+                removed = self._removed
+
+            start_time = time.time()
+            copy = await asyncio.to_thread(self._vectors.compacted_copy, removed, rows)
+            new_index = None
+            if not deletes_in_place(source):
+                if len(copy):
+                    copy_ids, copy_vectors = copy.read_rows(0, len(copy))
+                    new_index = await asyncio.to_thread(build_index, index_layout(source), copy_vectors, copy_ids)
+                else:
+                    new_index = build_flat_index(self._dim)
+
+            async with _lock:
+                if self._index is not source or _store_instance is not self:
+                    logger.info("Vector store changed during compaction; discarding the compacted copy.")
+                    copy.remove_files()
+                    return
+                # Rows appended since the copy started are carried over as-is;
+                # any of them removed meanwhile stay in _removed.
+                tail_ids, tail_vectors = self._vectors.read_rows(rows, len(self._vectors))
+                if len(tail_ids):
+                    copy.append(tail_ids, tail_vectors)
+                    if new_index is not None:
+                        add_vectors(new_index, tail_vectors, tail_ids)
+                self._vectors.replace_with(copy)
+                if new_index is not None:
+                    self._index = new_index
+                self._set_removed(np.setdiff1d(self._removed, removed))
+                await get_metadata_store().compact()
+                await asyncio.to_thread(self.persist)
+            logger.info(
+                f"Compacted the vector store: dropped {len(removed)} removed vectors "
+                f"in {time.time() - start_time:.1f}s."
+            )
+        except Exception as e:
+            logger.exception(f"Vector store compaction failed: {e}")
+        finally:
+            self._maintenance_task = None
+
     def persist(self):
         """
-        Synchronously writes the FAISS index to disk. This is simpler and
-        avoids asyncio/thread deadlocks with the FAISS C++ library.
+        Writes a full snapshot of the index to disk and truncates the vector
+        log it supersedes. This is blocking; callers hold _lock so that no
+        vectors are appended while the snapshot is written.
         """
+        if self.read_only:
+            return
         if self._index is not None:
-            # This is a direct, blocking call. It's fast enough.
-            faiss.write_index(self._index, self.index_path)
-    # --- END OF FIX ---
+            tmp_path = self.index_path + ".tmp"
+            write_index(self._index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+        # Written after the index: if this is lost, replaying the log (which is
+        # only reset below) restores the removed ids.
+        self._write_state()
+        if self._lexical is not None:
+            self._lexical.flush()
+        self._wal.reset()
+        self._last_snapshot = time.time()
+
+    def _snapshot_due(self) -> bool:
+        if self.read_only:
+            return False
+        pending = self._wal.size_bytes
+        if not pending:
+            return False
+        if pending >= settings.FAISS_SNAPSHOT_MAX_WAL_BYTES:
+            return True
+        return time.time() - self._last_snapshot >= settings.FAISS_SNAPSHOT_INTERVAL_SECONDS
 
     def _normalize(self, vectors: np.ndarray) -> np.ndarray:
         faiss.normalize_L2(vectors)
         return vectors
 
-    async def upsert_chunks(self, chunks: List[Dict]):
+    async def upsert_chunks(self, chunks: List[Dict], embeddings: np.ndarray):
+        """
+        Adds chunks (uuid, page_url, title, text) with their embeddings, an
+        (n, dim) array in chunk order. A contiguous float32 array is
+        L2-normalised in place and handed to FAISS without a copy.
+        """
         if not chunks: return
-        
-        redis_client = await get_redis()
-        if not redis_client:
-            raise ConnectionError("Redis is not available for vector store metadata.")
+        if self.read_only:
+            raise RuntimeError("This worker serves a read-only, memory-mapped index; ingest through a writer process.")
 
         async with _lock:
-            d = len(chunks[0]["embedding"])
-            if self._index is None: self._init_index(d)
-
-            to_add_vectors = []
-            to_add_ids = []
-            
-            async with redis_client.pipeline() as pipe:
-                for i, c in enumerate(chunks):
-                    new_id = self._index.ntotal + i
-                    metadata_key = f"meta:{new_id}"
-                    metadata_value = json.dumps({
-                        "uuid": c["uuid"],
-                        "page_url": c.get("page_url"),
-                        "title": c.get("title"),
-                        "text": c.get("text")
-                    })
-                    await pipe.set(metadata_key, metadata_value)
-                    
-                    vec = np.array(c["embedding"], dtype="float32")
-                    to_add_vectors.append(vec)
-                    to_add_ids.append(new_id)
-                
-                await pipe.execute()
-
-            if to_add_vectors:
-                vecs = np.vstack(to_add_vectors).astype("float32")
-                self._normalize(vecs)
-                ids_arr = np.array(to_add_ids, dtype="int64")
-                self._index.add_with_ids(vecs, ids_arr)
-                
-                # --- THIS IS THE FIX: Call the synchronous persist() ---
-                self.persist()
-                # --- END OF FIX ---
-
-    async def search(self, query_embedding: List[float], top_k: int = 10) -> List[Dict]:
-        if self._index is None: return []
-
-        redis_client = await get_redis()
-        if not redis_client:
-            raise ConnectionError("Redis is not available for vector search metadata.")
-
-        q = np.array([query_embedding], dtype="float32")
-        self._normalize(q)
-        D, I = self._index.search(q, top_k)
-        ids = I[0].tolist()
-        scores = D[0].tolist()
+            await self._write_chunks(chunks, embeddings)
 
-        results = []
-        
-        meta_keys = [f"meta:{int(idx)}" for idx in ids if idx != -1]
-        if not meta_keys: return []
+    async def replace_page(self, page_url: str, chunks: List[Dict], embeddings: np.ndarray):
+        """
+        Atomically swaps every chunk stored for page_url for the given chunks
+        and embeddings (which may be empty to drop the page). The removal and
+        the new vectors commit as one vector log record, so searches and crash
+        recovery see either the old page or the new one, never both or neither.
+        """
+        if self.read_only:
+            raise RuntimeError("This worker serves a read-only, memory-mapped index; ingest through a writer process.")
+
+        async with _lock:
+            metadata_store = get_metadata_store()
+            old_ids = np.array(await metadata_store.ids_for_page(page_url), dtype="int64")
+            if self._index is None:
+                # Nothing was ever indexed; any old rows are orphans.
+                await metadata_store.delete_many(old_ids.tolist())
+                await self._write_chunks(chunks, embeddings)
+                return
+            await self._write_chunks(chunks, embeddings, old_ids)
+            logger.info(f"Replaced {len(old_ids)} chunks of {page_url} with {len(chunks)} new ones.")
+
+    async def _write_chunks(self, chunks: List[Dict], embeddings: np.ndarray, removed: Optional[np.ndarray] = None):
+        """Adds chunks and removes the `removed` ids as one durable batch. Caller holds _lock."""
+        if removed is None:
+            removed = np.empty(0, dtype="int64")
+        if not chunks and not len(removed):
+            return
+        if chunks:
+            # No copy for the contiguous float32 batches the embedders return;
+            # they are normalised in place.
+            vecs = np.ascontiguousarray(embeddings, dtype="float32").reshape(len(chunks), -1)
+            if not vecs.flags.writeable:
+                vecs = vecs.copy()
+            if self._index is None:
+                self._init_index(vecs.shape[1])
+            self._normalize(vecs)
+        else:
+            vecs = np.empty((0, self._dim), dtype="float32")
+        ids_arr = np.arange(self._next_id, self._next_id + len(chunks), dtype="int64")
+
+        metadata_rows = [
+            {
+                "id": int(new_id),
+                "uuid": c["uuid"],
+                "page_url": c.get("page_url"),
+                "title": c.get("title"),
+                "text": c.get("text"),
+            }
+            for new_id, c in zip(ids_arr, chunks)
+        ]
+
+        metadata_store = get_metadata_store()
+        await self._sync_lexical()
+        # New rows go in first; old rows are only deleted once the swap has
+        # committed, so a crash never leaves the page without text.
+        if metadata_rows:
+            await metadata_store.put_many(metadata_rows)
+
+        # Write-ahead: the batch is durable before it becomes searchable.
+        await asyncio.to_thread(self._append_durable, ids_arr, vecs, removed)
+        await asyncio.to_thread(self._apply_batch, removed, ids_arr, vecs)
+        if self._lexical is not None:
+            await asyncio.to_thread(self._apply_lexical, ids_arr, [c.get("text") for c in chunks], removed)
+        self._next_id += len(ids_arr)
+        self.version = next(_versions)
+        await metadata_store.delete_many(removed.tolist())
+        # Cached answers may be built from what just changed.
+        await bump_kb_version()
+
+        if self._snapshot_due():
+            await asyncio.to_thread(self.persist)
+        self._maybe_schedule_maintenance()
+
+    def _append_durable(self, ids: np.ndarray, vectors: np.ndarray, removed: np.ndarray):
+        if len(removed):
+            self._wal.append_replace(removed, ids, vectors)
+        else:
+            self._wal.append_add(ids, vectors)
+        if len(ids):
+            self._vectors.append(ids, vectors)
+
+    def _apply_batch(self, removed: np.ndarray, ids: np.ndarray, vectors: np.ndarray):
+        # Removal and addition happen under one lock hold, so searches never
+        # see a page half-replaced.
+        with self._index_lock:
+            if len(removed):
+                self._apply_removal(removed)
+            if len(ids):
+                add_vectors(self._index, vectors, ids)
+                self._visible_next_id = int(ids.max()) + 1
+
+    def _visible(self, ids: np.ndarray) -> np.ndarray:
+        """
+        The given sorted ids minus those not (or no longer) in the index.
+        Metadata and vector file rows are written before the index swap and
+        dropped after it, so reads based on them filter through this. Caller
+        holds _index_lock.
+        """
+        ids = ids[ids < self._visible_next_id]
+        if len(self._removed):
+            ids = np.setdiff1d(ids, self._removed, assume_unique=True)
+        return ids
+
+    def _apply_lexical(self, ids: np.ndarray, texts: List[str], removed: np.ndarray):
+        if len(removed):
+            self._lexical.delete(removed)
+        if len(ids):
+            self._lexical.add(ids, texts)
+
+    async def _sync_lexical(self):
+        """
+        Re-indexes chunks the BM25 index lost with its unflushed buffer (or
+        never saw, for stores created before it) from the metadata store.
+        """
+        if self._lexical_synced or self._lexical is None:
+            return
+        async with self._lexical_sync_lock:
+            if self._lexical_synced:
+                return
+            start, stop = self._lexical.max_id + 1, self._next_id
+            if start < stop:
+                logger.info(f"Indexing chunks {start}..{stop - 1} for BM25 from the metadata store.")
+            for batch_start in range(start, stop, 1000):
+                ids = list(range(batch_start, min(batch_start + 1000, stop)))
+                # Removed chunks whose rows outlived a crash stay out.
+                removed = np.isin(ids, self._removed)
+                rows = [
+                    (i, row) for i, row, gone in zip(ids, await get_metadata_store().get_many(ids), removed)
+                    if row and not gone
+                ]
+                if rows:
+                    await asyncio.to_thread(
+                        self._lexical.add, np.array([i for i, _ in rows], dtype="int64"),
+                        [row["text"] for _, row in rows],
+                    )
+            self._lexical_synced = True
+
+    def _apply_removal(self, ids: np.ndarray):
+        """
+        Removes ids from the index. They are also recorded as removed until
+        compaction drops them from the vector file; layouts that cannot delete
+        in place (HNSW) mask them at query time meanwhile.
+        """
+        remove_ids(self._index, ids)
+        self._set_removed(np.union1d(self._removed, ids))
+
+    def _tombstone_selector(self, index):
+        """Selector hiding removed ids from an index that cannot delete them, or None when there is nothing to hide."""
+        if not len(self._removed) or deletes_in_place(index):
+            return None
+        if self._tombstones is None:
+            self._tombstones = exclude_selector(self._removed)
+        return self._tombstones
+
+    def _search_vectors(self, index, queries: np.ndarray, top_k: int, params=None):
+        """
+        Runs the FAISS search. Lossy layouts fetch FAISS_RESCORE_OVERSAMPLE
+        times more candidates and re-rank them with the exact vectors from the
+        vector file.
+        """
+        if not needs_rescoring(index) or not len(self._vectors):
+            return search_index(index, queries, top_k, params)
+        k = top_k * settings.FAISS_RESCORE_OVERSAMPLE
+        _, I = search_index(index, queries, k, params)
+        return self._rescore(queries, I, top_k)
+
+    def _rescore(self, queries: np.ndarray, candidates: np.ndarray, top_k: int):
+        n = len(queries)
+        out_D = np.full((n, top_k), -np.inf, dtype="float32")
+        out_I = np.full((n, top_k), -1, dtype="int64")
+        vectors, found = self._vectors.get(candidates.ravel())
+        vectors = vectors.reshape(n, candidates.shape[1], -1)
+        valid = (candidates >= 0) & found.reshape(candidates.shape)
+        exact = np.einsum("nkd,nd->nk", vectors, queries)
+        exact[~valid] = -np.inf
+        order = np.argsort(-exact, axis=1)[:, :top_k]
+        rows = np.arange(n)[:, None]
+        out_D[:, :order.shape[1]] = exact[rows, order]
+        out_I[:, :order.shape[1]] = np.where(np.isfinite(exact[rows, order]), candidates[rows, order], -1)
+        return out_D, out_I
+
+    def stats(self, recall_sample: int = 0, k: int = 10) -> Dict:
+        """
+        Memory footprint of the index and, when recall_sample > 0, its recall@k
+        against exact search, measured on vectors sampled from the store itself.
+        Blocking; run it in a worker thread.
+        """
+        index = self._index
+        if index is None:
+            return {"vectors": 0}
+        index_type, codec = index_layout(index)
+        full_bytes = self._dim * 4
+        # What the same vectors cost in the default flat float32 index.
+        baseline = full_bytes + 8
+        per_vector = bytes_per_vector(index)
+        # HNSW keeps removed vectors as tombstones until the next compaction.
+        live = index.ntotal if deletes_in_place(index) else index.ntotal - len(self._removed)
+        stats = {
+            "vectors": int(live),
+            "dim": int(self._dim),
+            "index_type": index_type,
+            "codec": codec,
+            "target_layout": list(target_layout()),
+            "index_bytes_per_vector": per_vector,
+            "float32_index_bytes_per_vector": baseline,
+            "compression_ratio": round(baseline / per_vector, 2),
+            "index_memory_bytes": int(per_vector * index.ntotal),
+            "vector_file_bytes": len(self._vectors) * (full_bytes + 8),
+            "rescoring": needs_rescoring(index),
+            "rescore_oversample": settings.FAISS_RESCORE_OVERSAMPLE,
+            "removed_pending_compaction": len(self._removed),
+        }
+        if recall_sample > 0 and len(self._vectors):
+            stats["recall"] = self._estimate_recall(index, recall_sample, k)
+        return stats
+
+    def _estimate_recall(self, index, sample: int, k: int) -> Dict:
+        rows = len(self._vectors)
+        removed = self._removed
+        all_ids, all_vectors = self._vectors.read_rows(0, rows)
+        live = np.flatnonzero(~np.isin(all_ids, removed)) if len(removed) else np.arange(rows)
+        if not len(live):
+            return {"k": k, "queries": 0}
+        rng = np.random.default_rng()
+        picks = np.sort(rng.choice(live, size=min(sample, len(live)), replace=False))
+        queries = np.ascontiguousarray(all_vectors[picks])
+        k = min(k, len(live))
+
+        # Exact top-k by scanning the vector file in blocks.
+        best_D = np.full((len(queries), k), -np.inf, dtype="float32")
+        best_I = np.full((len(queries), k), -1, dtype="int64")
+        block = 65536
+        for start in range(0, rows, block):
+            scores = queries @ np.asarray(all_vectors[start:start + block]).T
+            if len(removed):
+                scores[:, np.isin(all_ids[start:start + block], removed)] = -np.inf
+            ids = np.broadcast_to(all_ids[start:start + block], scores.shape)
+            merged_D = np.concatenate([best_D, scores], axis=1)
+            merged_I = np.concatenate([best_I, ids], axis=1)
+            top = np.argpartition(-merged_D, k - 1, axis=1)[:, :k]
+            best_D = np.take_along_axis(merged_D, top, axis=1)
+            best_I = np.take_along_axis(merged_I, top, axis=1)
+
+        with self._index_lock:
+            params = search_params(index, k * settings.FAISS_RESCORE_OVERSAMPLE, sel=self._tombstone_selector(index))
+            _, raw_I = search_index(index, queries, k, params)
+            _, rescored_I = self._search_vectors(index, queries, k, params)
+
+        def recall(found: np.ndarray) -> float:
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found.tolist(), best_I.tolist()))
+            return round(hits / best_I.size, 4)
+
+        return {"k": k, "queries": len(queries), "raw": recall(raw_I), "rescored": recall(rescored_I)}
+
+    def _run_search_batch(self, items: List[tuple]) -> List[tuple]:
+        """
+        Search executor callback: runs the (queries, top_k, nprobe, ef_search)
+        items of one micro-batch as a single FAISS call on the executor thread
+        and returns each item's (D, I) rows.
+        """
+        queries = np.vstack([item[0] for item in items])
+        top_k = max(item[1] for item in items)
+        nprobe, ef_search = items[0][2:]
+        with self._index_lock:
+            index = self._index
+            params = search_params(index, top_k, nprobe=nprobe, ef_search=ef_search, sel=self._tombstone_selector(index))
+            D, I = self._search_vectors(index, queries, top_k, params)
+        results, row = [], 0
+        for item_queries, item_k, _, _ in items:
+            rows = slice(row, row + len(item_queries))
+            results.append((D[rows, :item_k], I[rows, :item_k]))
+            row += len(item_queries)
+        return results
+
+    def _filtered_search(self, queries: np.ndarray, top_k: int, allowed: np.ndarray,
+                         nprobe: Optional[int], ef_search: Optional[int]):
+        """
+        Searches only the allowed ids. Small matches are scored exactly from
+        the vector file, so the work is proportional to the filter; larger
+        ones restrict the index search with a bitmap ID selector. Blocking;
+        run it in a worker thread.
+        """
+        exact = len(allowed) <= settings.FAISS_FILTER_EXACT_MAX or isinstance(self._index, faiss.IndexBinary)
+        if exact and len(self._vectors):
+            with self._index_lock:
+                allowed = self._visible(allowed)
+            if not len(allowed):
+                return (np.full((len(queries), top_k), -np.inf, dtype="float32"),
+                        np.full((len(queries), top_k), -1, dtype="int64"))
+            vectors, found = self._vectors.get(allowed)
+            return self._exact_top_k(queries, allowed, vectors, found, top_k)
+        with self._index_lock:
+            sel = bitmap_selector(self._visible(allowed))
+            params = search_params(self._index, top_k, nprobe=nprobe, ef_search=ef_search, sel=sel)
+            return self._search_vectors(self._index, queries, top_k, params)
 
-        metadata_values = await redis_client.mget(meta_keys)
+    def _exact_top_k(self, queries: np.ndarray, ids: np.ndarray, vectors: np.ndarray, valid: np.ndarray, top_k: int):
+        n = len(queries)
+        out_D = np.full((n, top_k), -np.inf, dtype="float32")
+        out_I = np.full((n, top_k), -1, dtype="int64")
+        scores = queries @ vectors.T
+        scores[:, ~valid] = -np.inf
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        out_D[:, :k] = top_scores
+        out_I[:, :k] = np.where(np.isfinite(top_scores), ids[top], -1)
+        return out_D, out_I
 
-        for i, meta_val in enumerate(metadata_values):
-            if not meta_val: continue
-            
-            meta = json.loads(meta_val)
+    async def search(self, query_embedding: List[float], top_k: int = 10,
+                     nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Returns the top_k chunks for the embedding. nprobe (IVF layouts) and
+        ef_search (HNSW) trade recall for latency on a per-query basis;
+        filters restrict the search to matching chunks (see FILTER_KEYS).
+        """
+        results = await self.search_batch(
+            np.array([query_embedding], dtype="float32"), top_k, nprobe, ef_search, filters=filters
+        )
+        return results[0]
+
+    async def search_batch(self, queries: np.ndarray, top_k: int = 10,
+                           nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                           filters: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        Searches a (n, dim) matrix of query embeddings with a single FAISS call
+        and a single metadata fetch, returning one result list per query.
+        """
+        queries = np.array(queries, dtype="float32", ndmin=2)
+        if self._index is None or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        self._normalize(queries)
+        if filters:
+            # Every filter has its own selector, so these skip the micro-batcher.
+            allowed = await get_metadata_store().select_ids(filters)
+            if not len(allowed):
+                return [[] for _ in range(len(queries))]
+            D, I = await asyncio.to_thread(self._filtered_search, queries, top_k, allowed, nprobe, ef_search)
+        else:
+            D, I = await self._searcher.run((queries, top_k, nprobe, ef_search))
+        return await self._results(D, I)
+
+    async def search_pages(self, query_embedding: List[float], page_urls: List[str], top_k: int = 10,
+                           filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Returns the top_k chunks of the given pages for the embedding, scored
+        exactly over just those pages' chunks. filters apply as in search().
+        """
+        if self._index is None or not page_urls:
+            return []
+        metadata = get_metadata_store()
+        page_ids = await asyncio.gather(*[metadata.ids_for_page(url) for url in page_urls])
+        allowed = np.unique(np.array([i for ids in page_ids for i in ids], dtype="int64"))
+        if filters and len(allowed):
+            allowed = np.intersect1d(allowed, await metadata.select_ids(filters), assume_unique=True)
+        if not len(allowed):
+            return []
+        queries = np.array([query_embedding], dtype="float32", ndmin=2)
+        self._normalize(queries)
+        D, I = await asyncio.to_thread(self._filtered_search, queries, top_k, allowed, None, None)
+        return (await self._results(D, I))[0]
+
+    async def vectors_for(self, ids: List[int]) -> np.ndarray:
+        """The stored unit vectors of the given chunk ids; zero rows for ids it has none for."""
+        vectors, _ = await asyncio.to_thread(self._vectors.get, np.asarray(ids, dtype="int64"))
+        return vectors
+
+    async def _results(self, D: np.ndarray, I: np.ndarray) -> List[List[Dict]]:
+        """Joins search hits with their chunk metadata, one result list per query row."""
+        hit_ids = sorted({int(idx) for idx in I.ravel() if idx != -1})
+        if not hit_ids:
+            return [[] for _ in range(len(I))]
+        metadata_values = await get_metadata_store().get_many(hit_ids)
+        metadata_by_id = dict(zip(hit_ids, metadata_values))
+
+        batch_results = []
+        for ids, scores in zip(I.tolist(), D.tolist()):
+            results = []
+            for idx, score in zip(ids, scores):
+                meta = metadata_by_id.get(idx)
+                if not meta: continue
+
+                results.append({
+                    "id": idx,
+                    "uuid": meta["uuid"],
+                    "page_url": meta["page_url"],
+                    "title": meta["title"],
+                    "text": meta["text"],
+                    "score": float(score),
+                })
+            batch_results.append(results)
+        return batch_results
+
+    async def lexical_search(self, query: str, top_k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """
+        Returns the top_k chunks for the query text by BM25, in the same shape
+        as search() with the BM25 score as "score". Empty if BM25 is disabled.
+        """
+        if self._lexical is None or not query:
+            return []
+        await self._sync_lexical()
+        allowed = None
+        if filters:
+            allowed = await get_metadata_store().select_ids(filters)
+            if not len(allowed):
+                return []
+        # Over-fetch a little: chunks removed since the last flush may still match.
+        ids, scores = await asyncio.to_thread(self._lexical.search, query, top_k + top_k // 2, allowed)
+        # BM25 is updated after the vector index; hide chunks it is not in step with.
+        with self._index_lock:
+            keep = np.isin(ids, self._visible(np.sort(ids)))
+        ids, scores = ids[keep], scores[keep]
+        hit_ids = ids.tolist()
+        metadata_values = await get_metadata_store().get_many(hit_ids) if hit_ids else []
+        results = []
+        for idx, score, meta in zip(hit_ids, scores.tolist(), metadata_values):
+            if not meta: continue
             results.append({
-                "id": ids[i],
+                "id": idx,
                 "uuid": meta["uuid"],
                 "page_url": meta["page_url"],
                 "title": meta["title"],
                 "text": meta["text"],
-                "score": float(scores[i]),
+                "score": float(score),
             })
-        return results
+        return results[:top_k]
+
+async def snapshot_store(force: bool = False):
+    """Writes a snapshot of the current store if one is due (or forced)."""
+    store = _store_instance
+    if store is None:
+        return
+    async with _lock:
+        if store is _store_instance and (force or store._snapshot_due()):
+            await asyncio.to_thread(store.persist)
+
+async def run_snapshot_scheduler():
+    """
+    Background loop that snapshots the index on FAISS_SNAPSHOT_INTERVAL_SECONDS
+    even when no new upserts arrive to trigger it.
+    """
+    while True:
+        await asyncio.sleep(settings.FAISS_SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await snapshot_store()
+        except Exception as e:
+            logger.exception(f"Scheduled vector store snapshot failed: {e}")
+
+async def run_reload_watcher():
+    """
+    Background loop for read-only workers that picks up snapshots published by
+    the writer process every FAISS_RELOAD_INTERVAL_SECONDS.
+    """
+    while True:
+        await asyncio.sleep(settings.FAISS_RELOAD_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(get_store().reload_if_changed)
+        except Exception as e:
+            logger.exception(f"Vector index hot-swap failed: {e}")
+
+def _file_signature(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
 
 def get_store() -> FaissVectorStore:
     global _store_instance
@@ -128,8 +847,21 @@ def get_store() -> FaissVectorStore:
 async def reset_store():
     global _store_instance
     async with _lock:
-        # We don't need to close the store instance anymore, just reset it
+        if _store_instance is not None and _store_instance._wal is not None:
+            _store_instance._wal.close()
+        if _store_instance is not None:
+            _store_instance._searcher.close()
         _store_instance = None
-        redis_client = await get_redis()
-        if redis_client:
-            await redis_client.flushdb()
\ No newline at end of file
+        if not settings.FAISS_MMAP_READONLY:
+            # Under the lock, so no snapshot is being written meanwhile.
+            index_path = settings.FAISS_INDEX_PATH
+            for path in (index_path, index_path + _STATE_SUFFIX, settings.FAISS_WAL_PATH):
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Deleted {path}")
+            VectorFile(settings.FAISS_VECTORS_PATH).remove_files()
+            Bm25Index.remove_files(settings.BM25_INDEX_DIR)
+            await get_metadata_store().clear()
+            reset_metadata_store()
+        # Also invalidates every cached answer.
+        await reset_cache()
\ No newline at end of file
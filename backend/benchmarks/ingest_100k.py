@@ -0,0 +1,123 @@
+"""
+Memory and throughput of handing chunk embeddings to the vector store, for
+a synthetic 100k-chunk ingest.
+
+Two hand-offs are compared on the same model output (random float32 rows
+standing in for encoder batches):
+
+  * lists:   each batch converted with .tolist(), stored per chunk, then
+             rebuilt with np.array per chunk and np.vstack (the old path);
+  * ndarray: batches written into one contiguous float32 array per page.
+
+The ndarray path is then ingested end to end through
+FaissVectorStore.upsert_chunks (WAL, vector file, FAISS) into a throwaway
+DATA_DIR. Run from the backend directory:
+
+    python -m benchmarks.ingest_100k --chunks 100000 --dim 384
+"""
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# The store reads its paths from settings at import time.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="ingest_bench_")
+
+from app.vectorstore_faiss_prod import get_store  # noqa: E402
+
+EMBEDDING_BATCH_SIZE = 32
+
+
+def _model_batches(n: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, EMBEDDING_BATCH_SIZE):
+        yield rng.standard_normal((min(EMBEDDING_BATCH_SIZE, n - start), dim), dtype="float32")
+
+
+def _pages(n: int, page_size: int):
+    for start in range(0, n, page_size):
+        yield start, min(page_size, n - start)
+
+
+def _via_lists(n: int, dim: int, page_size: int) -> int:
+    batches = _model_batches(n, dim)
+    total = 0
+    for _, size in _pages(n, page_size):
+        chunks = []
+        while len(chunks) < size:
+            chunks.extend({"embedding": e.astype("float32").tolist()} for e in next(batches))
+        vecs = np.vstack([np.array(c["embedding"], dtype="float32") for c in chunks]).astype("float32")
+        total += len(vecs)
+    return total
+
+
+def _via_ndarray(n: int, dim: int, page_size: int) -> int:
+    batches = _model_batches(n, dim)
+    total = 0
+    for _, size in _pages(n, page_size):
+        vecs = np.empty((size, dim), dtype="float32")
+        filled = 0
+        while filled < size:
+            batch = next(batches)
+            vecs[filled:filled + len(batch)] = batch
+            filled += len(batch)
+        total += len(np.ascontiguousarray(vecs, dtype="float32"))
+    return total
+
+
+def _measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+async def _ingest(n: int, dim: int, page_size: int) -> float:
+    store = get_store()
+    batches = _model_batches(n, dim)
+    start = time.perf_counter()
+    for first, size in _pages(n, page_size):
+        vecs = np.concatenate([next(batches) for _ in range(0, size, EMBEDDING_BATCH_SIZE)])
+        chunks = [
+            {"uuid": str(first + i), "page_url": f"https://example.com/{first}", "title": "t", "text": "x"}
+            for i in range(size)
+        ]
+        await store.upsert_chunks(chunks, vecs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--page-size", type=int, default=EMBEDDING_BATCH_SIZE * 8, help="chunks per page (per upsert)")
+    args = parser.parse_args()
+    n, dim, page = args.chunks, args.dim, args.page_size
+    raw_mb = n * dim * 4 / 2**20
+
+    print(f"{n} chunks x {dim} dims ({raw_mb:.0f} MiB of float32), {page} chunks per page")
+    print(f"{'hand-off':<10} {'seconds':>8} {'chunks/s':>10} {'peak MiB':>9}")
+    for label, fn in (("lists", _via_lists), ("ndarray", _via_ndarray)):
+        elapsed, peak = _measure(fn, n, dim, page)
+        print(f"{label:<10} {elapsed:>8.2f} {n / elapsed:>10.0f} {peak / 2**20:>9.1f}")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed = asyncio.run(_ingest(n, dim, page))
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"upsert_chunks: {elapsed:.2f} s, {n / elapsed:.0f} chunks/s, "
+        f"max RSS +{(rss_after - rss_before) / 1024:.0f} MiB (index and vector file hold {raw_mb:.0f} MiB)"
+    )
+    print(f"data written to {os.environ['DATA_DIR']}")
+
+
+if __name__ == "__main__":
+    main()
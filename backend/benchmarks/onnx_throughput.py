@@ -0,0 +1,79 @@
+"""
+Throughput and parity of the PyTorch and ONNX Runtime (fp32 and int8)
+inference backends for the embedding model and the cross-encoder.
+
+Run from the backend directory:
+
+    python -m benchmarks.onnx_throughput --texts 512 --threads 1 4
+
+Artifacts are exported to ONNX_CACHE_DIR on first use, exactly as the app
+would, so a later start with INFERENCE_BACKEND=onnx reuses them.
+"""
+import argparse
+import os
+import time
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from app import reranker
+from app.config import settings
+from app.onnx_backend import (
+    PARITY_PASSAGES, PARITY_QUERIES, OnnxCrossEncoder, OnnxSentenceEncoder, artifact_dir,
+    cross_encoder_parity, export_model, sentence_parity,
+)
+
+
+def _rate(fn, items, batch_size: int, repeats: int = 3) -> float:
+    fn(items[:batch_size])  # warm-up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(items), batch_size):
+            fn(items[i:i + batch_size])
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def _artifact(model_name: str, kind: str, quantize: bool, reference) -> str:
+    model_dir = artifact_dir(model_name, quantize)
+    if not os.path.exists(os.path.join(model_dir, "meta.json")):
+        model_dir = export_model(model_name, kind, quantize, reference)
+    return model_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=512, help="texts (and query/passage pairs) per run")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, settings.ONNX_NUM_THREADS],
+                        help="ONNX Runtime intra-op thread counts to try")
+    args = parser.parse_args()
+
+    texts = [PARITY_PASSAGES[i % len(PARITY_PASSAGES)] + f" ({i})" for i in range(args.texts)]
+    pairs = [(PARITY_QUERIES[i % len(PARITY_QUERIES)], t) for i, t in enumerate(texts)]
+
+    torch_encoder = SentenceTransformer(settings.EMBEDDING_MODEL, device="cpu")
+    torch_cross = CrossEncoder(reranker._model_name, device="cpu")
+    models = [
+        ("embedding", settings.EMBEDDING_MODEL, "sentence", torch_encoder, OnnxSentenceEncoder, sentence_parity,
+         lambda m, batch: m.encode(batch, show_progress_bar=False), texts),
+        ("cross-encoder", reranker._model_name, "cross", torch_cross, OnnxCrossEncoder, cross_encoder_parity,
+         lambda m, batch: m.predict(batch, show_progress_bar=False), pairs),
+    ]
+
+    print(f"{'model':<14} {'backend':<12} {'threads':>7} {'items/s':>9} {'speedup':>8}  parity")
+    for label, name, kind, reference, onnx_cls, parity, call, items in models:
+        baseline = _rate(lambda batch: call(reference, batch), items, args.batch_size)
+        print(f"{label:<14} {'torch':<12} {'-':>7} {baseline:>9.1f} {1.0:>7.2f}x")
+        for quantize in (False, True):
+            model_dir = _artifact(name, kind, quantize, reference)
+            for threads in args.threads:
+                settings.ONNX_NUM_THREADS = threads
+                model = onnx_cls(model_dir)
+                rate = _rate(lambda batch: call(model, batch), items, args.batch_size)
+                backend = "onnx-int8" if quantize else "onnx-fp32"
+                print(f"{label:<14} {backend:<12} {threads:>7} {rate:>9.1f} {rate / baseline:>7.2f}x  {parity(reference, model)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# The app resolves its data paths when app.config is imported: point them at
+# a scratch directory, and keep the tests away from any Redis in .env.
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="webgraph_rag_tests_")
+os.environ["REDIS_URL"] = ""
+os.environ["METADATA_BACKEND"] = "local"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
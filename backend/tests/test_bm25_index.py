@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.bm25_index import Bm25Index, decode_varints, encode_varints, tokenize
+
+
+def test_varints_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**35 + 7, 2**63 - 1], dtype="uint64")
+    data, starts = encode_varints(values)
+    np.testing.assert_array_equal(decode_varints(data), values)
+    assert starts.tolist()[:4] == [0, 1, 2, 3]
+    assert len(encode_varints(np.empty(0, dtype="uint64"))[0]) == 0
+
+
+def test_compound_tokens_match_whole_and_in_parts():
+    tokens = tokenize("Got ERR_CONN_RESET from api.example.com")
+    assert "err_conn_reset" in tokens and "conn" in tokens
+    assert "api.example.com" in tokens and "example" in tokens
+
+
+def _texts(n):
+    return [f"chunk {i} about widgets" + (" torque x-200 spec" if i % 10 == 3 else "") for i in range(n)]
+
+
+def test_segments_answer_like_the_buffer(tmp_path):
+    buffered = Bm25Index(str(tmp_path / "buffered"), flush_docs=10_000)
+    flushed = Bm25Index(str(tmp_path / "flushed"), flush_docs=7, merge_factor=2)
+    for index in (buffered, flushed):
+        index.add(np.arange(50), _texts(50))
+    flushed.flush()
+
+    for query in ("torque", "x-200 spec", "widgets chunk 17"):
+        ids_a, scores_a = buffered.search(query, 10)
+        ids_b, scores_b = flushed.search(query, 10)
+        assert ids_a.tolist() == ids_b.tolist()
+        np.testing.assert_allclose(scores_a, scores_b, rtol=1e-5)
+
+
+def test_deletes_survive_a_reopen(tmp_path):
+    path = str(tmp_path / "bm25")
+    index = Bm25Index(path, flush_docs=20)
+    index.add(np.arange(50), _texts(50))
+    index.delete(np.array([3, 13]))
+    index.flush()
+
+    reopened = Bm25Index(path)
+    ids, _ = reopened.search("torque", 10)
+    assert sorted(ids.tolist()) == [23, 33, 43]
+
+
+def test_common_terms_still_match_in_small_indexes(tmp_path):
+    index = Bm25Index(str(tmp_path / "bm25"))
+    index.add(np.arange(20), _texts(20))
+    ids, _ = index.search("widgets", 5)
+    assert len(ids) == 5
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from email.utils import formatdate
+from urllib.robotparser import RobotFileParser
+
+import pytest
+
+from app.config import settings
+from app.crawl_frontier import HostFrontier, parse_retry_after
+
+
+class FakeRobots:
+    """Stands in for RobotsCache with fixed robots.txt contents per host."""
+
+    user_agent = "WebGraphRAG"
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    async def get(self, url):
+        parser = RobotFileParser()
+        parser.parse(self.rules.get(url.split("/")[2], "").splitlines())
+        return parser
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert 50 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_token_bucket_spaces_fetches_on_a_host():
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=2, delay=0.1)
+        for i in range(3):
+            frontier.add(f"https://a.com/{i}", 0)
+        times = []
+        while True:
+            item = await frontier.next()
+            if item is None:
+                return times
+            times.append(time.monotonic())
+            frontier.done(item[0], True)
+
+    times = run(crawl())
+    assert len(times) == 3
+    assert all(b - a >= 0.08 for a, b in zip(times, times[1:]))
+
+
+def test_hosts_take_turns_and_respect_per_host_limit():
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0)
+        for url in ("https://a.com/1", "https://a.com/2", "https://b.com/1"):
+            frontier.add(url, 0)
+        first = await frontier.next()
+        second = await frontier.next()
+        return first, second
+
+    first, second = run(crawl())
+    assert {first[0], second[0]} == {"https://a.com/1", "https://b.com/1"}
+
+
+def test_add_skips_urls_seen_before():
+    frontier = HostFrontier(max_pages=10, per_host=1, delay=0)
+    assert frontier.add("https://a.com/", 0)
+    assert not frontier.add("https://a.com/", 1)
+
+
+def test_only_successes_count_toward_max_pages():
+    async def crawl():
+        frontier = HostFrontier(max_pages=3, per_host=4, delay=0)
+        for i in range(10):
+            frontier.add(f"https://a.com/bad{i}" if i % 2 else f"https://a.com/{i}", 0)
+        handed_out = []
+        while True:
+            item = await frontier.next()
+            if item is None:
+                return frontier, handed_out
+            handed_out.append(item[0])
+            frontier.done(item[0], "bad" not in item[0], 404 if "bad" in item[0] else 200)
+
+    frontier, handed_out = run(crawl())
+    assert frontier.fetched == 3
+    assert frontier.failed == len(handed_out) - 3 > 0
+
+
+def test_failure_budget_ends_the_crawl():
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0, max_failures=3)
+        for i in range(20):
+            frontier.add(f"https://a.com/{i}", 0)
+        handed_out = 0
+        while item := await frontier.next():
+            handed_out += 1
+            frontier.done(item[0], False)
+        return handed_out
+
+    assert run(crawl()) == 3
+
+
+def test_throttled_url_backs_off_and_is_retried(monkeypatch):
+    monkeypatch.setattr(settings, "CRAWL_MAX_RETRIES", 3)
+
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0)
+        frontier.add("https://a.com/", 0)
+        url, _ = await frontier.next()
+        throttled_at = time.monotonic()
+        frontier.done(url, False, 429, retry_after="0.2")
+        retried, _ = await frontier.next()
+        waited = time.monotonic() - throttled_at
+        frontier.done(retried, True, 200)
+        return frontier, retried, waited
+
+    frontier, retried, waited = run(crawl())
+    assert retried == "https://a.com/"
+    assert waited >= 0.18
+    assert (frontier.fetched, frontier.failed) == (1, 0)
+
+
+def test_throttled_url_is_given_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(settings, "CRAWL_MAX_RETRIES", 2)
+
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0)
+        frontier.add("https://a.com/", 0)
+        attempts = 0
+        while item := await frontier.next():
+            attempts += 1
+            frontier.done(item[0], False, 503, retry_after="0")
+        return frontier, attempts
+
+    frontier, attempts = run(crawl())
+    assert attempts == 3
+    assert (frontier.fetched, frontier.failed) == (0, 1)
+
+
+@pytest.mark.parametrize("rules, expected", [
+    ("User-agent: *\nDisallow: /private\n", ["https://a.com/public"]),
+    ("", ["https://a.com/private", "https://a.com/public"]),
+])
+def test_robots_disallowed_urls_are_skipped(rules, expected):
+    async def crawl():
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0, robots=FakeRobots({"a.com": rules}))
+        frontier.add("https://a.com/private", 0)
+        frontier.add("https://a.com/public", 0)
+        fetched = []
+        while item := await frontier.next():
+            fetched.append(item[0])
+            frontier.done(item[0], True)
+        return frontier, fetched
+
+    frontier, fetched = run(crawl())
+    assert fetched == expected
+    assert frontier.skipped_by_robots == 2 - len(expected)
+
+
+def test_robots_request_rate_slows_the_host():
+    async def crawl():
+        robots = FakeRobots({"a.com": "User-agent: *\nRequest-rate: 5/1\n"})
+        frontier = HostFrontier(max_pages=10, per_host=1, delay=0, robots=robots)
+        frontier.add("https://a.com/1", 0)
+        frontier.add("https://a.com/2", 0)
+        times = []
+        while item := await frontier.next():
+            times.append(time.monotonic())
+            frontier.done(item[0], True)
+        return times
+
+    first, second = run(crawl())
+    assert second - first >= 0.18
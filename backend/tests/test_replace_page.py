@@ -0,0 +1,93 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app import vectorstore_faiss_prod
+from app.config import settings
+from app.faiss_index import index_layout
+
+PAGES = 60
+CHUNKS_PER_PAGE = 10
+DIM = 32
+NLIST = 16
+
+
+def _url(page):
+    return f"https://example.com/{page}"
+
+
+def _chunks(page, tag, n=CHUNKS_PER_PAGE):
+    return [
+        {"uuid": f"{page}-{tag}-{i}", "page_url": _url(page), "title": "t", "text": f"page {page} {tag} {i}"}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def layout_settings(monkeypatch):
+    monkeypatch.setattr(settings, "BM25_ENABLED", False)
+    monkeypatch.setattr(settings, "FAISS_ANN_MIN_VECTORS", PAGES * CHUNKS_PER_PAGE)
+    monkeypatch.setattr(settings, "FAISS_IVF_NLIST", NLIST)
+    monkeypatch.setattr(settings, "FAISS_PQ_M", 8)
+    yield
+    asyncio.run(vectorstore_faiss_prod.reset_store())
+
+
+async def _built_store(rng):
+    await vectorstore_faiss_prod.reset_store()
+    store = vectorstore_faiss_prod.get_store()
+    for page in range(PAGES):
+        await store.upsert_chunks(_chunks(page, "v0"), rng.standard_normal((CHUNKS_PER_PAGE, DIM), dtype="float32"))
+    # Wait for the background rebuild into the configured layout.
+    while store._maintenance_task is not None:
+        await asyncio.sleep(0.01)
+    return store
+
+
+@pytest.mark.parametrize("index_type, codec", [
+    ("flat", "float32"),
+    ("ivf_flat", "float32"),
+    ("ivf_flat", "sq8"),
+    ("ivf_pq", "pq"),
+    ("hnsw", "float32"),
+    ("flat", "binary"),
+])
+def test_replace_page_rounds_find_the_new_chunks(layout_settings, monkeypatch, index_type, codec):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", index_type)
+    monkeypatch.setattr(settings, "FAISS_VECTOR_CODEC", codec)
+
+    async def scenario():
+        rng = np.random.default_rng(0)
+        store = await _built_store(rng)
+        assert index_layout(store._index) == (index_type, codec)
+        # IVF layouts used to lose track of their ids after the first removal
+        # and abort on the second, so every page is replaced twice.
+        for round_no in (1, 2):
+            for page in range(0, PAGES, 6):
+                tag = f"v{round_no}"
+                vectors = rng.standard_normal((CHUNKS_PER_PAGE, DIM), dtype="float32")
+                await store.replace_page(_url(page), _chunks(page, tag), vectors.copy())
+                hits = await store.search(vectors[0].tolist(), top_k=CHUNKS_PER_PAGE, nprobe=NLIST, ef_search=256)
+                assert hits[0]["uuid"] == f"{page}-{tag}-0"
+                stale = [h["uuid"] for h in hits if h["page_url"] == _url(page) and f"-{tag}-" not in h["uuid"]]
+                assert not stale
+        return store
+
+    store = asyncio.run(scenario())
+    assert store.stats()["vectors"] == PAGES * CHUNKS_PER_PAGE
+
+
+def test_replace_page_with_no_chunks_drops_the_page(layout_settings):
+    async def scenario():
+        rng = np.random.default_rng(1)
+        store = await _built_store(rng)
+        page_vectors = rng.standard_normal((CHUNKS_PER_PAGE, DIM), dtype="float32")
+        await store.replace_page(_url(0), _chunks(0, "v1"), page_vectors.copy())
+        await store.replace_page(_url(0), [], np.empty((0, 0), dtype="float32"))
+        hits = await store.search(page_vectors[0].tolist(), top_k=CHUNKS_PER_PAGE)
+        return store, hits
+
+    store, hits = asyncio.run(scenario())
+    assert all(h["page_url"] != _url(0) for h in hits)
+    assert store.stats()["vectors"] == (PAGES - 1) * CHUNKS_PER_PAGE
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from app.vector_wal import OP_ADD, OP_REPLACE, VectorLog
+
+
+def _vectors(n, dim=4, start=0.0):
+    return (np.arange(n * dim, dtype="float32") + start).reshape(n, dim)
+
+
+def _write_two_records(path):
+    log = VectorLog(path)
+    log.append_add(np.array([0, 1, 2]), _vectors(3))
+    log.append_replace(np.array([1]), np.array([3, 4]), _vectors(2, start=100.0))
+    return log
+
+
+def test_replay_returns_every_record(tmp_path):
+    path = str(tmp_path / "faiss.wal")
+    _write_two_records(path).close()
+
+    records = list(VectorLog(path).replay())
+    assert [op for op, *_ in records] == [OP_ADD, OP_REPLACE]
+    _, ids, vectors, removed = records[0]
+    assert ids.tolist() == [0, 1, 2] and not len(removed)
+    np.testing.assert_array_equal(vectors, _vectors(3))
+    _, ids, vectors, removed = records[1]
+    assert ids.tolist() == [3, 4] and removed.tolist() == [1]
+    np.testing.assert_array_equal(vectors, _vectors(2, start=100.0))
+
+
+def test_replace_with_no_new_vectors(tmp_path):
+    path = str(tmp_path / "faiss.wal")
+    log = VectorLog(path)
+    log.append_replace(np.array([5, 6]), np.empty(0, dtype="int64"), np.empty((0, 4), dtype="float32"))
+    log.close()
+
+    [(op, ids, vectors, removed)] = VectorLog(path).replay()
+    assert op == OP_REPLACE and removed.tolist() == [5, 6] and not len(ids)
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    path = str(tmp_path / "faiss.wal")
+    _write_two_records(path).close()
+    intact = os.path.getsize(path)
+    # A crash in the middle of the next append.
+    with open(path, "ab") as fh:
+        fh.write(b"A\x02\x00\x00\x00\x04\x00")
+
+    log = VectorLog(path)
+    assert len(list(log.replay())) == 2
+    assert os.path.getsize(path) == intact
+    # New records go after the last intact one.
+    log.append_add(np.array([5]), _vectors(1))
+    log.close()
+    assert [ids.tolist() for _, ids, _, _ in VectorLog(path).replay()] == [[0, 1, 2], [3, 4], [5]]
+
+
+def test_corrupt_record_drops_it_and_everything_after(tmp_path):
+    path = str(tmp_path / "faiss.wal")
+    log = VectorLog(path)
+    log.append_add(np.array([0]), _vectors(1))
+    first = log.size_bytes
+    log.append_add(np.array([1]), _vectors(1))
+    log.append_add(np.array([2]), _vectors(1))
+    log.close()
+    with open(path, "r+b") as fh:
+        fh.seek(first + 20)
+        fh.write(b"\xff")
+
+    log = VectorLog(path)
+    assert [ids.tolist() for _, ids, _, _ in log.replay()] == [[0]]
+    assert log.size_bytes == first
+
+
+def test_reset_discards_every_record(tmp_path):
+    path = str(tmp_path / "faiss.wal")
+    log = _write_two_records(path)
+    log.reset()
+    assert list(log.replay()) == []
+    assert log.size_bytes == 0